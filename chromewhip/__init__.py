@@ -1,4 +1,5 @@
 import asyncio.subprocess
+import concurrent.futures
 import logging
 import logging.config
 import platform
@@ -10,9 +11,16 @@ import time
 from aiohttp import web
 import yaml
 
+from chromewhip.admission import AdmissionController
+from chromewhip.cache import ResourceCache
 from chromewhip.chrome import Chrome
+from chromewhip.filters import load_filters
+from chromewhip.jobs import JOBS_DISK_BYTES, JobQueue, JobStore
 from chromewhip.middleware import error_middleware
+from chromewhip.pool import DEFAULT_ISOLATION, ISOLATION_LEVELS, HealthPolicy, TabPool
+from chromewhip.profiles import RELOAD_INTERVAL_S, load_profiles
 from chromewhip.routes import setup_routes
+from chromewhip.views import MAX_TIMEOUT_S
 
 
 log = logging.getLogger(__name__)
@@ -41,13 +49,40 @@ async def on_shutdown(app):
     except asyncio.TimeoutError:
         log.error('Timed out trying to shutdown Chrome gracefully!')
 
+async def on_shutdown_html_executor(app):
+    app['html-executor'].shutdown(wait=False)
+
+
+async def on_startup_tab_pool(app):
+    await app['tab-pool'].start()
+
+
+async def on_startup_job_queue(app):
+    await app['job-queue'].start()
+
+
+async def on_shutdown_job_queue(app):
+    await app['job-queue'].stop()
+
+
+async def on_startup_profiles_watcher(app):
+    app['js-profiles-watcher'] = asyncio.ensure_future(app['js-profiles'].watch(app['js-profiles-reload-interval']))
+
+
+async def on_cleanup_profiles_watcher(app):
+    app['js-profiles-watcher'].cancel()
+
 Settings = namedtuple('Settings', [
     'chrome_fp',
     'chrome_flags',
-    'should_run_xfvb'
+    'should_run_xfvb',
+    'headless'
 ])
 
-def get_settings():
+def get_settings(headless: bool = False):
+    """ How Chrome is started, with a window on an Xvfb display on Linux unless `headless`, which needs neither Xvfb
+    nor a window manager.
+    """
     chrome_flags = [
         '--window-size=1920,1080',
         '--enable-logging',
@@ -58,11 +93,13 @@ def get_settings():
         '--user-data-dir=/tmp',
         'about:blank'  # TODO: multiple tabs
     ]
+    if headless:
+        chrome_flags[:0] = ['--headless', '--disable-gpu']
     os_type = platform.system()
     if os_type == 'Linux':
-        chrome_flags.insert(3, '--no-sandbox')
+        chrome_flags.insert(chrome_flags.index('--no-first-run'), '--no-sandbox')
         chrome_fp = '/opt/google/chrome/chrome'
-        should_run_xfvb = True
+        should_run_xfvb = not headless
     elif os_type == 'Darwin':
         chrome_fp = '/Applications/Google Chrome Canary.app/Contents/MacOS/Google Chrome Canary'
         should_run_xfvb = False
@@ -71,7 +108,8 @@ def get_settings():
     return Settings(
         chrome_fp,
         chrome_flags,
-        should_run_xfvb
+        should_run_xfvb,
+        headless
     )
 
 
@@ -102,27 +140,55 @@ def setup_xvfb(settings: Settings, env: dict = None, loop: asyncio.AbstractEvent
     return xvfb
 
 
-def setup_app(loop=None, js_profiles_path=None):
+def setup_app(loop=None, js_profiles_path=None, filters_path=None, cache_path=None, cache_memory_mb=0,
+              cache_disk_mb=1024, num_tabs=NUM_TABS, admission=None, max_timeout=MAX_TIMEOUT_S,
+              slow_render_threshold=None, prettify_html=False, prettify_workers=None,
+              js_profiles_reload_interval=RELOAD_INTERVAL_S, jobs_path=None,
+              jobs_disk_mb=JOBS_DISK_BYTES // 1024 ** 2, job_workers=None, tab_isolation=DEFAULT_ISOLATION,
+              tab_health=None, spare_tabs=0, headless=False):
     app = web.Application(loop=loop, middlewares=[error_middleware])
 
-    js_profiles = {}
+    js_profiles = load_profiles(js_profiles_path) if js_profiles_path else {}
+
+    filters = load_filters(filters_path) if filters_path else {}
 
-    if js_profiles_path:
-        root, _, files, _ = next(os.fwalk(js_profiles_path))
-        js_files = filter(lambda f: os.path.splitext(f)[1] == '.js', files)
-        _, profile_name = os.path.split(root)
-        log.debug('adding profile "{}"'.format(profile_name))
-        js_profiles[profile_name] = ""
-        for f in js_files:
-            code = open(os.path.join(root, f)).read()
-            js_profiles[profile_name] += '{}\n'.format(code)
+    resource_cache = None
+    if cache_memory_mb or cache_path:
+        resource_cache = ResourceCache(max_memory_bytes=cache_memory_mb * 1024 ** 2,
+                                       path=cache_path,
+                                       max_disk_bytes=cache_disk_mb * 1024 ** 2,
+                                       loop=loop)
 
     app.on_shutdown.append(on_shutdown)
+    app.on_shutdown.append(on_shutdown_html_executor)
+    if spare_tabs:
+        app.on_startup.append(on_startup_tab_pool)
+    job_queue = None
+    if jobs_path:
+        job_queue = JobQueue(app, JobStore(jobs_path, max_disk_bytes=jobs_disk_mb * 1024 ** 2),
+                             workers=job_workers or num_tabs, loop=loop)
+        app.on_startup.append(on_startup_job_queue)
+        # stop taking jobs before the tabs go away, jobs that were running are resumed on the next start
+        app.on_shutdown.insert(0, on_shutdown_job_queue)
+    if js_profiles_path and js_profiles_reload_interval:
+        app.on_startup.append(on_startup_profiles_watcher)
+        app.on_cleanup.append(on_cleanup_profiles_watcher)
 
-    c = Chrome(host=HOST, port=PORT)
+    c = Chrome(host=HOST, port=PORT, headless=headless)
 
     app['chrome-driver'] = c
+    app['tab-pool'] = TabPool(c, size=num_tabs, isolation=tab_isolation, health=HealthPolicy(**(tab_health or {})),
+                              spare=spare_tabs)
+    app['admission-controller'] = AdmissionController(max_concurrency=num_tabs, **(admission or {}))
+    app['max-timeout'] = max_timeout
+    app['slow-render-threshold'] = slow_render_threshold
+    app['prettify-html'] = prettify_html
+    app['html-executor'] = concurrent.futures.ProcessPoolExecutor(max_workers=prettify_workers)
     app['js-profiles'] = js_profiles
+    app['js-profiles-reload-interval'] = js_profiles_reload_interval
+    app['filters'] = filters
+    app['resource-cache'] = resource_cache
+    app['job-queue'] = job_queue
 
     setup_routes(app)
 
@@ -138,19 +204,71 @@ if __name__ == '__main__':
     logging.config.dictConfig(config['logging'])
     parser = argparse.ArgumentParser()
     parser.add_argument('--js-profiles-path',
-                        help="path to a folder with javascript profiles")
+                        help="path to a folder with javascript profiles, one sub folder per profile")
+    parser.add_argument('--js-profiles-reload-interval', type=float, default=RELOAD_INTERVAL_S,
+                        help="seconds between checks for changed javascript profiles, 0 to never reload them")
+    parser.add_argument('--filters-path',
+                        help="path to a folder with Adblock Plus filter profiles, one `<name>.txt` per profile")
+    parser.add_argument('--cache-path',
+                        help="path to a folder for the shared subresource cache, which persists across restarts")
+    parser.add_argument('--cache-memory-mb', type=int, default=0,
+                        help="size of the in-memory shared subresource cache, 0 to disable")
+    parser.add_argument('--cache-disk-mb', type=int, default=1024,
+                        help="size of the on-disk shared subresource cache")
+    parser.add_argument('--jobs-path',
+                        help="path to a folder to spool render jobs and their results to, enables the jobs API")
+    parser.add_argument('--jobs-disk-mb', type=int, default=JOBS_DISK_BYTES // 1024 ** 2,
+                        help="size of the results of finished render jobs kept on disk")
+    parser.add_argument('--job-workers', type=int,
+                        help="number of render jobs run at once, defaults to the number of tabs")
+    parser.add_argument('--tab-isolation', choices=ISOLATION_LEVELS, default=DEFAULT_ISOLATION,
+                        help="how much of a render may leak into the next render on the same tab, see chromewhip.pool")
+    parser.add_argument('--spare-tabs', type=int, default=0,
+                        help="number of idle tabs kept created and warmed up ahead of renders")
+    parser.add_argument('--headless', action='store_true', default=bool(config.get('headless')),
+                        help="run Chrome headless, without Xvfb, as opposed to in a window on an Xvfb display")
+    parser.add_argument('--no-headless', action='store_false', dest='headless',
+                        help="run Chrome in a window on an Xvfb display, even if the config says headless")
+    parser.add_argument('--max-timeout', type=float, default=MAX_TIMEOUT_S,
+                        help="maximum allowed value for the timeout of a render, in seconds")
+    parser.add_argument('--slow-render-threshold', type=float,
+                        help="log the phase breakdown of renders taking at least this many seconds")
+    parser.add_argument('--prettify-html', action='store_true',
+                        help="prettify /render.html output by default, as opposed to returning the DOM as is")
+    parser.add_argument('--prettify-workers', type=int,
+                        help="number of worker processes prettifying HTML, defaults to the number of CPUs")
     args = parser.parse_args(sys.argv[1:])
     kwargs = {}
     if args.js_profiles_path:
         kwargs['js_profiles_path'] = args.js_profiles_path
+        kwargs['js_profiles_reload_interval'] = args.js_profiles_reload_interval
+    if args.filters_path:
+        kwargs['filters_path'] = args.filters_path
+    if args.cache_path:
+        kwargs['cache_path'] = args.cache_path
+        kwargs['cache_disk_mb'] = args.cache_disk_mb
+    kwargs['cache_memory_mb'] = args.cache_memory_mb
+    if args.jobs_path:
+        kwargs['jobs_path'] = args.jobs_path
+        kwargs['jobs_disk_mb'] = args.jobs_disk_mb
+        kwargs['job_workers'] = args.job_workers
+    kwargs['tab_isolation'] = args.tab_isolation
+    kwargs['spare_tabs'] = args.spare_tabs
+    kwargs['headless'] = args.headless
+    kwargs['admission'] = config.get('admission')
+    kwargs['tab_health'] = config.get('tab_health')
+    kwargs['max_timeout'] = args.max_timeout
+    kwargs['slow_render_threshold'] = args.slow_render_threshold
+    kwargs['prettify_html'] = args.prettify_html
+    kwargs['prettify_workers'] = args.prettify_workers
 
     loop = asyncio.get_event_loop()
 
-    env = {
+    settings = get_settings(headless=args.headless)
+    env = {} if settings.headless else {
        'DISPLAY': DISPLAY
     }
 
-    settings = get_settings()
     app = setup_app(**kwargs, loop=loop)
 
     if settings.should_run_xfvb:
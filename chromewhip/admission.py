@@ -0,0 +1,295 @@
+""" Admission control for the render views.
+
+Renders are admitted up to a concurrency limit, normally the size of the tab pool. Beyond that, requests
+wait in a bounded queue ordered by priority class and shared fairly between clients and hosts, and are
+rejected with `AdmissionRejected` when the queue is full, when a client already has too many requests in
+flight or when they have waited too long, so that an upstream load balancer can back off instead of timing
+out.
+"""
+import asyncio
+import collections
+import functools
+import logging
+import math
+import time
+from typing import Optional
+
+from yarl import URL
+
+from chromewhip.chrome import ChromewhipException
+from chromewhip.metrics import Counter, Histogram
+from chromewhip.timing import get_timer
+
+log = logging.getLogger('chromewhip.admission')
+
+PRIORITIES = ('high', 'normal', 'low')
+DEFAULT_PRIORITY = 'normal'
+MAX_QUEUE_SIZE = 64
+MAX_WAIT_S = 10
+API_KEY_HEADER = 'X-Api-Key'
+
+REJECTIONS = Counter('chromewhip_admission_rejections_total', 'Renders rejected with a 503, by reason', ['reason'])
+WAIT_SECONDS = Histogram('chromewhip_admission_wait_seconds', 'Time renders waited for a free tab', ['priority'])
+
+
+class AdmissionRejected(ChromewhipException):
+
+    def __init__(self, message, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """ A request's claim on a render slot.
+    """
+
+    def __init__(self, client_id, priority: str, host: str = None):
+        self.client_id = client_id
+        self.priority = priority
+        self.host = host
+        self.queued_at = time.monotonic()
+        self.started_at = None
+
+    @property
+    def wait_s(self):
+        return (self.started_at or time.monotonic()) - self.queued_at
+
+
+class _Admission:
+
+    def __init__(self, controller, client_id, priority, host):
+        self._controller = controller
+        self._client_id = client_id
+        self._priority = priority
+        self._host = host
+        self._ticket = None
+
+    async def __aenter__(self) -> Ticket:
+        self._ticket = await self._controller.acquire(self._client_id, self._priority, self._host)
+        return self._ticket
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._controller.release(self._ticket)
+
+
+class AdmissionController:
+    """ Bounded queue in front of a fixed number of render slots.
+
+    Waiting renders are admitted by priority class and, within a class, round robin across clients, so that a
+    client with a large backlog doesn't hold up the others. A client with a `weight` has that many renders
+    admitted per turn. Renders of a host, or of a client, beyond their running limits wait while others go ahead.
+
+    :param max_concurrency: number of renders running at once
+    :param max_queue_size: number of renders allowed to wait for a slot
+    :param max_wait_s: longest a render may wait for a slot
+    :param max_per_client: renders in flight or queued per client, `None` for no limit
+    :param max_running_per_client: renders running at once per client, `None` for no limit
+    :param max_per_host: renders of the same host running at once, `None` for no limit
+    :param clients: per API key settings, mapping the key to a dict with optional `priority`, `weight`,
+    `max_per_client` and `max_running_per_client` overrides
+    """
+
+    def __init__(self, max_concurrency: int, max_queue_size: int = MAX_QUEUE_SIZE, max_wait_s: float = MAX_WAIT_S,
+                 max_per_client: Optional[int] = None, max_running_per_client: Optional[int] = None,
+                 max_per_host: Optional[int] = None, clients: dict = None):
+        self._max_concurrency = max_concurrency
+        self._max_queue_size = max_queue_size
+        self._max_wait_s = max_wait_s
+        self._max_per_client = max_per_client
+        self._max_running_per_client = max_running_per_client
+        self._max_per_host = max_per_host
+        self._clients = clients or {}
+        self._running = 0
+        # per priority class, the waiters of every client in round robin order
+        self._queues = [collections.OrderedDict() for _ in PRIORITIES]
+        self._turns = {}
+        self._queued = 0
+        self._per_client = {}
+        self._running_per_client = {}
+        self._running_per_host = {}
+        # exponentially weighted average of how long a render holds a slot, for `Retry-After`
+        self._avg_hold_s = 1.0
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def queued(self):
+        return self._queued
+
+    def client_settings(self, client_id):
+        return self._clients.get(client_id, {})
+
+    def priority_for(self, client_id, requested: str = None) -> str:
+        """ A client's priority class, where a client may lower but never raise the class assigned to it.
+        """
+        assigned = self.client_settings(client_id).get('priority', DEFAULT_PRIORITY)
+        if requested in PRIORITIES and PRIORITIES.index(requested) > PRIORITIES.index(assigned):
+            return requested
+        return assigned
+
+    def retry_after(self) -> int:
+        backlog = self._queued + self._running
+        return max(1, math.ceil(self._avg_hold_s * backlog / max(self._max_concurrency, 1)))
+
+    def _reject(self, message, reason):
+        REJECTIONS.labels(reason).inc()
+        retry_after = self.retry_after()
+        log.warning('%s, asking client to retry after %ss' % (message, retry_after))
+        raise AdmissionRejected(message, retry_after)
+
+    @staticmethod
+    def _decrement(counts: dict, key):
+        count = counts.get(key, 0) - 1
+        if count > 0:
+            counts[key] = count
+        else:
+            counts.pop(key, None)
+
+    def _forget_client(self, client_id):
+        self._decrement(self._per_client, client_id)
+
+    def _client_can_start(self, client_id) -> bool:
+        limit = self.client_settings(client_id).get('max_running_per_client', self._max_running_per_client)
+        return limit is None or self._running_per_client.get(client_id, 0) < limit
+
+    def _host_can_start(self, host) -> bool:
+        return host is None or self._max_per_host is None or self._running_per_host.get(host, 0) < self._max_per_host
+
+    def _start(self, ticket: Ticket):
+        self._running += 1
+        self._running_per_client[ticket.client_id] = self._running_per_client.get(ticket.client_id, 0) + 1
+        if ticket.host is not None:
+            self._running_per_host[ticket.host] = self._running_per_host.get(ticket.host, 0) + 1
+
+    async def acquire(self, client_id=None, priority: str = DEFAULT_PRIORITY, host: str = None) -> Ticket:
+        max_per_client = self.client_settings(client_id).get('max_per_client', self._max_per_client)
+        in_flight = self._per_client.get(client_id, 0)
+        if max_per_client is not None and in_flight >= max_per_client:
+            self._reject('Client has %s renders in flight, the limit is %s' % (in_flight, max_per_client),
+                         'client_limit')
+
+        ticket = Ticket(client_id, priority, host)
+        # every waiter that could start has been started already, so a render that can start doesn't jump the queue
+        if self._running < self._max_concurrency and self._client_can_start(client_id) and self._host_can_start(host):
+            self._start(ticket)
+            self._per_client[client_id] = in_flight + 1
+            ticket.started_at = time.monotonic()
+            return ticket
+
+        if self._queued >= self._max_queue_size:
+            self._reject('Render queue is full', 'queue_full')
+
+        waiter = asyncio.Future()
+        waiters = self._queues[PRIORITIES.index(priority)].setdefault(client_id, collections.deque())
+        waiters.append((waiter, ticket))
+        self._queued += 1
+        self._per_client[client_id] = in_flight + 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self._max_wait_s)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just as we gave up on it
+                ticket.started_at = time.monotonic()
+                self.release(ticket)
+            else:
+                waiter.cancel()
+                self._dequeue(PRIORITIES.index(priority), client_id, (waiter, ticket))
+                self._queued -= 1
+                self._forget_client(client_id)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject('Timed out after %ss waiting for a free tab' % self._max_wait_s, 'wait_timeout')
+            raise
+        ticket.started_at = time.monotonic()
+        return ticket
+
+    def release(self, ticket: Ticket):
+        held_s = time.monotonic() - ticket.started_at
+        self._avg_hold_s = 0.8 * self._avg_hold_s + 0.2 * held_s
+        self._running -= 1
+        self._decrement(self._running_per_client, ticket.client_id)
+        if ticket.host is not None:
+            self._decrement(self._running_per_host, ticket.host)
+        self._forget_client(ticket.client_id)
+        self._wake_next()
+
+    def _dequeue(self, priority_index: int, client_id, entry):
+        clients = self._queues[priority_index]
+        waiters = clients[client_id]
+        waiters.remove(entry)
+        if not waiters:
+            del clients[client_id]
+            self._turns.pop((priority_index, client_id), None)
+
+    def _next_waiter(self):
+        """ The first waiter that can start, by priority class then round robin across clients, taking the client's
+        turn.
+        """
+        for priority_index, clients in enumerate(self._queues):
+            for client_id, waiters in list(clients.items()):
+                if not self._client_can_start(client_id):
+                    continue
+                entry = next((e for e in waiters if self._host_can_start(e[1].host)), None)
+                if entry is None:
+                    continue
+                key = (priority_index, client_id)
+                turns = self._turns.get(key, self.client_settings(client_id).get('weight', 1)) - 1
+                self._dequeue(priority_index, client_id, entry)
+                if client_id in clients:
+                    if turns > 0:
+                        self._turns[key] = turns
+                    else:
+                        self._turns.pop(key, None)
+                        clients.move_to_end(client_id)
+                return entry
+        return None
+
+    def _wake_next(self):
+        while self._running < self._max_concurrency:
+            entry = self._next_waiter()
+            if entry is None:
+                return
+            waiter, ticket = entry
+            self._queued -= 1
+            self._start(ticket)
+            waiter.set_result(None)
+
+    def admit(self, client_id=None, priority: str = DEFAULT_PRIORITY, host: str = None):
+        """ Async context manager holding a render slot for its duration.
+        """
+        return _Admission(self, client_id, priority, host)
+
+
+def client_id_for(request) -> str:
+    """ Requests are attributed to their API key if provided, otherwise to the address they came from.
+    """
+    api_key = request.headers.get(API_KEY_HEADER) or request.query.get('api_key')
+    if api_key:
+        return api_key
+    peername = request.transport.get_extra_info('peername') if request.transport else None
+    return peername[0] if peername else 'unknown'
+
+
+def host_for(request) -> Optional[str]:
+    """ The host a render loads its page from, if it has a `url`.
+    """
+    try:
+        return URL(request.query.get('url', '')).host
+    except ValueError:
+        return None
+
+
+def admission_controlled(handler):
+    """ Decorator for views that hold a render slot while they run.
+    """
+    @functools.wraps(handler)
+    async def wrapper(request):
+        controller = request.app['admission-controller']
+        client_id = client_id_for(request)
+        priority = controller.priority_for(client_id, request.query.get('priority'))
+        async with controller.admit(client_id, priority, host_for(request)) as ticket:
+            WAIT_SECONDS.labels(priority).observe(ticket.wait_s)
+            get_timer(request).record('queue', ticket.wait_s)
+            return await handler(request)
+    return wrapper
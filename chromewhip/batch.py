@@ -0,0 +1,152 @@
+""" Batch rendering, many renders requested with a single HTTP request.
+
+`POST /render.batch` takes a JSON object with a list of `renders`, each the query params of a render plus its
+`endpoint` and an optional `id`, and streams back one JSON line per render as soon as it completes. Every
+render goes through the same view, admission control and error handling as the equivalent `GET` request,
+so each line holds the response that request would have had.
+"""
+import asyncio
+import base64
+import json
+import logging
+
+from aiohttp import web
+from multidict import CIMultiDict
+from yarl import URL
+
+from chromewhip.middleware import error_middleware
+from chromewhip.views import render_extract, render_html, render_links, render_png, render_txt
+
+log = logging.getLogger('chromewhip.batch')
+
+ENDPOINTS = {
+    'html': ('/render.html', render_html),
+    'png': ('/render.png', render_png),
+    'txt': ('/render.txt', render_txt),
+    'links': ('/render.links', render_links),
+    'extract': ('/render.extract', render_extract),
+}
+DEFAULT_ENDPOINT = 'html'
+MAX_BATCH_SIZE = 1000
+CONTENT_TYPE = 'application/x-ndjson'
+
+
+class RenderRequest(dict):
+    """ Stand-in for the `GET` request of a render made on behalf of another request, or of no request at all,
+    with its own query and state.
+
+    A request can't be cloned once its body has been read, so this only provides what the views use.
+    """
+
+    def __init__(self, app: web.Application, path: str, params: dict, headers=None, transport=None):
+        super().__init__()
+        self.app = app
+        self.headers = CIMultiDict(headers or {})
+        self.transport = transport
+        self.method = 'GET'
+        self.rel_url = URL(path).with_query(params)
+        self.path = self.rel_url.path
+        self.query = self.rel_url.query
+        self.query_string = self.rel_url.query_string
+
+
+def parse_render_spec(spec: dict):
+    """ Split a render spec into its endpoint and its query params.
+    """
+    params = dict(spec)
+    endpoint = params.pop('endpoint', DEFAULT_ENDPOINT)
+    if endpoint not in ENDPOINTS:
+        raise web.HTTPBadRequest(reason='endpoint must be one of %s' % ', '.join(sorted(ENDPOINTS)))
+    return endpoint, {k: str(v) for k, v in params.items()}
+
+
+def _get_renders(body, max_concurrency: int):
+    if not isinstance(body, dict) or not isinstance(body.get('renders'), list) or not body['renders']:
+        raise web.HTTPBadRequest(reason='body must be a JSON object with a non empty list of renders')
+    renders = body['renders']
+    if len(renders) > MAX_BATCH_SIZE:
+        raise web.HTTPBadRequest(reason='a batch can have at most %s renders' % MAX_BATCH_SIZE)
+
+    specs = []
+    for i, render in enumerate(renders):
+        if not isinstance(render, dict):
+            raise web.HTTPBadRequest(reason='render %s is not a JSON object' % i)
+        params = dict(render)
+        render_id = params.pop('id', i)
+        endpoint, params = parse_render_spec(params)
+        specs.append((render_id, endpoint, params))
+    if len({render_id for render_id, _, _ in specs}) != len(specs):
+        raise web.HTTPBadRequest(reason='render ids must be unique')
+
+    try:
+        concurrency = int(body.get('concurrency', max_concurrency))
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(reason='concurrency must be a number')
+    if concurrency < 1:
+        raise web.HTTPBadRequest(reason='concurrency must be at least 1')
+    return specs, min(concurrency, max_concurrency)
+
+
+def _to_result(render_id, response: web.Response) -> dict:
+    result = {
+        'id': render_id,
+        'status': response.status,
+        'content_type': response.content_type,
+        'headers': {k: v for k, v in response.headers.items() if k.lower() != 'content-type'},
+    }
+    body = response.body or b''
+    if response.content_type.startswith('text/') or response.content_type == 'application/json':
+        result['body'] = body.decode(response.charset or 'utf-8')
+    else:
+        result['body_base64'] = base64.b64encode(body).decode('ascii')
+    return result
+
+
+async def render_view(app: web.Application, path: str, view, params: dict, headers=None,
+                      transport=None) -> web.Response:
+    """ Run the render `view` of `path` with the query `params`, returning the response of the equivalent `GET`.
+    """
+    handler = await error_middleware(app, view)
+    return await handler(RenderRequest(app, path, params, headers, transport))
+
+
+async def render_response(app: web.Application, endpoint: str, params: dict, headers=None,
+                          transport=None) -> web.Response:
+    """ Run a render of `endpoint` with the query `params`, returning the response of the equivalent `GET`.
+    """
+    path, view = ENDPOINTS[endpoint]
+    return await render_view(app, path, view, params, headers, transport)
+
+
+async def _render_one(request: web.Request, render_id, endpoint: str, params: dict) -> dict:
+    response = await render_response(request.app, endpoint, params, request.headers, request.transport)
+    return _to_result(render_id, response)
+
+
+async def render_batch(request: web.Request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(reason='body must be JSON')
+    specs, concurrency = _get_renders(body, request.app['tab-pool'].size)
+    log.debug('rendering batch of %s with a concurrency of %s' % (len(specs), concurrency))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(spec):
+        async with semaphore:
+            return await _render_one(request, *spec)
+
+    response = web.StreamResponse(headers={'Content-Type': CONTENT_TYPE})
+    await response.prepare(request)
+    futures = [asyncio.ensure_future(run(spec)) for spec in specs]
+    try:
+        for future in asyncio.as_completed(futures):
+            result = await future
+            await response.write(json.dumps(result).encode('utf-8') + b'\n')
+    finally:
+        # when the client went away, nobody is waiting for the remaining renders any more
+        for future in futures:
+            future.cancel()
+    await response.write_eof()
+    return response
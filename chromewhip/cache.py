@@ -0,0 +1,347 @@
+""" A chromewhip side cache of static subresources, shared by every tab.
+
+Bodies are content addressed, so the same bundle served from several URLs is only stored once. Entries live
+in a size bounded in-memory LRU and, when a cache path is given, in a size bounded folder on disk, which
+survives browser contexts being disposed and Chrome being restarted.
+
+Only responses that explicitly allow caching through `Cache-Control` or `Expires` are stored, and they are
+served only while fresh.
+"""
+import asyncio
+import base64
+import functools
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from http.client import responses as HTTP_REASONS
+from typing import Optional
+
+from chromewhip.interception import is_response_stage
+from chromewhip.metrics import Counter
+from chromewhip.protocol import network
+
+log = logging.getLogger('chromewhip.cache')
+
+CACHE_MEMORY_BYTES = 128 * 1024 ** 2
+CACHE_DISK_BYTES = 1024 * 1024 ** 2
+# entries kept in memory, looked up on disk once evicted when there is a cache path
+CACHE_MEMORY_ENTRIES = 10000
+CACHEABLE_RESOURCE_TYPES = {'Script', 'Stylesheet', 'Font', 'Image'}
+CACHEABLE_STATUS_CODES = {200, 203}
+# headers that no longer describe the body once it has been decoded by Chrome
+DROPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection', 'keep-alive'}
+
+CACHE_OPERATIONS = Counter('chromewhip_resource_cache_operations_total',
+                           'Shared subresource cache lookups and writes, by result', ['result'])
+
+
+def _lower_headers(headers: dict) -> dict:
+    return {k.lower(): v for k, v in (headers or {}).items()}
+
+
+def freshness_lifetime(headers: dict, now: float = None, authorized: bool = False) -> Optional[float]:
+    """ Seconds a response may be served from a shared cache, or `None` if it must not be stored. Responses to
+    `authorized` requests, those with an `Authorization` header, are only stored when explicitly `public`.
+    """
+    headers = _lower_headers(headers)
+    now = time.time() if now is None else now
+    directives = {}
+    for part in headers.get('cache-control', '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    if {'no-store', 'no-cache', 'private'} & set(directives):
+        return None
+    # https://tools.ietf.org/html/rfc7234#section-3.2
+    if authorized and 'public' not in directives:
+        return None
+    if 'set-cookie' in headers:
+        return None
+    vary = {v.strip().lower() for v in headers.get('vary', '').split(',') if v.strip()}
+    if vary - {'accept-encoding'}:
+        return None
+    for directive in ('s-maxage', 'max-age'):
+        if directive in directives:
+            try:
+                lifetime = float(directives[directive])
+            except ValueError:
+                return None
+            break
+    else:
+        try:
+            expires = parsedate_to_datetime(headers['expires']).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return None
+        lifetime = expires - now
+    try:
+        lifetime -= float(headers.get('age', 0))
+    except ValueError:
+        pass
+    return lifetime if lifetime > 0 else None
+
+
+class CacheEntry:
+
+    def __init__(self, url: str, digest: str, status: int, headers: dict, expires_at: float, size: int):
+        self.url = url
+        self.digest = digest
+        self.status = status
+        self.headers = headers
+        self.expires_at = expires_at
+        self.size = size
+
+    @property
+    def is_fresh(self):
+        return self.expires_at > time.time()
+
+    def to_dict(self):
+        return self.__dict__
+
+
+class ResourceCache:
+    """ Content addressed cache of subresource bodies, bounded both in memory and on disk.
+    """
+
+    def __init__(self, max_memory_bytes: int = CACHE_MEMORY_BYTES, path: str = None,
+                 max_disk_bytes: int = CACHE_DISK_BYTES, loop: asyncio.AbstractEventLoop = None,
+                 max_memory_entries: int = CACHE_MEMORY_ENTRIES):
+        self._max_memory_bytes = max_memory_bytes
+        self._max_memory_entries = max_memory_entries
+        self._max_disk_bytes = max_disk_bytes
+        self._path = path
+        self._loop = loop
+        self._entries = OrderedDict()
+        self._bodies = OrderedDict()
+        self._memory_bytes = 0
+        # only updated on the loop thread, with disk writes and evictions done one at a time
+        self._disk_bytes = 0
+        self._disk_lock = asyncio.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        if path:
+            os.makedirs(os.path.join(path, 'objects'), exist_ok=True)
+            os.makedirs(os.path.join(path, 'entries'), exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    def _count(self, stat):
+        self.stats[stat] += 1
+        CACHE_OPERATIONS.labels(stat).inc()
+
+    @property
+    def memory_bytes(self):
+        return self._memory_bytes
+
+    @property
+    def disk_bytes(self):
+        return self._disk_bytes
+
+    async def _run(self, fn, *args):
+        loop = self._loop or asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(fn, *args))
+
+    # disk layout: `objects/<2 char prefix>/<sha256 of body>` and `entries/<sha256 of url>.json`
+    def _object_fp(self, digest):
+        return os.path.join(self._path, 'objects', digest[:2], digest)
+
+    def _entry_fp(self, url):
+        return os.path.join(self._path, 'entries', '%s.json' % hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def _read_entry(self, url) -> Optional[CacheEntry]:
+        try:
+            with open(self._entry_fp(url)) as f:
+                return CacheEntry(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _read_body(self, digest) -> Optional[bytes]:
+        fp = self._object_fp(digest)
+        try:
+            with open(fp, 'rb') as f:
+                body = f.read()
+            os.utime(fp)  # mtime doubles as last access time for eviction
+            return body
+        except OSError:
+            return None
+
+    def _write(self, entry: CacheEntry, body: bytes) -> int:
+        """ Write `entry` and its body unless already on disk, returning the bytes added to the cache folder.
+        """
+        added = 0
+        fp = self._object_fp(entry.digest)
+        if not os.path.exists(fp):
+            os.makedirs(os.path.dirname(fp), exist_ok=True)
+            tmp_fp = '%s.tmp' % fp
+            with open(tmp_fp, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_fp, fp)
+            added += len(body)
+        entry_fp = self._entry_fp(entry.url)
+        try:
+            added -= os.path.getsize(entry_fp)
+        except OSError:
+            pass
+        with open(entry_fp, 'w') as f:
+            json.dump(entry.to_dict(), f)
+        added += os.path.getsize(entry_fp)
+        return added
+
+    def _disk_files(self):
+        """ (last access time, size, path) of every object and entry file in the cache folder.
+        """
+        files = []
+        for folder in ('objects', 'entries'):
+            for root, _, fns in os.walk(os.path.join(self._path, folder)):
+                for fn in fns:
+                    fp = os.path.join(root, fn)
+                    try:
+                        st = os.stat(fp)
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, fp))
+        return files
+
+    def _evict_disk(self, excess: int):
+        """ Remove the least recently used objects and entries until at least `excess` bytes are freed, returning
+        the bytes freed and the number of files removed.
+        """
+        freed = removed = 0
+        for _, size, fp in sorted(self._disk_files()):
+            if freed >= excess:
+                break
+            try:
+                os.remove(fp)
+            except OSError:
+                continue
+            freed += size
+            removed += 1
+        return freed, removed
+
+    async def _store(self, entry: CacheEntry, body: bytes):
+        async with self._disk_lock:
+            self._disk_bytes += await self._run(self._write, entry, body)
+            if self._disk_bytes > self._max_disk_bytes:
+                freed, removed = await self._run(self._evict_disk, self._disk_bytes - self._max_disk_bytes * 0.9)
+                self._disk_bytes -= freed
+                for _ in range(removed):
+                    self._count('evictions')
+
+    def _remember_entry(self, entry: CacheEntry):
+        self._entries[entry.url] = entry
+        self._entries.move_to_end(entry.url)
+        while len(self._entries) > self._max_memory_entries:
+            self._entries.popitem(last=False)
+
+    def _remember(self, entry: CacheEntry, body: bytes):
+        if entry.digest in self._bodies:
+            self._remember_entry(entry)
+            self._bodies.move_to_end(entry.digest)
+            return
+        if len(body) > self._max_memory_bytes:
+            if self._path:
+                self._remember_entry(entry)
+            return
+        self._remember_entry(entry)
+        self._bodies[entry.digest] = body
+        self._memory_bytes += len(body)
+        while self._memory_bytes > self._max_memory_bytes:
+            _, evicted = self._bodies.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self._count('evictions')
+
+    async def get(self, url: str):
+        """ The fresh entry and body cached for `url`, or `None`.
+        """
+        entry = self._entries.get(url)
+        if entry is None and self._path:
+            entry = await self._run(self._read_entry, url)
+        if entry is None or not entry.is_fresh:
+            self._entries.pop(url, None)
+            self._count('misses')
+            return None
+        body = self._bodies.get(entry.digest)
+        if body is not None:
+            self._bodies.move_to_end(entry.digest)
+        elif self._path:
+            body = await self._run(self._read_body, entry.digest)
+        if body is None:
+            self._entries.pop(url, None)
+            self._count('misses')
+            return None
+        self._remember(entry, body)
+        self._count('hits')
+        return entry, body
+
+    async def put(self, url: str, status: int, headers: dict, body: bytes,
+                  authorized: bool = False) -> Optional[CacheEntry]:
+        lifetime = freshness_lifetime(headers, authorized=authorized)
+        if status not in CACHEABLE_STATUS_CODES or lifetime is None:
+            return None
+        headers = {k: v for k, v in headers.items() if k.lower() not in DROPPED_HEADERS}
+        entry = CacheEntry(url, hashlib.sha256(body).hexdigest(), status, headers, time.time() + lifetime, len(body))
+        self._remember(entry, body)
+        if self._path:
+            await self._store(entry, body)
+        self._count('stores')
+        return entry
+
+
+def build_raw_response(entry: CacheEntry, body: bytes) -> str:
+    """ Base64 encoded HTTP response, as expected by `Network.continueInterceptedRequest(rawResponse=...)`.
+    """
+    lines = ['HTTP/1.1 %s %s' % (entry.status, HTTP_REASONS.get(entry.status, ''))]
+    # Chrome joins the values of headers sent several times, such as `Link`, with new lines
+    lines.extend('%s: %s' % (k, value) for k, v in entry.headers.items() for value in v.split('\n'))
+    lines.append('Content-Length: %s' % len(body))
+    head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1', errors='replace')
+    return base64.b64encode(head + body).decode('ascii')
+
+
+class ResourceCacheHandler:
+    """ Interception handler serving cacheable subresources from a `ResourceCache`.
+
+    Requests are looked up when intercepted before being sent, and responses are stored when intercepted
+    once their headers have been received.
+    """
+
+    def __init__(self, tab, cache: ResourceCache, resource_types: set = None):
+        self._tab = tab
+        self._cache = cache
+        self._resource_types = resource_types or CACHEABLE_RESOURCE_TYPES
+
+    @property
+    def patterns(self):
+        return [{'urlPattern': '*', 'resourceType': t, 'interceptionStage': stage}
+                for t in sorted(self._resource_types) for stage in ('Request', 'HeadersReceived')]
+
+    async def __call__(self, event: network.RequestInterceptedEvent):
+        if event.resourceType not in self._resource_types or event.request.method != 'GET':
+            return None
+        if not is_response_stage(event):
+            return await self._on_request(event)
+        if event.responseStatusCode in CACHEABLE_STATUS_CODES:
+            await self._on_response(event)
+        return None
+
+    async def _on_request(self, event):
+        cached = await self._cache.get(event.request.url)
+        if cached is None:
+            return None
+        entry, body = cached
+        log.debug('serving "%s" from cache' % event.request.url)
+        return network.Network.continueInterceptedRequest(interceptionId=event.interceptionId,
+                                                          rawResponse=build_raw_response(entry, body))
+
+    async def _on_response(self, event):
+        headers = event.responseHeaders or {}
+        authorized = any(k.lower() == 'authorization' for k in event.request.headers or {})
+        if freshness_lifetime(headers, authorized=authorized) is None:
+            return
+        result = await self._tab.send_command(
+            network.Network.getResponseBodyForInterception(interceptionId=event.interceptionId))
+        payload = result['ack']['result']
+        body = payload['body']
+        body = base64.b64decode(body) if payload['base64Encoded'] else body.encode('utf-8')
+        await self._cache.put(event.request.url, event.responseStatusCode, headers, body, authorized=authorized)
@@ -1,7 +1,10 @@
 import asyncio
 import base64
+import contextlib
+import importlib
 import json
 import logging
+import time
 from typing import Optional
 
 import aiohttp
@@ -10,12 +13,107 @@ import websockets.protocol
 
 from chromewhip import helpers
 from chromewhip.base import SyncAdder
-from chromewhip.protocol import page, runtime, target, input, inspector, browser, accessibility
+from chromewhip.metrics import Counter, Histogram
+from chromewhip.protocol import page, runtime, target, input, inspector, browser, accessibility, network, emulation, \
+    storage, memory, performance
 
 TIMEOUT_S = 25
+# extra time given to the ack of a command waiting in the page, on top of the wait itself
+WAIT_MARGIN_S = 5
 MAX_PAYLOAD_SIZE_BYTES = 2 ** 23
 MAX_PAYLOAD_SIZE_MB = MAX_PAYLOAD_SIZE_BYTES / 1024 ** 2
 
+COMMANDS = Counter('chromewhip_devtools_commands_total',
+                   'Devtools commands sent, by method and outcome', ['method', 'outcome'])
+COMMAND_SECONDS = Histogram('chromewhip_devtools_command_duration_seconds',
+                            'Time from sending a devtools command until its ack and awaited event', ['method'])
+EVENTS = Counter('chromewhip_devtools_events_total', 'Devtools events received, by event', ['event'])
+WEBSOCKET_BYTES = Counter('chromewhip_devtools_websocket_bytes_total',
+                          'Size of devtools messages sent and received, in bytes of UTF-8 encoded JSON',
+                          ['direction'])
+
+# object group of the remote objects returned by `ChromeTab.evaluate`, released by `ChromeTab.reset`
+OBJECT_GROUP = 'chromewhip'
+# emulation settings a reset tab returns to; device metrics are kept, as every render sets its own viewport
+DEFAULT_STATE = {'blocked_urls': [], 'user_agent': None, 'extra_headers': None, 'script_execution_disabled': None}
+
+CENTRE_OF_JS = """
+(() => {
+    const element = document.querySelector(%s);
+    if (!element) { return null; }
+    element.scrollIntoView({block: 'center', inline: 'center'});
+    const rect = element.getBoundingClientRect();
+    return {x: rect.left + rect.width / 2, y: rect.top + rect.height / 2};
+})()
+"""
+FOCUS_JS = """
+(() => {
+    const element = document.querySelector(%s);
+    if (!element) { return false; }
+    element.focus();
+    return true;
+})()
+"""
+# `specs` maps names to `{selector, attribute, html, all}`, each extracting the attribute, outer html or text of
+# the first, or every, element matching its selector
+EXTRACT_JS = """
+((specs) => {
+    const valueOf = (element, spec) => spec.attribute ? element.getAttribute(spec.attribute)
+        : spec.html ? element.outerHTML : element.textContent.trim();
+    const results = {};
+    for (const [name, spec] of Object.entries(specs)) {
+        const values = Array.from(document.querySelectorAll(spec.selector), (e) => valueOf(e, spec));
+        results[name] = spec.all ? values : (values.length ? values[0] : null);
+    }
+    return results;
+})(%s)
+"""
+# absolute http(s) URLs of the links of the page without their fragment, deduplicated in document order
+LINKS_JS = """
+((sameOrigin) => {
+    const links = new Set();
+    for (const a of document.querySelectorAll('a[href], area[href]')) {
+        let url;
+        try { url = new URL(a.getAttribute('href'), document.baseURI); } catch (e) { continue; }
+        if (!['http:', 'https:'].includes(url.protocol) || (sameOrigin && url.origin !== location.origin)) {
+            continue;
+        }
+        url.hash = '';
+        links.add(url.href);
+    }
+    return Array.from(links);
+})(%s)
+"""
+
+# resolves with whether `predicate` became truthy, re-checking it on DOM mutations and, as not every change
+# is a mutation, every `POLL_MS`, for at most `timeoutMs`
+WAIT_FOR_JS = """
+new Promise((resolve) => {
+    const POLL_MS = 100;
+    const predicate = %s;
+    const timeoutMs = %s;
+    const check = () => { try { return !!predicate(); } catch (e) { return false; } };
+    if (check()) { return resolve(true); }
+    let observer, poller, timer;
+    const done = (result) => {
+        observer.disconnect();
+        clearInterval(poller);
+        clearTimeout(timer);
+        resolve(result);
+    };
+    observer = new MutationObserver(() => { if (check()) { done(true); } });
+    observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    poller = setInterval(() => { if (check()) { done(true); } }, POLL_MS);
+    timer = setTimeout(() => done(false), timeoutMs);
+})
+"""
+
+
+def _utf8_len(msg) -> int:
+    """ Size in bytes of a websocket message, which is text unless sent as a binary frame.
+    """
+    return len(msg.encode('utf-8')) if isinstance(msg, str) else len(msg)
+
 
 class ChromewhipException(Exception):
     pass
@@ -33,6 +131,57 @@ class JSScriptError(ChromewhipException):
     pass
 
 
+class DomainManager:
+    """ Reference counts `enable`/`disable` of devtools domains on a tab.
+
+    A domain is enabled by its first user and disabled once its last user releases it, so that a tab only
+    receives events for domains something is actually listening to.
+    """
+
+    def __init__(self, tab):
+        self._tab = tab
+        self._counts = {}
+        self._locks = {}
+
+    @staticmethod
+    def _domain_cls(domain: str):
+        # importing the protocol module is also what allows `helpers.json_to_event` to decode its events
+        module = importlib.import_module('chromewhip.protocol.%s' % domain.lower())
+        return getattr(module, domain)
+
+    def _lock(self, domain: str) -> asyncio.Lock:
+        return self._locks.setdefault(domain, asyncio.Lock())
+
+    def is_enabled(self, domain: str) -> bool:
+        return self._counts.get(domain, 0) > 0
+
+    @property
+    def enabled(self):
+        return tuple(d for d, c in self._counts.items() if c > 0)
+
+    async def acquire(self, *domains: str):
+        for domain in domains:
+            async with self._lock(domain):
+                if not self._counts.get(domain):
+                    await self._tab.send_command(self._domain_cls(domain).enable())
+                self._counts[domain] = self._counts.get(domain, 0) + 1
+
+    async def release(self, *domains: str):
+        for domain in domains:
+            async with self._lock(domain):
+                count = self._counts.get(domain, 0)
+                if not count:
+                    raise ValueError('Domain "%s" released more often than acquired' % domain)
+                if count == 1:
+                    await self._tab.send_command(self._domain_cls(domain).disable())
+                self._counts[domain] = count - 1
+
+    def reset(self):
+        """ Forget every domain, for when the tab's session has been replaced.
+        """
+        self._counts = {}
+
+
 class ChromeTab(metaclass=SyncAdder):
 
     def __init__(self, title, url, ws_uri, tab_id):
@@ -41,6 +190,11 @@ class ChromeTab(metaclass=SyncAdder):
         self._url = url
         self._ws_uri = ws_uri
         self.target_id = ws_uri.split('/')[-1]
+        # set for tabs created in a browser context of their own, see `Chrome.create_tab`
+        self.browser_context_id = None
+        # whether screenshots are captured from the compositor surface rather than the view, which headless Chrome
+        # requires, set by `Chrome`
+        self.from_surface = False
         self._ws: Optional[websockets.WebSocketClientProtocol] = None
         self._message_id = 0
         self._current_task: Optional[asyncio.Task] = None
@@ -48,7 +202,17 @@ class ChromeTab(metaclass=SyncAdder):
         self._ack_payloads = {}
         self._input_events = {}
         self._trigger_events = {}
+        # (number, event) of received events by hash and by name, only kept while commands wait on events, see
+        # `_send`
         self._event_payloads = {}
+        self._events_received = 0
+        self._awaiting_events = 0
+        self._event_handlers = {}
+        # settings applied to the tab that survive navigations, so that unchanged ones are not sent again
+        self._state = {'blocked_urls': []}
+        # key -> (source, identifier) of the scripts registered with `Page.addScriptToEvaluateOnNewDocument`
+        self._new_document_scripts = {}
+        self.domains = DomainManager(self)
         self._recv_task = None
         self._log = logging.getLogger('chromewhip.chrome.ChromeTab')
         self._send_log = logging.getLogger('chromewhip.chrome.ChromeTab.send_handler')
@@ -91,27 +255,31 @@ class ChromeTab(metaclass=SyncAdder):
                 if not result:
                     self._recv_log.error('Missing message, may have been a connection timeout...')
                     continue
+                WEBSOCKET_BYTES.labels('in').inc(_utf8_len(result))
                 result = json.loads(result)
 
                 if not isinstance(result, dict):
                     self._recv_log.error('decoded messages is of type "%s" and = "%s"' % (type(result), result))
                     continue
                 if 'id' in result:
-                    self._ack_payloads[result['id']] = result
                     ack_event = self._ack_events.get(result['id'])
                     if ack_event is None:
                         self._recv_log.error('Ignoring ack with id %s as no registered recv' % result['id'])
                         continue
+                    self._ack_payloads[result['id']] = result
                     self._recv_log.debug('Notifying ack event with id=%s' % (result['id']))
                     ack_event.set()
 
                 elif 'method' in result:
                     self._recv_log.debug('Received event message!')
                     event = helpers.json_to_event(result)
+                    EVENTS.labels(event.js_name).inc()
                     self._recv_log.debug('Received a "%s" event , storing against hash and name...' % event.js_name)
                     hash_ = event.hash_()
-                    self._event_payloads[hash_] = event
-                    self._event_payloads[event.js_name] = event
+                    self._events_received += 1
+                    if self._awaiting_events:
+                        self._event_payloads[hash_] = self._event_payloads[event.js_name] = (
+                            self._events_received, event)
 
                     # first, check if any requests are waiting upon it
                     input_event = self._input_events.get(event.js_name)
@@ -123,6 +291,10 @@ class ChromeTab(metaclass=SyncAdder):
                     if trigger_event:
                         self._recv_log.debug('trigger exists for hash "%s", alerting...' % hash_)
                         trigger_event.set()
+
+                    for coro in self._event_handlers.get(event.js_name, ()):
+                        self._recv_log.debug('scheduling handler for event name "%s"...' % event.js_name)
+                        asyncio.ensure_future(self._run_event_handler(coro, event))
                 else:
                     # TODO: deal with invalid state
                     self._recv_log.info('Invalid message %s, what do i do now?' % result)
@@ -141,7 +313,8 @@ class ChromeTab(metaclass=SyncAdder):
                 raise ValueError('%s is not expected type %s, instead is %s' % (v, type_, type(v)))
         return result
 
-    async def _send(self, request, recv_validator=None, input_event_cls=None, trigger_event_cls=None):
+    async def _send(self, request, recv_validator=None, input_event_cls=None, trigger_event_cls=None,
+                    timeout=None):
         """
         TODO:
         * clean up of stale events in payloads and asyncio event stores
@@ -149,6 +322,7 @@ class ChromeTab(metaclass=SyncAdder):
         :param recv_validator:
         :param input_event_cls:
         :param trigger_event_cls:
+        :param timeout: seconds to wait for the ack of the command, `TIMEOUT_S` by default
         :return:
         """
         self._message_id += 1
@@ -169,15 +343,24 @@ class ChromeTab(metaclass=SyncAdder):
                 raise ValueError('Trigger event type "%s" as not hashable' % trigger_event_cls.__name__)
 
         result = {'ack': None, 'event': None}
+        started = time.monotonic()
+        outcome = 'error'
+        awaits_event = bool(input_event_cls or trigger_event_cls)
+        trigger_hash = None
+        # events received up to now, such as those of a previous navigation of the tab, don't answer this command
+        sent_after = self._events_received
+        if awaits_event:
+            self._awaiting_events += 1
 
         try:
             msg = json.dumps(request, cls=helpers.ChromewhipJSONEncoder)
+            WEBSOCKET_BYTES.labels('out').inc(_utf8_len(msg))
             self._send_log.info('Sending command = %s' % msg)
             self._current_task = asyncio.ensure_future(self._ws.send(msg))
             await asyncio.wait_for(self._current_task, timeout=TIMEOUT_S)  # send
 
             self._send_log.debug('Waiting for ack event set for id=%s' % request['id'])
-            await asyncio.wait_for(ack_event.wait(), timeout=TIMEOUT_S)  # recv
+            await asyncio.wait_for(ack_event.wait(), timeout=TIMEOUT_S if timeout is None else timeout)  # recv
             self._send_log.debug('Received ack event set for id=%s' % request['id'])
 
             ack_payload = self._ack_payloads.get(request['id'])
@@ -207,12 +390,12 @@ class ChromeTab(metaclass=SyncAdder):
             if input_event_cls:
                 hash_ = input_event_cls.js_name
                 # use latest payload as key is not unique within a single session
-                event = self._event_payloads.get(hash_)
+                event = self._event_since(hash_, sent_after)
                 hash_input_dict = {}
                 if not event:
                     self._send_log.debug('Waiting for event with hash "%s"...' % hash_)
                     await asyncio.wait_for(input_event.wait(), timeout=TIMEOUT_S)  # recv
-                    event = self._event_payloads.get(hash_)
+                    event = self._event_since(hash_, sent_after)
 
                 params = event.hash_().split(':')[-1].split(',')
                 for p in params:
@@ -226,21 +409,26 @@ class ChromeTab(metaclass=SyncAdder):
                     # TODO: put in a `strict` flag so that we can catch differences between the protocol spec and the
                     # underlying implementation.
                     cleaned_hash_input_dict = {k: v for k, v in hash_input_dict.items() if k in trigger_event_cls.hashable}
-                    hash_ = trigger_event_cls.build_hash(**cleaned_hash_input_dict)
+                    hash_ = trigger_hash = trigger_event_cls.build_hash(**cleaned_hash_input_dict)
                 except TypeError:
                     raise TypeError(f'Event "{trigger_event_cls.js_name}" hash cannot be built with "{hash_input_dict}"')
-                event = self._event_payloads.get(hash_)
+                event = self._event_since(hash_, sent_after)
                 if not event:
                     self._send_log.debug('Waiting for event with hash "%s"...' % hash_)
                     trigger_event = asyncio.Event()
                     self._trigger_events[hash_] = trigger_event
                     await asyncio.wait_for(trigger_event.wait(), timeout=TIMEOUT_S)  # recv
-                    event = self._event_payloads.get(hash_)
+                    event = self._event_since(hash_, sent_after)
                 result['event'] = event
 
             self._send_log.info('Successfully sent command = %s' % msg)
+            outcome = 'ok'
             return result
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+            raise
         except asyncio.TimeoutError:
+            outcome = 'timeout'
             method = request['method']
             id_ = request['id']
             self._send_log.error(msg)
@@ -255,6 +443,50 @@ class ChromeTab(metaclass=SyncAdder):
                 elif close_code == 1009:
                     raise ProtocolError('Recv\'d payload exceeded %sMB for "%s" with id=%s, consider increasing this limit' % (MAX_PAYLOAD_SIZE_MB, method, id_))
             raise TimeoutError('Unknown cause for timeout to occurs for "%s" with id=%s' % (method, id_))
+        finally:
+            self._ack_events.pop(request['id'], None)
+            self._ack_payloads.pop(request['id'], None)
+            if trigger_hash:
+                self._trigger_events.pop(trigger_hash, None)
+            if awaits_event:
+                self._awaiting_events -= 1
+                if not self._awaiting_events:
+                    # events received before a command is sent are not the ones it waits on
+                    self._event_payloads.clear()
+            COMMANDS.labels(request['method'], outcome).inc()
+            COMMAND_SECONDS.labels(request['method']).observe(time.monotonic() - started)
+
+    def _event_since(self, key, received_after: int):
+        number, event = self._event_payloads.get(key, (0, None))
+        return event if number > received_after else None
+
+    async def _run_event_handler(self, coro, event):
+        try:
+            command = await coro(event)
+            if command:
+                await self.send_command(command)
+        except Exception:
+            self._log.exception('Event handler for "%s" failed' % event.js_name)
+
+    def add_event_handler(self, event_cls, coro):
+        """
+        Run `coro` with every received event of type `event_cls`. If the coroutine returns a command, it is sent
+        on this tab.
+        """
+        self._event_handlers.setdefault(event_cls.js_name, []).append(coro)
+
+    def remove_event_handler(self, event_cls, coro):
+        handlers = self._event_handlers.get(event_cls.js_name, [])
+        if coro in handlers:
+            handlers.remove(coro)
+
+    @contextlib.contextmanager
+    def schedule_coro_on_event(self, coro, event):
+        self.add_event_handler(event, coro)
+        try:
+            yield
+        finally:
+            self.remove_event_handler(event, coro)
 
     async def new_message_handler(self, request):
         request['id'] = self._message_id
@@ -274,18 +506,176 @@ class ChromeTab(metaclass=SyncAdder):
         return self._ws_uri
 
     async def enable_page_events(self):
-        return await self._send(*page.Page.enable())
+        """
+        Enable the Page domain, unless already enabled. Pair with `disable_page_events` once done.
+        """
+        await self.domains.acquire('Page')
+
+    async def disable_page_events(self):
+        await self.domains.release('Page')
+
+    async def send_command(self, command, input_event_type=None, await_on_event_type=None, timeout=None):
+        return await self._send(*command, input_event_cls=input_event_type, trigger_event_cls=await_on_event_type,
+                                timeout=timeout)
+
+    async def _apply_state(self, key, value, command):
+        if self._state.get(key) == value:
+            return False
+        await self.send_command(command)
+        self._state[key] = value
+        return True
+
+    @property
+    def emulation_state(self):
+        """
+        Copy of the settings currently applied to the tab.
+        """
+        return dict(self._state)
+
+    @property
+    def viewport(self):
+        metrics = self._state.get('device_metrics')
+        return (metrics[0], metrics[1]) if metrics else None
+
+    async def set_blocked_urls(self, urls):
+        """
+        Block URLs matching any of the wildcard `urls` from loading, skipping the command if already applied.
+        """
+        urls = list(urls)
+        return await self._apply_state('blocked_urls', urls, network.Network.setBlockedURLs(urls=urls))
+
+    async def set_device_metrics(self, width, height, device_scale_factor=0.0, mobile=False):
+        """
+        Emulate a viewport of `width` x `height`, skipping the command if already applied.
+        """
+        cmd = page.Page.setDeviceMetricsOverride(width=width, height=height,
+                                                 deviceScaleFactor=device_scale_factor, mobile=mobile)
+        return await self._apply_state('device_metrics', (width, height, device_scale_factor, mobile), cmd)
+
+    async def set_user_agent(self, user_agent):
+        """
+        Override the user agent, where an empty string restores Chrome's own.
+        """
+        return await self._apply_state('user_agent', user_agent or None,
+                                       network.Network.setUserAgentOverride(userAgent=user_agent or ''))
+
+    async def set_extra_headers(self, headers):
+        """
+        Send `headers` with every request of the tab.
+        """
+        headers = dict(headers or {})
+        return await self._apply_state('extra_headers', headers or None,
+                                       network.Network.setExtraHTTPHeaders(headers=headers))
 
-    async def send_command(self, command, input_event_type=None, await_on_event_type=None):
-        return await self._send(*command, input_event_cls=input_event_type, trigger_event_cls=await_on_event_type)
+    async def set_script_execution_disabled(self, disabled):
+        return await self._apply_state('script_execution_disabled', bool(disabled) or None,
+                                       emulation.Emulation.setScriptExecutionDisabled(value=bool(disabled)))
+
+    async def set_new_document_scripts(self, scripts: dict):
+        """
+        Make `scripts`, a mapping of a key to JavaScript source, the scripts run on every new document of the tab,
+        only registering the ones that are new or changed and removing those no longer wanted.
+        """
+        for key, (source, identifier) in list(self._new_document_scripts.items()):
+            if scripts.get(key) != source:
+                await self.send_command(page.Page.removeScriptToEvaluateOnNewDocument(identifier=identifier))
+                del self._new_document_scripts[key]
+        for key, source in scripts.items():
+            if key not in self._new_document_scripts:
+                result = await self.send_command(page.Page.addScriptToEvaluateOnNewDocument(source=source))
+                self._new_document_scripts[key] = (source, result['ack']['result']['identifier'])
+
+    @property
+    def new_document_scripts(self):
+        return tuple(self._new_document_scripts)
+
+    async def frame_origins(self):
+        """
+        Origins of the http(s) frames currently in the tab, main frame first
+        """
+        result = await self.send_command(page.Page.getFrameTree())
+        origins, trees = [], [result['ack']['result']['frameTree']]
+        while trees:
+            tree = trees.pop(0)
+            frame, children = (tree.frame, tree.childFrames) if hasattr(tree, 'frame') else (
+                tree['frame'], tree.get('childFrames'))
+            origin = frame['securityOrigin']
+            if origin.startswith(('http://', 'https://')) and origin not in origins:
+                origins.append(origin)
+            trees.extend(children or [])
+        return origins
+
+    async def reset_emulation(self):
+        """
+        Return the emulation settings of the tab to their defaults, except for device metrics
+        """
+        await self.set_blocked_urls(DEFAULT_STATE['blocked_urls'])
+        await self.set_user_agent(DEFAULT_STATE['user_agent'])
+        await self.set_extra_headers(DEFAULT_STATE['extra_headers'])
+        await self.set_script_execution_disabled(DEFAULT_STATE['script_execution_disabled'])
+
+    async def reset(self, clear_storage=True):
+        """
+        Leave the tab as a new one would be, without the cost of creating one: navigate to about:blank, release
+        remote objects, remove scripts run on new documents and reset emulation. With `clear_storage`, cookies, which
+        are shared by every tab of the browser context, and the storage of the origins of the frames of the page are
+        cleared too.
+        """
+        origins = await self.frame_origins() if clear_storage else []
+        await self.send_command(runtime.Runtime.releaseObjectGroup(objectGroup=OBJECT_GROUP))
+        await self.enable_page_events()
+        try:
+            await self.stop_loading()
+            await self.go('about:blank')
+        finally:
+            await self.disable_page_events()
+        await self.set_new_document_scripts({})
+        await self.reset_emulation()
+        if clear_storage:
+            for origin in origins:
+                await self.send_command(storage.Storage.clearDataForOrigin(origin=origin, storageTypes='all'))
+            await self.send_command(network.Network.clearBrowserCookies())
+
+    async def health(self):
+        """
+        Sample the memory use of the tab: its JavaScript heap, DOM counters and run-time metrics by their name
+        """
+        result = await self.send_command(runtime.Runtime.getHeapUsage())
+        heap = result['ack']['result']
+        result = await self.send_command(memory.Memory.getDOMCounters())
+        counters = result['ack']['result']
+        await self.domains.acquire('Performance')
+        try:
+            result = await self.send_command(performance.Performance.getMetrics())
+        finally:
+            await self.domains.release('Performance')
+        return {
+            'js_heap_used_bytes': heap['usedSize'],
+            'js_heap_total_bytes': heap['totalSize'],
+            'documents': counters['documents'],
+            'nodes': counters['nodes'],
+            'js_event_listeners': counters['jsEventListeners'],
+            'metrics': {m.name: m.value for m in result['ack']['result']['metrics']},
+        }
 
     async def html(self):
         result = await self.evaluate('document.documentElement.outerHTML')
         value = result['ack']['result']['result'].value
         return value.encode('utf-8')
 
+    async def text(self):
+        result = await self.evaluate('document.body ? document.body.innerText : ""', return_by_value=True)
+        return result['ack']['result']['result'].value
+
+    async def links(self, same_origin=False):
+        """
+        Absolute URLs of the links of the page, deduplicated in the page, only those of its origin if `same_origin`
+        """
+        result = await self.evaluate(LINKS_JS % json.dumps(bool(same_origin)), return_by_value=True)
+        return result['ack']['result']['result'].value
+
     async def screenshot(self):
-        result = await self.send_command(page.Page.captureScreenshot(format='png', fromSurface=False))
+        result = await self.send_command(page.Page.captureScreenshot(format='png', fromSurface=self.from_surface))
         base64_data = result['ack']['result']['data']
         return base64.b64decode(base64_data)
 
@@ -296,19 +686,89 @@ class ChromeTab(metaclass=SyncAdder):
         return await self.send_command(page.Page.navigate(url),
                                        await_on_event_type=page.FrameStoppedLoadingEvent)
 
-    async def evaluate(self, javascript):
+    async def stop_loading(self):
         """
-        Evaluate JavaScript on the page
+        Force the page to stop all navigations and pending resource fetches
+        """
+        return await self.send_command(page.Page.stopLoading())
+
+    async def evaluate(self, javascript, return_by_value=None, await_promise=None):
         """
-        result = await self.send_command(runtime.Runtime.evaluate(javascript))
+        Evaluate JavaScript on the page, optionally returning its value as JSON and awaiting it if it's a promise
+        """
+        cmd = runtime.Runtime.evaluate(javascript, objectGroup=OBJECT_GROUP, returnByValue=return_by_value,
+                                       awaitPromise=await_promise)
+        result = await self.send_command(cmd)
         r = result["ack"]["result"]["result"]
-        if r.subtype == 'error':
+        if r.subtype == 'error' or result["ack"]["result"].get("exceptionDetails"):
             raise JSScriptError({
                 'reason': 'Runtime.evalulate threw an error',
                 'error': result["ack"]["result"]["exceptionDetails"].to_dict()
             })
         return result
 
+    async def click(self, selector):
+        """
+        Click the centre of the first element matching the CSS `selector` with the mouse, scrolling it into view
+        """
+        js = CENTRE_OF_JS % json.dumps(selector)
+        result = await self.evaluate(js, return_by_value=True)
+        centre = result['ack']['result']['result'].value
+        if not centre:
+            raise JSScriptError({'reason': 'no element matches "%s"' % selector})
+        for type_ in ('mousePressed', 'mouseReleased'):
+            await self.send_command(input.Input.dispatchMouseEvent(type=type_, x=centre['x'], y=centre['y'],
+                                                                   button='left', clickCount=1))
+
+    async def type_text(self, text, selector=None):
+        """
+        Type `text` with the keyboard, into the first element matching the CSS `selector` if given
+        """
+        if selector:
+            result = await self.evaluate(FOCUS_JS % json.dumps(selector), return_by_value=True)
+            if not result['ack']['result']['result'].value:
+                raise JSScriptError({'reason': 'no element matches "%s"' % selector})
+        for char in text:
+            await self.send_command(input.Input.dispatchKeyEvent(type='char', text=char))
+
+    async def extract(self, specs):
+        """
+        Extract values from the page in a single round trip, by name, see `EXTRACT_JS` for the form of `specs`
+        """
+        result = await self.evaluate(EXTRACT_JS % json.dumps(specs), return_by_value=True)
+        return result['ack']['result']['result'].value
+
+    async def _wait_for(self, predicate, timeout):
+        timeout = TIMEOUT_S if timeout is None else timeout
+        cmd = runtime.Runtime.evaluate(WAIT_FOR_JS % (predicate, int(timeout * 1000)), awaitPromise=True,
+                                       returnByValue=True)
+        try:
+            result = await self.send_command(cmd, timeout=timeout + WAIT_MARGIN_S)
+        except TimeoutError:
+            self._log.warning('No answer from the page within %ss of waiting for %s' % (timeout, predicate))
+            return False
+        ack = result['ack']['result']
+        if ack.get('exceptionDetails'):
+            raise JSScriptError({
+                'reason': 'waiting in page threw an error',
+                'error': ack['exceptionDetails'].to_dict()
+            })
+        return ack['result'].value is True
+
+    async def wait_for_selector(self, selector, timeout=None):
+        """
+        Wait in a single round trip until an element matches the CSS `selector`, at most `timeout` seconds,
+        `TIMEOUT_S` by default. Returns whether one did.
+        """
+        return await self._wait_for('() => document.querySelector(%s)' % json.dumps(selector), timeout)
+
+    async def wait_for_function(self, expression, timeout=None):
+        """
+        Wait in a single round trip until the JavaScript `expression` is truthy, at most `timeout` seconds,
+        `TIMEOUT_S` by default. Returns whether it was.
+        """
+        return await self._wait_for('() => (%s)' % expression, timeout)
+
     def __str__(self):
         return '%s - %s' % (self.title, self.url)
 
@@ -318,11 +778,13 @@ class ChromeTab(metaclass=SyncAdder):
 
 class Chrome(metaclass=SyncAdder):
 
-    def __init__(self, host='localhost', port=9222):
+    def __init__(self, host='localhost', port=9222, headless=False):
         self._host = host
         self._port = port
+        self._headless = headless
         self._url = 'http://%s:%d' % (self.host, self.port)
         self._tabs = []
+        self._browser = None
         self.is_connected = False
         self._log = logging.getLogger('chromewhip.chrome.Chrome')
 
@@ -344,6 +806,7 @@ class Chrome(metaclass=SyncAdder):
                     self._log.warning('Empty data, will attempt to reconnect until able to get pages.')
                 for tab in filter(lambda x: x['type'] == 'page', data):
                     t = await ChromeTab.create_from_json(tab, self._host, self._port)
+                    t.from_surface = self._headless
                     tabs.append(t)
                 self._tabs = tabs
                 self._log.debug("Connected to Chrome! Found {} tabs".format(len(self._tabs)))
@@ -362,22 +825,64 @@ class Chrome(metaclass=SyncAdder):
     def url(self):
         return self._url
 
+    @property
+    def headless(self):
+        return self._headless
+
     @property
     def tabs(self):
         if not len(self._tabs):
             raise ValueError('Must call connect_s or connect first!')
         return tuple(self._tabs)
 
-    async def create_tab(self):
+    async def browser_session(self) -> ChromeTab:
+        """ Connection to the browser target itself, for commands such as those of the Target domain that are
+        not about a single tab
+        """
+        if not self._browser:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(self._url + '/json/version') as resp:
+                    data = await resp.json()
+            self._browser = ChromeTab('browser', '', data['webSocketDebuggerUrl'], 'browser')
+            await self._browser.connect()
+        return self._browser
+
+    async def create_tab(self, browser_context=False):
+        """ Open a new tab, in a browser context of its own if `browser_context`, similar to an incognito
+        profile, so that it shares no cookies, storage or cache with other tabs
+        """
+        if browser_context:
+            browser_session = await self.browser_session()
+            result = await browser_session.send_command(target.Target.createBrowserContext())
+            context_id = result['ack']['result']['browserContextId']
+            result = await browser_session.send_command(target.Target.createTarget(url='about:blank',
+                                                                                   browserContextId=context_id))
+            target_id = result['ack']['result']['targetId']
+            t = ChromeTab('', 'about:blank', 'ws://{}:{}/devtools/page/{}'.format(self._host, self._port, target_id),
+                          target_id)
+            t.browser_context_id = context_id
+            t.from_surface = self._headless
+            await t.connect()
+            self._tabs.append(t)
+            return t
         async with aiohttp.ClientSession() as session:
             async with session.get(self._url + '/json/new') as resp:
                 data = await resp.json()
                 t = await ChromeTab.create_from_json(data, self._host, self._port)
+                t.from_surface = self._headless
                 self._tabs.append(t)
         return t
 
     async def close_tab(self, tab):
+        if tab in self._tabs:
+            self._tabs.remove(tab)
         await tab.disconnect()
+        if tab.browser_context_id:
+            # closes the tab with its context
+            browser_session = await self.browser_session()
+            await browser_session.send_command(
+                target.Target.disposeBrowserContext(browserContextId=tab.browser_context_id))
+            return
         async with aiohttp.ClientSession() as session:
             await session.get(self._url + f'/json/close/{tab.id_}')
 
@@ -0,0 +1,314 @@
+""" Crawling, following the links of rendered pages from a set of seed URLs without leaving chromewhip.
+
+`POST /crawl` takes a JSON object with the `seeds` to start from, the `scope` of URLs to follow, limits and the
+query params of the renders, and streams back one JSON line per crawled page, with its links and optionally its
+text or html. URLs are normalized and deduplicated in a frontier that hands out URLs of the same host at most
+once every `delay` seconds, while pages of different hosts are rendered concurrently across the tab pool.
+"""
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import re
+from typing import Optional
+
+from aiohttp import web
+from yarl import URL
+
+from chromewhip.admission import admission_controlled
+from chromewhip.batch import CONTENT_TYPE, render_view
+from chromewhip.timing import get_timer, timed
+from chromewhip.views import load_page, render_within_timeout
+
+log = logging.getLogger('chromewhip.crawl')
+
+DEFAULT_MAX_DEPTH = 2
+DEFAULT_MAX_PAGES = 100
+MAX_PAGES = 10000
+DEFAULT_DELAY_S = 1.0
+OUTPUTS = ('links', 'txt', 'html')
+PAGE_PATH = '/crawl'
+
+
+def normalize_url(url: str) -> Optional[str]:
+    """ Absolute http(s) `url` without its fragment, credentials, default port and dot segments, with its scheme and host
+    lowercased and an empty path as `/`, or `None` if it isn't one.
+    """
+    try:
+        parsed = URL(url)
+    except ValueError:
+        return None
+    if parsed.scheme not in ('http', 'https') or not parsed.host:
+        return None
+    return str(URL.build(scheme=parsed.scheme, host=parsed.raw_host,
+                         port=None if parsed.is_default_port() else parsed.port, path=parsed.raw_path or '/',
+                         query_string=parsed.raw_query_string, encoded=True))
+
+
+class SeenSet:
+    """ URLs seen, kept as 64 bit hashes rather than strings, as crawls see many more URLs than they crawl.
+    """
+
+    def __init__(self):
+        self._hashes = set()
+
+    @staticmethod
+    def _hash(url: str) -> int:
+        return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def __contains__(self, url):
+        return self._hash(url) in self._hashes
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, url: str) -> bool:
+        """ Add `url`, returning whether it was new.
+        """
+        h = self._hash(url)
+        if h in self._hashes:
+            return False
+        self._hashes.add(h)
+        return True
+
+
+class Scope:
+    """ URLs a crawl follows: those on one of `hosts` or their subdomains, matching one of the `include` regular
+    expressions if any, and none of the `exclude` ones.
+    """
+
+    def __init__(self, hosts, include=None, exclude=None):
+        self._hosts = {h.lower() for h in hosts}
+        self._include = [re.compile(p) for p in include or []]
+        self._exclude = [re.compile(p) for p in exclude or []]
+
+    def allows(self, url: str) -> bool:
+        host = URL(url).host
+        if not any(host == h or host.endswith('.%s' % h) for h in self._hosts):
+            return False
+        if self._include and not any(p.search(url) for p in self._include):
+            return False
+        return not any(p.search(url) for p in self._exclude)
+
+
+class Frontier:
+    """ URLs waiting to be crawled, queued by host, handing out a URL of a host at most once every `delay_s`.
+    """
+
+    def __init__(self, delay_s: float = DEFAULT_DELAY_S):
+        self._delay_s = delay_s
+        self._queues = collections.OrderedDict()
+        self._next_at = {}
+        self._seen = SeenSet()
+        self._changed = asyncio.Event()
+        self.in_progress = 0
+
+    @property
+    def queued(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def add(self, url: str, depth: int) -> bool:
+        """ Queue `url`, found at `depth`, returning whether it was queued rather than already seen.
+        """
+        if not self._seen.add(url):
+            return False
+        self._queues.setdefault(URL(url).host, collections.deque()).append((url, depth))
+        self._changed.set()
+        return True
+
+    async def get(self):
+        """ Wait for the next URL and its depth that may be crawled, or `None` once no URLs are queued and none
+        are being crawled, which could add more. Every URL got must be marked `done`.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            self._changed.clear()
+            hosts = [h for h, q in self._queues.items() if q]
+            if not hosts:
+                if not self.in_progress:
+                    return None
+                await self._changed.wait()
+                continue
+            host = min(hosts, key=lambda h: self._next_at.get(h, 0))
+            wait_s = self._next_at.get(host, 0) - loop.time()
+            if wait_s > 0:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=wait_s)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._next_at[host] = loop.time() + self._delay_s
+            self.in_progress += 1
+            return self._queues[host].popleft()
+
+    def done(self):
+        self.in_progress -= 1
+        self._changed.set()
+
+
+@timed
+@admission_controlled
+async def render_page(request: web.Request):
+    return await render_within_timeout(request, _render_page)
+
+
+async def _render_page(request: web.Request):
+    tab = await load_page(request)
+    timer = get_timer(request)
+    with timer.phase('serialize'):
+        page = {'links': await tab.links()}
+        output = request.query.get('output')
+        if output == 'txt':
+            page['text'] = await tab.text()
+        elif output == 'html':
+            page['html'] = (await tab.html()).decode('utf-8')
+    return web.json_response(page)
+
+
+class Crawler:
+    """ Crawls from `seeds` the URLs in `scope`, up to `max_depth` links away and `max_pages` pages in total,
+    rendering at most `concurrency` pages at once with the render query `params`.
+    """
+
+    def __init__(self, app: web.Application, seeds, scope: Scope, max_depth: int = DEFAULT_MAX_DEPTH,
+                 max_pages: int = DEFAULT_MAX_PAGES, concurrency: int = 1, delay_s: float = DEFAULT_DELAY_S,
+                 params: dict = None, headers=None, transport=None):
+        self._app = app
+        self._scope = scope
+        self._max_depth = max_depth
+        self._max_pages = max_pages
+        self._concurrency = concurrency
+        self._params = params or {}
+        self._headers = headers
+        self._transport = transport
+        self._frontier = Frontier(delay_s)
+        self._started = 0
+        for seed in seeds:
+            self._frontier.add(seed, 0)
+
+    async def _crawl(self, url: str, depth: int) -> dict:
+        params = dict(self._params, url=url)
+        response = await render_view(self._app, PAGE_PATH, render_page, params, self._headers, self._transport)
+        result = {'url': url, 'depth': depth, 'status': response.status}
+        try:
+            page = json.loads(response.body.decode('utf-8'))
+        except ValueError:
+            page = {'error': response.body.decode('utf-8', 'replace')}
+        if response.status != 200 or 'error' in page:
+            result['error'] = page.get('error')
+            return result
+        result.update(page)
+        if depth < self._max_depth:
+            for link in page['links']:
+                link = normalize_url(link)
+                if link and self._scope.allows(link):
+                    self._frontier.add(link, depth + 1)
+        return result
+
+    async def _work(self, results: asyncio.Queue):
+        while True:
+            item = await self._frontier.get()
+            if item is None:
+                break
+            if self._started >= self._max_pages:
+                self._frontier.done()
+                break
+            self._started += 1
+            try:
+                results.put_nowait(await self._crawl(*item))
+            finally:
+                self._frontier.done()
+
+    async def results(self):
+        """ Crawl, yielding the result of every page as soon as it is crawled.
+        """
+        results = asyncio.Queue()
+        workers = [asyncio.ensure_future(self._work(results)) for _ in range(self._concurrency)]
+        running = asyncio.ensure_future(asyncio.gather(*workers))
+        try:
+            while not (running.done() and results.empty()):
+                getter = asyncio.ensure_future(results.get())
+                await asyncio.wait([getter, running], return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+            # surfaces unexpected errors of the workers
+            running.result()
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+
+def _get_int(body: dict, key: str, default: int, minimum: int, maximum: int = None) -> int:
+    try:
+        value = int(body.get(key, default))
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(reason='%s must be a number' % key)
+    if value < minimum or (maximum is not None and value > maximum):
+        raise web.HTTPBadRequest(reason='%s must be between %s and %s' % (key, minimum, maximum))
+    return value
+
+
+def _get_crawl(request: web.Request, body) -> Crawler:
+    if not isinstance(body, dict) or not isinstance(body.get('seeds'), list) or not body['seeds']:
+        raise web.HTTPBadRequest(reason='body must be a JSON object with a non empty list of seeds')
+    seeds = [normalize_url(s) if isinstance(s, str) else None for s in body['seeds']]
+    if not all(seeds):
+        raise web.HTTPBadRequest(reason='seeds must be absolute http URLs')
+
+    scope = body.get('scope') or {}
+    if not isinstance(scope, dict):
+        raise web.HTTPBadRequest(reason='scope must be a JSON object')
+    hosts = scope.get('hosts') or [URL(s).host for s in seeds]
+    patterns = [scope.get('include') or [], scope.get('exclude') or []]
+    if not all(isinstance(v, list) and all(isinstance(i, str) for i in v) for v in [hosts] + patterns):
+        raise web.HTTPBadRequest(reason='scope hosts must be a list of hosts and include and exclude lists of '
+                                        'regular expressions')
+    try:
+        scope = Scope(hosts, *patterns)
+    except re.error as e:
+        raise web.HTTPBadRequest(reason='invalid scope regular expression: %s' % e)
+
+    params = body.get('params') or {}
+    if not isinstance(params, dict):
+        raise web.HTTPBadRequest(reason='params must be a JSON object')
+    params = {k: str(v) for k, v in params.items() if k != 'url'}
+    output = body.get('output', 'links')
+    if output not in OUTPUTS:
+        raise web.HTTPBadRequest(reason='output must be one of %s' % ', '.join(OUTPUTS))
+    params['output'] = output
+
+    try:
+        delay_s = float(body.get('delay', DEFAULT_DELAY_S))
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(reason='delay must be a number')
+    max_concurrency = request.app['tab-pool'].size
+    return Crawler(
+        request.app, seeds, scope,
+        max_depth=_get_int(body, 'max_depth', DEFAULT_MAX_DEPTH, 0),
+        max_pages=_get_int(body, 'max_pages', DEFAULT_MAX_PAGES, 1, MAX_PAGES),
+        concurrency=min(_get_int(body, 'concurrency', max_concurrency, 1), max_concurrency),
+        delay_s=max(delay_s, 0),
+        params=params, headers=request.headers, transport=request.transport)
+
+
+async def crawl(request: web.Request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(reason='body must be JSON')
+    crawler = _get_crawl(request, body)
+
+    response = web.StreamResponse(headers={'Content-Type': CONTENT_TYPE})
+    await response.prepare(request)
+    results = crawler.results()
+    try:
+        async for result in results:
+            await response.write(json.dumps(result).encode('utf-8') + b'\n')
+    finally:
+        # stops the crawl when the client went away
+        await results.aclose()
+    await response.write_eof()
+    return response
@@ -0,0 +1,315 @@
+""" Request filtering with Adblock Plus (EasyList style) rules.
+
+Filter profiles are plain text files living in a single folder, where the file name minus the `.txt`
+extension is the profile name, mirroring the `--filters-path` option of splash.
+
+Rules are compiled once into a `FilterMatcher`, which indexes them by keyword so matching a URL only
+has to test the handful of rules that could possibly match instead of the whole list.
+"""
+import logging
+import os
+import re
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+log = logging.getLogger('chromewhip.filters')
+
+DEFAULT_FILTER_NAME = 'default'
+NO_FILTERS_NAME = 'none'
+
+# maps Adblock Plus resource type options to devtools `Page.ResourceType`
+RESOURCE_TYPE_OPTIONS = {
+    'script': {'Script'},
+    'image': {'Image'},
+    'stylesheet': {'Stylesheet'},
+    'font': {'Font'},
+    'media': {'Media'},
+    'object': {'Other'},
+    'other': {'Other', 'Manifest', 'TextTrack', 'CSPViolationReport'},
+    'xmlhttprequest': {'XHR', 'Fetch', 'EventSource'},
+    'subdocument': {'Document'},
+    'websocket': {'WebSocket'},
+    'ping': {'Ping'},
+}
+
+_KEYWORD_RE = re.compile(r'[a-z0-9%]{3,}')
+_SEPARATOR_RE = r'(?:[^\w\-.%]|$)'
+
+
+class FilterRule:
+
+    def __init__(self, raw, regex, keywords, is_exception=False, resource_types=None,
+                 excluded_resource_types=None, third_party=None, include_domains=None,
+                 exclude_domains=None, native_pattern=None):
+        self.raw = raw
+        self.regex = regex
+        self.keywords = keywords
+        self.is_exception = is_exception
+        self.resource_types = resource_types
+        self.excluded_resource_types = excluded_resource_types or set()
+        self.third_party = third_party
+        self.include_domains = include_domains or set()
+        self.exclude_domains = exclude_domains or set()
+        self.native_pattern = native_pattern
+
+    @property
+    def has_options(self):
+        return bool(self.resource_types is not None or self.excluded_resource_types or self.third_party is not None
+                    or self.include_domains or self.exclude_domains)
+
+    def matches(self, url: str, resource_type: str = None, document_host: str = None, is_third_party: bool = None):
+        if resource_type is not None:
+            if self.resource_types is not None and resource_type not in self.resource_types:
+                return False
+            if resource_type in self.excluded_resource_types:
+                return False
+        if self.third_party is not None:
+            if is_third_party is None or is_third_party != self.third_party:
+                return False
+        if self.include_domains or self.exclude_domains:
+            if document_host is None:
+                return False
+            if self.include_domains and not _host_in(document_host, self.include_domains):
+                return False
+            if _host_in(document_host, self.exclude_domains):
+                return False
+        return self.regex.search(url) is not None
+
+    def __repr__(self):
+        return 'FilterRule("%s")' % self.raw
+
+
+def _host_in(host: str, domains: set) -> bool:
+    parts = host.split('.')
+    return any('.'.join(parts[i:]) in domains for i in range(len(parts)))
+
+
+def _base_domain(host: str) -> str:
+    return '.'.join(host.split('.')[-2:])
+
+
+def _pattern_to_regex(pattern: str) -> str:
+    prefix = suffix = ''
+    if pattern.startswith('||'):
+        prefix = r'^[a-z][a-z0-9+.\-]*://(?:[^/?#]*\.)?'
+        pattern = pattern[2:]
+    elif pattern.startswith('|'):
+        prefix = '^'
+        pattern = pattern[1:]
+    if pattern.endswith('|'):
+        suffix = '$'
+        pattern = pattern[:-1]
+    body = []
+    for char in pattern:
+        if char == '*':
+            body.append('.*')
+        elif char == '^':
+            body.append(_SEPARATOR_RE)
+        else:
+            body.append(re.escape(char))
+    return prefix + ''.join(body) + suffix
+
+
+def _pattern_keywords(pattern: str) -> List[str]:
+    """ Keywords are tokens that are guaranteed to appear as a whole token in every URL the pattern matches.
+    """
+    anchored_start = pattern.startswith('|')
+    anchored_end = pattern.endswith('|')
+    text = pattern.strip('|')
+    keywords = []
+    for m in _KEYWORD_RE.finditer(text):
+        start, end = m.span()
+        before = text[start - 1] if start else ('|' if anchored_start else '*')
+        after = text[end] if end < len(text) else ('|' if anchored_end else '*')
+        if before == '*' or after == '*':
+            continue
+        keywords.append(m.group())
+    return keywords
+
+
+def _pattern_to_native(pattern: str) -> Optional[List[str]]:
+    """ Convert to `Network.setBlockedURLs` wildcard patterns, if the rule can be expressed exactly enough.
+    """
+    if '?' in pattern:
+        return None
+    if pattern.endswith('^'):
+        pattern = pattern[:-1] + '/*'
+    if '^' in pattern:
+        return None
+    if pattern.endswith('|'):
+        pattern = pattern[:-1]
+    elif not pattern.endswith('*'):
+        pattern += '*'
+    if pattern.startswith('||'):
+        host_pattern = pattern[2:]
+        return ['*://%s' % host_pattern, '*://*.%s' % host_pattern]
+    if pattern.startswith('|'):
+        return [pattern[1:]]
+    if not pattern.startswith('*'):
+        pattern = '*' + pattern
+    return [pattern]
+
+
+def parse_rule(line: str) -> Optional[FilterRule]:
+    """ Parse a single Adblock Plus rule, returning `None` for comments, element hiding rules and
+    rules with options chromewhip is unable to honour.
+    """
+    raw = line.strip()
+    if not raw or raw.startswith('!') or raw.startswith('['):
+        return None
+    if '##' in raw or '#@#' in raw or '#?#' in raw or '#$#' in raw:
+        return None
+
+    text = raw
+    is_exception = text.startswith('@@')
+    if is_exception:
+        text = text[2:]
+
+    options = ''
+    is_regex_literal = len(text) > 1 and text.startswith('/') and text.endswith('/')
+    if not is_regex_literal and '$' in text:
+        text, _, options = text.rpartition('$')
+        is_regex_literal = len(text) > 1 and text.startswith('/') and text.endswith('/')
+
+    resource_types = None
+    excluded_resource_types = set()
+    third_party = None
+    include_domains = set()
+    exclude_domains = set()
+    match_case = False
+    for option in filter(None, options.split(',')):
+        option = option.strip().lower()
+        negated = option.startswith('~')
+        name = option.lstrip('~')
+        if name in RESOURCE_TYPE_OPTIONS:
+            if negated:
+                excluded_resource_types |= RESOURCE_TYPE_OPTIONS[name]
+            else:
+                resource_types = (resource_types or set()) | RESOURCE_TYPE_OPTIONS[name]
+        elif name == 'third-party':
+            third_party = not negated
+        elif name.startswith('domain='):
+            for domain in name[len('domain='):].split('|'):
+                if domain.startswith('~'):
+                    exclude_domains.add(domain[1:])
+                elif domain:
+                    include_domains.add(domain)
+        elif name == 'match-case':
+            match_case = True
+        else:
+            log.debug('skipping rule "%s" with unsupported option "%s"' % (raw, option))
+            return None
+
+    flags = 0 if match_case else re.IGNORECASE
+    if is_regex_literal:
+        try:
+            regex = re.compile(text[1:-1], flags)
+        except re.error:
+            log.debug('skipping rule "%s" with invalid regex' % raw)
+            return None
+        keywords = []
+        native_pattern = None
+    else:
+        pattern = text.lower() if not match_case else text
+        # a leading or trailing wildcard is redundant for a search
+        pattern = re.sub(r'\*+', '*', pattern)
+        if pattern.startswith('*'):
+            pattern = pattern.lstrip('*')
+        if pattern.endswith('*') and not pattern.endswith('|*'):
+            pattern = pattern.rstrip('*')
+        regex = re.compile(_pattern_to_regex(pattern), flags)
+        keywords = _pattern_keywords(pattern.lower())
+        native_pattern = _pattern_to_native(pattern) if pattern else None
+
+    return FilterRule(raw, regex, keywords,
+                      is_exception=is_exception,
+                      resource_types=resource_types,
+                      excluded_resource_types=excluded_resource_types,
+                      third_party=third_party,
+                      include_domains=include_domains,
+                      exclude_domains=exclude_domains,
+                      native_pattern=native_pattern)
+
+
+class FilterMatcher:
+    """ A compiled set of Adblock Plus rules.
+
+    Every rule is stored against one of its keywords, so matching a URL only requires testing the rules
+    filed under the tokens the URL contains, plus the few rules that have no usable keyword.
+    """
+
+    def __init__(self, rules: List[FilterRule] = None, name: str = None):
+        self.name = name
+        self._block_index: Dict[str, List[FilterRule]] = {}
+        self._exception_index: Dict[str, List[FilterRule]] = {}
+        self._rules = []
+        for rule in rules or []:
+            self.add(rule)
+
+    @classmethod
+    def from_lines(cls, lines, name: str = None):
+        rules = filter(None, (parse_rule(line) for line in lines))
+        return cls(list(rules), name=name)
+
+    @classmethod
+    def from_file(cls, fp: str, name: str = None):
+        with open(fp, encoding='utf-8', errors='ignore') as f:
+            return cls.from_lines(f, name=name)
+
+    def add(self, rule: FilterRule):
+        index = self._exception_index if rule.is_exception else self._block_index
+        keyword = ''
+        if rule.keywords:
+            # prefer the least used keyword, so buckets stay small
+            keyword = min(rule.keywords, key=lambda k: (len(index.get(k, ())), -len(k)))
+        index.setdefault(keyword, []).append(rule)
+        self._rules.append(rule)
+
+    def __len__(self):
+        return len(self._rules)
+
+    @staticmethod
+    def _candidates(index, tokens):
+        yield from index.get('', ())
+        for token in tokens:
+            yield from index.get(token, ())
+
+    def should_block(self, url: str, resource_type: str = None, document_url: str = None) -> bool:
+        lowered_url = url.lower()
+        tokens = set(_KEYWORD_RE.findall(lowered_url))
+        document_host = urlsplit(document_url).hostname if document_url else None
+        is_third_party = None
+        if document_host:
+            request_host = urlsplit(url).hostname or ''
+            is_third_party = _base_domain(request_host) != _base_domain(document_host)
+        args = (url, resource_type, document_host, is_third_party)
+        if not any(r.matches(*args) for r in self._candidates(self._block_index, tokens)):
+            return False
+        return not any(r.matches(*args) for r in self._candidates(self._exception_index, tokens))
+
+    def native_patterns(self) -> Optional[List[str]]:
+        """ `Network.setBlockedURLs` patterns equivalent to this matcher, or `None` if any rule needs
+        request interception to be honoured.
+        """
+        if self._exception_index:
+            return None
+        patterns = []
+        for rule in self._rules:
+            if rule.has_options or rule.native_pattern is None:
+                return None
+            patterns.extend(rule.native_pattern)
+        return patterns
+
+
+def load_filters(filters_path: str) -> Dict[str, FilterMatcher]:
+    """ Compile every `<name>.txt` file in `filters_path` into a named `FilterMatcher`.
+    """
+    filters = {}
+    for fn in sorted(os.listdir(filters_path)):
+        name, ext = os.path.splitext(fn)
+        if ext != '.txt':
+            continue
+        matcher = FilterMatcher.from_file(os.path.join(filters_path, fn), name=name)
+        log.debug('adding filter "{}" with {} rules'.format(name, len(matcher)))
+        filters[name] = matcher
+    return filters
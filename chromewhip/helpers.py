@@ -28,10 +28,20 @@ class PayloadMixin:
                     expected_type_ = expected_['class']
                 except KeyError:
                     raise KeyError('name %s not in expected payload of %s' % (name, types))
-                if issubclass(expected_type_, ChromeTypeBase):
+                if isinstance(expected_type_, list):
+                    # arrays are declared as a list of their item type
+                    if not isinstance(val, list):
+                        raise ValueError('%s is not expected type %s, instead is %s' % (val, expected_type_, val))
+                    item_type_ = expected_type_[0] if expected_type_ else None
+                    if isinstance(item_type_, type) and issubclass(item_type_, ChromeTypeBase):
+                        result[name] = [item_type_(**v) for v in val]
+                elif issubclass(expected_type_, ChromeTypeBase):
                     result[name] = expected_type_(**val)
                 elif re.match(r'.*Id$', name) and isinstance(val, str):
                     result[name] = expected_type_(val)
+                elif expected_type_ is float and isinstance(val, int) and not isinstance(val, bool):
+                    # JSON has a single number type, so whole floats arrive as ints
+                    result[name] = float(val)
                 elif not isinstance(val, expected_type_):
                     raise ValueError('%s is not expected type %s, instead is %s' % (val, expected_type_, val))
             for rn, rv in types_.items():
@@ -0,0 +1,129 @@
+""" Request interception for a single tab.
+
+Chrome only allows a single set of interception patterns per tab, so every feature that needs to look at
+requests before Chrome fetches them registers a handler on a `RequestInterceptor` instead of talking to
+`Network.setRequestInterception` directly.
+"""
+import logging
+from typing import Callable, List, Optional
+
+from chromewhip.filters import FilterMatcher
+from chromewhip.protocol import network
+
+log = logging.getLogger('chromewhip.interception')
+
+BLOCKED_ERROR_REASON = 'BlockedByClient'
+
+
+def is_response_stage(event: network.RequestInterceptedEvent) -> bool:
+    """ Whether the request was intercepted after its response headers were received.
+    """
+    return event.responseStatusCode is not None or event.responseErrorReason is not None
+
+
+class RequestInterceptor:
+    """ Dispatches `Network.requestIntercepted` events of a tab through a chain of handlers.
+
+    Each handler is a callable with a `patterns` attribute listing the `Network.RequestPattern`s it needs to
+    see, which is awaited with the event and returns either a `Network.continueInterceptedRequest` command,
+    which settles the request, or `None` to pass the request on to the next handler. Requests no handler
+    settles are continued unmodified.
+    """
+
+    def __init__(self, tab, handlers: List[Callable] = None):
+        self._tab = tab
+        self._handlers = list(handlers or [])
+        self._patterns = []
+        for handler in self._handlers:
+            self._patterns.extend(p for p in handler.patterns if p not in self._patterns)
+        self._is_started = False
+
+    @property
+    def is_started(self):
+        return self._is_started
+
+    async def start(self):
+        if self._is_started:
+            return
+        self._tab.add_event_handler(network.RequestInterceptedEvent, self._on_request_intercepted)
+        await self._tab.domains.acquire('Network')
+        self._is_started = True
+        await self._tab.send_command(network.Network.setRequestInterception(patterns=self._patterns))
+
+    async def stop(self):
+        if not self._is_started:
+            return
+        self._is_started = False
+        try:
+            await self._tab.send_command(network.Network.setRequestInterception(patterns=[]))
+            await self._tab.domains.release('Network')
+        finally:
+            self._tab.remove_event_handler(network.RequestInterceptedEvent, self._on_request_intercepted)
+
+    async def _on_request_intercepted(self, event: network.RequestInterceptedEvent):
+        for handler in self._handlers:
+            try:
+                command = await handler(event)
+            except Exception:
+                log.exception('Interception handler %s failed for "%s"' % (handler, event.request.url))
+                continue
+            if command:
+                return command
+        return network.Network.continueInterceptedRequest(interceptionId=event.interceptionId)
+
+
+class RequestFilter:
+    """ Interception handler aborting requests blocked by filter profiles or by resource type.
+    """
+
+    def __init__(self, matchers: List[FilterMatcher] = None, blocked_resource_types: set = None,
+                 document_url: Optional[str] = None):
+        self._matchers = matchers or []
+        self._blocked_resource_types = blocked_resource_types or set()
+        self._document_url = document_url
+
+    @property
+    def patterns(self):
+        if self._matchers:
+            return [{'urlPattern': '*'}]
+        # only resource types are blocked, so no other request needs to pay for a round trip
+        return [{'urlPattern': '*', 'resourceType': t} for t in sorted(self._blocked_resource_types)]
+
+    def should_block(self, url: str, resource_type: str = None) -> bool:
+        if resource_type in self._blocked_resource_types:
+            return True
+        return any(m.should_block(url, resource_type=resource_type, document_url=self._document_url)
+                   for m in self._matchers)
+
+    async def __call__(self, event: network.RequestInterceptedEvent):
+        if event.isNavigationRequest or is_response_stage(event):
+            return None
+        if self.should_block(event.request.url, event.resourceType):
+            log.debug('blocking request to "%s"' % event.request.url)
+            return network.Network.continueInterceptedRequest(interceptionId=event.interceptionId,
+                                                              errorReason=BLOCKED_ERROR_REASON)
+        return None
+
+
+def build_blocking(matchers: List[FilterMatcher], blocked_resource_types: set, document_url: str = None):
+    """ Work out the cheapest way to apply filters to a render.
+
+    Filters that can be expressed as `Network.setBlockedURLs` wildcards are applied natively by Chrome,
+    anything else is handled by interception.
+
+    :return: tuple of the native url patterns and a `RequestFilter` handler, or `None` if interception is
+    not needed.
+    """
+    native_urls = []
+    intercepted_matchers = []
+    for matcher in matchers:
+        patterns = matcher.native_patterns()
+        if patterns is None:
+            intercepted_matchers.append(matcher)
+        else:
+            native_urls.extend(patterns)
+
+    if not intercepted_matchers and not blocked_resource_types:
+        return native_urls, None
+
+    return native_urls, RequestFilter(intercepted_matchers, blocked_resource_types, document_url=document_url)
@@ -0,0 +1,316 @@
+""" Asynchronous render jobs, for renders too long to hold an HTTP connection open for.
+
+`POST /jobs` takes a render spec in the same form as a render of `/render.batch` and replies straight away
+with the id of the job. Jobs are spooled to disk and run by a fixed number of workers, at low priority unless
+asked otherwise, so a burst of jobs is worked through at the pace of the tab pool rather than all at once.
+`GET /jobs/{id}` returns the status of the job until it is done, then the response of its render.
+
+Finished jobs are kept in a folder bounded by the size of their results, their number and their age, oldest
+first out, and jobs that were queued or running when chromewhip stopped are run again on startup.
+"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Optional
+
+import aiohttp
+from aiohttp import web
+from yarl import URL
+
+from chromewhip.admission import API_KEY_HEADER, AdmissionRejected, client_id_for
+from chromewhip.batch import parse_render_spec, render_response
+from chromewhip.metrics import Counter
+from chromewhip.middleware import json_error
+
+log = logging.getLogger('chromewhip.jobs')
+
+JOBS_DISK_BYTES = 1024 * 1024 ** 2
+MAX_FINISHED_JOBS = 10000
+FINISHED_JOB_TTL_S = 7 * 24 * 3600
+MAX_QUEUED_JOBS = 1000
+DEFAULT_JOB_PRIORITY = 'low'
+WEBHOOK_HOSTS = {'localhost', '127.0.0.1', '::1'}
+WEBHOOK_TIMEOUT_S = 10
+RENDER_STATUS_HEADER = 'Chromewhip-Render-Status'
+# headers describing the body are set again when serving the result
+STORED_HEADERS_SKIPPED = {'content-type', 'content-length', 'content-encoding', 'transfer-encoding'}
+
+QUEUED, RUNNING, DONE = 'queued', 'running', 'done'
+
+JOBS = Counter('chromewhip_jobs_total', 'Render jobs by event', ['event'])
+
+
+class Job:
+
+    def __init__(self, id: str, endpoint: str, params: dict, client_id: str = None, webhook: str = None,
+                 status: str = QUEUED, created_at: float = None, finished_at: float = None, result: dict = None,
+                 size: int = 0):
+        self.id = id
+        self.endpoint = endpoint
+        self.params = params
+        self.client_id = client_id
+        self.webhook = webhook
+        self.status = status
+        self.created_at = time.time() if created_at is None else created_at
+        self.finished_at = finished_at
+        # status, content type and headers of the response of the render
+        self.result = result
+        self.size = size
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    def describe(self):
+        """ What clients get to see of the job.
+        """
+        info = {'id': self.id, 'status': self.status, 'created_at': self.created_at}
+        if self.status == DONE:
+            info['finished_at'] = self.finished_at
+            info['render_status'] = self.result['status']
+        return info
+
+
+class JobStore:
+    """ Job metadata and results in the folder `path`, keeping at most `max_finished` finished jobs, for at most
+    `ttl_s` seconds and `max_disk_bytes` of results.
+
+    Disk layout: `jobs/<id>.json` and `results/<id>`.
+    """
+
+    def __init__(self, path: str, max_disk_bytes: int = JOBS_DISK_BYTES, max_finished: int = MAX_FINISHED_JOBS,
+                 ttl_s: float = FINISHED_JOB_TTL_S):
+        self._path = path
+        self._max_disk_bytes = max_disk_bytes
+        self._max_finished = max_finished
+        self._ttl_s = ttl_s
+        os.makedirs(os.path.join(path, 'jobs'), exist_ok=True)
+        os.makedirs(os.path.join(path, 'results'), exist_ok=True)
+
+    def _job_fp(self, job_id):
+        return os.path.join(self._path, 'jobs', '%s.json' % job_id)
+
+    def result_fp(self, job_id):
+        return os.path.join(self._path, 'results', job_id)
+
+    def load(self) -> list:
+        jobs = []
+        for fn in os.listdir(os.path.join(self._path, 'jobs')):
+            if not fn.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self._path, 'jobs', fn)) as f:
+                    jobs.append(Job(**json.load(f)))
+            except (OSError, ValueError, TypeError):
+                log.exception('Unable to load job "%s", ignoring it' % fn)
+        return sorted(jobs, key=lambda j: j.created_at)
+
+    def save(self, job: Job):
+        fp = self._job_fp(job.id)
+        tmp_fp = '%s.tmp' % fp
+        with open(tmp_fp, 'w') as f:
+            json.dump(job.to_dict(), f)
+        os.replace(tmp_fp, fp)
+
+    def save_result(self, job: Job, body: bytes):
+        fp = self.result_fp(job.id)
+        tmp_fp = '%s.tmp' % fp
+        with open(tmp_fp, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_fp, fp)
+        job.size = len(body)
+
+    def delete(self, job: Job):
+        for fp in (self.result_fp(job.id), self._job_fp(job.id)):
+            try:
+                os.remove(fp)
+            except FileNotFoundError:
+                pass
+
+    def evict(self, jobs: list, now: float = None) -> list:
+        """ Delete the oldest of the finished `jobs` until they fit, as well as those older than the TTL, returning
+        the deleted jobs.
+        """
+        expired_at = (time.time() if now is None else now) - self._ttl_s
+        finished = sorted((j for j in jobs if j.status == DONE), key=lambda j: j.finished_at)
+        total = sum(j.size for j in finished)
+        left = len(finished)
+        evicted = []
+        for job in finished:
+            if total <= self._max_disk_bytes and left <= self._max_finished and job.finished_at >= expired_at:
+                break
+            self.delete(job)
+            total -= job.size
+            left -= 1
+            evicted.append(job)
+        return evicted
+
+
+class JobQueue:
+    """ Runs the jobs of `store` with `workers` concurrent workers, holding at most `max_queued` waiting jobs.
+    """
+
+    def __init__(self, app: web.Application, store: JobStore, workers: int, max_queued: int = MAX_QUEUED_JOBS,
+                 loop: asyncio.AbstractEventLoop = None):
+        self._app = app
+        self._store = store
+        self._num_workers = workers
+        self._max_queued = max_queued
+        self._loop = loop
+        self._jobs = {}
+        self._queue = None
+        self._workers = []
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def queued(self):
+        return self._queue.qsize() if self._queue else 0
+
+    def get(self, job_id) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def _run_io(self, fn, *args):
+        loop = self._loop or asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(fn, *args))
+
+    async def _evict(self):
+        for evicted in await self._run_io(self._store.evict, list(self._jobs.values())):
+            self._jobs.pop(evicted.id, None)
+            JOBS.labels('evicted').inc()
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        for job in await self._run_io(self._store.load):
+            self._jobs[job.id] = job
+            if job.status != DONE:
+                log.info('resuming job %s' % job.id)
+                job.status = QUEUED
+                self._queue.put_nowait(job)
+        await self._evict()
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(self._num_workers)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, endpoint: str, params: dict, client_id: str = None, webhook: str = None) -> Job:
+        if self.queued >= self._max_queued:
+            JOBS.labels('rejected').inc()
+            raise AdmissionRejected('Job queue is full', retry_after=60)
+        params.setdefault('priority', DEFAULT_JOB_PRIORITY)
+        job = Job(uuid.uuid4().hex, endpoint, params, client_id=client_id, webhook=webhook)
+        await self._run_io(self._store.save, job)
+        self._jobs[job.id] = job
+        self._queue.put_nowait(job)
+        JOBS.labels('submitted').inc()
+        return job
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception('Job %s failed unexpectedly' % job.id)
+                await self._finish(job, json_error('Job failed unexpectedly', status=500))
+
+    async def _render(self, job: Job) -> web.Response:
+        headers = {API_KEY_HEADER: job.client_id} if job.client_id else None
+        while True:
+            response = await render_response(self._app, job.endpoint, dict(job.params), headers)
+            if response.status != 503:
+                return response
+            # jobs are not in a hurry, so wait for the render queue to drain instead of failing
+            retry_after = int(response.headers.get('Retry-After', 1))
+            log.debug('render queue busy, retrying job %s in %ss' % (job.id, retry_after))
+            await asyncio.sleep(retry_after)
+
+    async def _run(self, job: Job):
+        job.status = RUNNING
+        await self._run_io(self._store.save, job)
+        await self._finish(job, await self._render(job))
+
+    async def _finish(self, job: Job, response: web.Response):
+        await self._run_io(self._store.save_result, job, response.body or b'')
+        job.result = {
+            'status': response.status,
+            'content_type': response.content_type,
+            'headers': {k: v for k, v in response.headers.items() if k.lower() not in STORED_HEADERS_SKIPPED},
+        }
+        job.status = DONE
+        job.finished_at = time.time()
+        await self._run_io(self._store.save, job)
+        JOBS.labels('done').inc()
+
+        await self._evict()
+
+        if job.webhook:
+            await self._notify(job)
+
+    async def _notify(self, job: Job):
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(job.webhook, json=job.describe(), timeout=WEBHOOK_TIMEOUT_S) as resp:
+                    if resp.status >= 400:
+                        log.warning('webhook of job %s replied with %s' % (job.id, resp.status))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning('Unable to call webhook of job %s: %r' % (job.id, e))
+
+
+def _disabled():
+    return json_error('Jobs are not enabled, start chromewhip with --jobs-path', status=404)
+
+
+def _get_webhook(raw_webhook):
+    if raw_webhook is None:
+        return None
+    try:
+        url = URL(raw_webhook)
+    except ValueError:
+        url = None
+    # only local services may be called back, so that jobs can't be used to make requests elsewhere
+    if not url or url.scheme not in ('http', 'https') or url.host not in WEBHOOK_HOSTS:
+        raise web.HTTPBadRequest(reason='webhook must be an http URL on one of %s' % ', '.join(sorted(WEBHOOK_HOSTS)))
+    return str(url)
+
+
+async def submit_job(request: web.Request):
+    queue = request.app['job-queue']
+    if not queue:
+        return _disabled()
+    try:
+        spec = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(reason='body must be JSON')
+    if not isinstance(spec, dict):
+        raise web.HTTPBadRequest(reason='body must be a JSON object')
+    spec = dict(spec)
+    webhook = _get_webhook(spec.pop('webhook', None))
+    endpoint, params = parse_render_spec(spec)
+    job = await queue.submit(endpoint, params, client_id=client_id_for(request), webhook=webhook)
+    return web.json_response(job.describe(), status=202, headers={'Location': '/jobs/%s' % job.id})
+
+
+async def get_job(request: web.Request):
+    queue = request.app['job-queue']
+    if not queue:
+        return _disabled()
+    job = queue.get(request.match_info['job_id'])
+    if not job:
+        return json_error('No job with id %s' % request.match_info['job_id'], status=404)
+    if job.status != DONE:
+        return web.json_response(job.describe(), status=202)
+    headers = dict(job.result['headers'])
+    headers['Content-Type'] = job.result['content_type']
+    headers[RENDER_STATUS_HEADER] = str(job.result['status'])
+    return web.FileResponse(queue.store.result_fp(job.id), headers=headers)
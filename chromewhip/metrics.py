@@ -0,0 +1,212 @@
+""" Minimal Prometheus instrumentation, exposed in the text exposition format on `/metrics`.
+
+Metrics are module level objects declared next to the code they measure, in the same way as loggers, and
+are all collected by the `REGISTRY` of this module.
+"""
+import math
+import os
+import threading
+from typing import Optional, Sequence
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 25, 60)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (n, _escape(v)) for n, v in zip(names, values))
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError('metric "%s" is already registered' % metric.name)
+        self._metrics[metric.name] = metric
+
+    def get(self, name):
+        return self._metrics[name]
+
+    def expose(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type_))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type_ = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError('%s expects labels %s' % (self.name, self.labelnames))
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def clear(self):
+        with self._lock:
+            self._children = {}
+
+    def samples(self):
+        for key, child in sorted(self._children.items()):
+            yield from child.samples(self.name, self.labelnames, key)
+
+
+class _ValueChild:
+
+    def __init__(self):
+        self.value = 0.0
+
+    def samples(self, name, labelnames, key):
+        yield '%s%s %s' % (name, _format_labels(labelnames, key), _format_value(self.value))
+
+
+class _CounterChild(_ValueChild):
+
+    def inc(self, amount: float = 1):
+        if amount < 0:
+            raise ValueError('counters can only be incremented')
+        self.value += amount
+
+
+class _GaugeChild(_ValueChild):
+
+    def set(self, value: float):
+        self.value = float(value)
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+
+class Counter(_Metric):
+    type_ = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    type_ = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class _HistogramChild:
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self._buckets):
+            if value <= bound:
+                self._counts[i] += 1
+                break
+
+    def samples(self, name, labelnames, key):
+        cumulative = 0
+        for bound, count in zip(self._buckets, self._counts):
+            cumulative += count
+            labels = _format_labels(labelnames + ('le',), key + (_format_value(bound),))
+            yield '%s_bucket%s %s' % (name, labels, cumulative)
+        yield '%s_sum%s %s' % (name, _format_labels(labelnames, key), _format_value(self.sum))
+        yield '%s_count%s %s' % (name, _format_labels(labelnames, key), self.count)
+
+
+class Histogram(_Metric):
+    type_ = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional[Registry] = REGISTRY):
+        self._buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self._buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """ Resident memory in bytes of a process and all of its descendants, read from `/proc`.
+
+    Chrome runs a process per renderer, so the RSS of the browser process alone is meaningless.
+    """
+    if not os.path.isdir('/proc/%s' % pid):
+        return None
+    children = {}
+    rss_pages = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as f:
+                stat = f.read()
+            with open('/proc/%s/statm' % entry) as f:
+                statm = f.read().split()
+        except OSError:
+            continue
+        # the process name is in parentheses and may contain spaces
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+        rss_pages[int(entry)] = int(statm[1])
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        total += rss_pages.get(current, 0)
+        stack.extend(children.get(current, ()))
+    return total * os.sysconf('SC_PAGE_SIZE')
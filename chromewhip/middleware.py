@@ -4,25 +4,42 @@ import pprint
 
 from aiohttp import web
 
+from chromewhip.admission import AdmissionRejected
 from chromewhip.chrome import ChromewhipException
+from chromewhip.views import GlobalTimeoutError
 
 
-def json_error(message):
+def json_error(message, status=200, headers=None):
     # return web.Response(
     #     body=json.dumps({'error': message}).encode('utf-8'),
     #     content_type='application/json')
     # return web.Response(text=pprint.pformat({'error': message}))
-    return web.Response(text=json.dumps({'error': message}, indent=4))
+    return web.Response(text=json.dumps({'error': message}, indent=4), status=status, headers=headers)
+
+def splash_error(status, type_, description, info=None):
+    # https://splash.readthedocs.io/en/stable/api.html#errors
+    return web.Response(text=json.dumps({'error': status, 'type': type_, 'description': description, 'info': info},
+                                        indent=4),
+                        status=status)
+
 
 async def error_middleware(app, handler):
     async def middleware_handler(request):
+        response = await _handle(request)
+        timer = request.get('chromewhip-timer')
+        if timer and 'Server-Timing' not in response.headers:
+            timer.apply(response)
+        return response
+
+    async def _handle(request):
         try:
-            response = await handler(request)
-            if response.status != 200:
-                return json_error(response.message)
-            return response
+            return await handler(request)
         except web.HTTPException as ex:
             return json_error(ex.reason)
+        except GlobalTimeoutError as ex:
+            return splash_error(504, 'GlobalTimeoutError', ex.args[0], {'timeout': ex.timeout})
+        except AdmissionRejected as ex:
+            return json_error(ex.args[0], status=503, headers={'Retry-After': str(ex.retry_after)})
         except ChromewhipException as ex:
             return json_error(ex.args[0])
         except Exception as ex:
@@ -0,0 +1,278 @@
+""" A fixed size pool of Chrome tabs shared by the render views.
+
+How much of a render can leak into the next render on the same tab depends on the isolation level of the pool,
+each using the cheapest way of providing it, see `scripts/benchmark_tab_reset.py`:
+
+* `none`: renders only undo what they set up themselves
+* `page`: tabs are reset to about:blank, without scripts run on new documents, remote objects or emulation
+  settings left over from the render
+* `storage`: as `page`, also clearing cookies and the storage of the origins of the page
+* `context`: every render gets a new tab in a browser context of its own, sharing nothing with other tabs
+
+With `spare` tabs, that many idle tabs are kept created and warmed up ahead of renders, so that creating a tab
+is never on the critical path of a render.
+
+Tabs degrade over many renders, so a `HealthPolicy` can retire them after a number of renders or once their
+memory use grows past limits, replacing them before they are closed.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Optional
+
+from chromewhip.chrome import Chrome, ChromeTab
+from chromewhip.metrics import Counter
+
+log = logging.getLogger('chromewhip.pool')
+
+ISOLATION_LEVELS = ('none', 'page', 'storage', 'context')
+DEFAULT_ISOLATION = 'none'
+RESET_TIMEOUT_S = 5
+# viewport renders get unless they ask for another, which spare tabs are warmed up with
+DEFAULT_VIEWPORT = (1024, 768)
+
+RETIREMENTS = Counter('chromewhip_tab_retirements_total', 'Tabs retired by the health policy, by reason', ['reason'])
+
+
+class HealthPolicy:
+    """ When tabs are retired: after `max_renders` renders, or once a sample of their health, taken after every
+    `sample_every` renders, exceeds one of the limits. Limits of `None` don't apply.
+    """
+
+    def __init__(self, max_renders: int = None, max_js_heap_mb: float = None, max_dom_nodes: int = None,
+                 max_documents: int = None, max_js_event_listeners: int = None, sample_every: int = 1):
+        self.max_renders = max_renders
+        self._limits = {
+            'js_heap_used_bytes': max_js_heap_mb * 1024 ** 2 if max_js_heap_mb is not None else None,
+            'nodes': max_dom_nodes,
+            'documents': max_documents,
+            'js_event_listeners': max_js_event_listeners,
+        }
+        self._sample_every = max(sample_every, 1)
+
+    def should_sample(self, renders: int) -> bool:
+        return any(v is not None for v in self._limits.values()) and renders % self._sample_every == 0
+
+    def is_due(self, renders: int) -> bool:
+        """ Whether a tab needs checking after its `renders`-th render.
+        """
+        return self.max_renders is not None or self.should_sample(renders)
+
+    def exceeded(self, health: dict) -> Optional[str]:
+        """ The first limit `health` exceeds, if any.
+        """
+        for key, limit in self._limits.items():
+            if limit is not None and health[key] > limit:
+                return key
+        return None
+
+
+class TabPool:
+    """ Hands out tabs for exclusive use by a single render at a time.
+
+    Tabs are created lazily, adopting the tabs Chrome was started with first, up to `size` tabs. Once
+    every tab is in use, `acquire` waits for one to be released.
+
+    With `spare` tabs, up to `spare` more tabs are created in the background whenever fewer than `spare` tabs are
+    idle. They are warmed up with the default viewport and the Page domain enabled for as long as they live,
+    which also saves renders enabling and disabling it.
+
+    Idle tabs already emulating the requested viewport are preferred, to save re-applying device metrics.
+    """
+
+    def __init__(self, chrome: Chrome, size: int, isolation: str = DEFAULT_ISOLATION, health: HealthPolicy = None,
+                 spare: int = 0):
+        if isolation not in ISOLATION_LEVELS:
+            raise ValueError('Unknown isolation level "%s"' % isolation)
+        self._chrome = chrome
+        self._size = size
+        self._spare = spare
+        self._isolation = isolation
+        self._health = health or HealthPolicy()
+        self._tabs = []
+        # renders each tab has served
+        self._renders = {}
+        # tabs on their way out, which must not be adopted again
+        self._closing = []
+        self._idle = deque()
+        self._waiters = deque()
+        self._creating = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def spare(self):
+        return self._spare
+
+    @property
+    def isolation(self):
+        return self._isolation
+
+    @property
+    def tabs(self):
+        return tuple(self._tabs)
+
+    @property
+    def in_use(self):
+        return len(self._tabs) - len(self._idle)
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    async def _create_tab(self, reserved: bool = False) -> ChromeTab:
+        """ Create a tab, where `reserved` means the caller already counted it as being created.
+        """
+        if not reserved:
+            self._creating += 1
+        try:
+            await self._chrome.connect()
+            if self._isolation == 'context':
+                tab = await self._chrome.create_tab(browser_context=True)
+            else:
+                try:
+                    existing = self._chrome.tabs
+                except ValueError:
+                    existing = ()
+                adoptable = [t for t in existing if t not in self._tabs and t not in self._closing]
+                tab = adoptable[0] if adoptable else await self._chrome.create_tab()
+            if self._spare:
+                await self._warm_up(tab)
+            self._tabs.append(tab)
+            log.debug('pool now has %s of %s tabs' % (len(self._tabs), self._size + self._spare))
+            return tab
+        finally:
+            self._creating -= 1
+
+    async def _warm_up(self, tab: ChromeTab):
+        await tab.set_device_metrics(*DEFAULT_VIEWPORT)
+        # held for the life of the tab, so that renders find it enabled
+        await tab.enable_page_events()
+
+    def _top_up(self):
+        """ Create tabs in the background until `spare` tabs are idle or on their way.
+        """
+        while (len(self._idle) + self._creating < self._spare and
+               len(self._tabs) + self._creating < self._size + self._spare):
+            self._creating += 1
+            asyncio.ensure_future(self._replenish(reserved=True))
+
+    async def start(self):
+        """ Create the spare tabs ahead of the first renders.
+        """
+        self._top_up()
+
+    def _pop_idle(self, viewport=None) -> ChromeTab:
+        if viewport is not None:
+            for tab in self._idle:
+                if tab.viewport == viewport:
+                    self._idle.remove(tab)
+                    return tab
+        return self._idle.popleft()
+
+    async def acquire(self, viewport: tuple = None) -> ChromeTab:
+        if self._idle:
+            tab = self._pop_idle(viewport)
+            self._top_up()
+            return tab
+        if len(self._tabs) + self._creating < self._size:
+            return await self._create_tab()
+        waiter = asyncio.Future()
+        self._waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(waiter.result())
+            raise
+
+    async def _close_tab(self, tab: ChromeTab):
+        try:
+            await self._chrome.close_tab(tab)
+        except Exception:
+            log.exception('Unable to close discarded tab %r' % tab)
+        finally:
+            self._closing.remove(tab)
+
+    async def _replenish(self, reserved: bool = False):
+        try:
+            tab = await self._create_tab(reserved)
+        except Exception:
+            log.exception('Unable to create a replacement tab')
+            return
+        self.release(tab)
+
+    def discard(self, tab: ChromeTab):
+        """ Remove a tab that can no longer be trusted from the pool, closing it once a replacement has been
+        created.
+        """
+        log.warning('discarding tab %r, replacing it' % tab)
+        self.replace(tab)
+
+    async def _replace(self, tab: ChromeTab):
+        await self._replenish(reserved=True)
+        await self._close_tab(tab)
+
+    def replace(self, tab: ChromeTab):
+        """ Hand back a tab that must not serve another render, closing it once a replacement has been created,
+        so that the pool stays at full size.
+        """
+        if tab in self._tabs:
+            self._tabs.remove(tab)
+        self._renders.pop(tab, None)
+        self._closing.append(tab)
+        # counted straight away, so that renders acquiring meanwhile don't create a tab of their own as well
+        self._creating += 1
+        asyncio.ensure_future(self._replace(tab))
+
+    async def _check(self, tab: ChromeTab, renders: int):
+        if self._isolation in ('page', 'storage'):
+            try:
+                await asyncio.wait_for(tab.reset(clear_storage=self._isolation == 'storage'),
+                                       timeout=RESET_TIMEOUT_S)
+            except Exception:
+                log.exception('Unable to reset tab %r' % tab)
+                self.discard(tab)
+                return
+
+        reason = None
+        if self._health.max_renders is not None and renders >= self._health.max_renders:
+            reason = 'renders'
+        elif self._health.should_sample(renders):
+            try:
+                health = await asyncio.wait_for(tab.health(), timeout=RESET_TIMEOUT_S)
+            except Exception:
+                log.exception('Unable to sample health of tab %r' % tab)
+                self.discard(tab)
+                return
+            reason = self._health.exceeded(health)
+            log.debug('health of tab %r after %s renders: %s' % (tab, renders, health))
+        if reason:
+            log.info('retiring tab %r after %s renders, exceeded %s' % (tab, renders, reason))
+            RETIREMENTS.labels(reason).inc()
+            self.replace(tab)
+        else:
+            self.release(tab)
+
+    def recycle(self, tab: ChromeTab):
+        """ Hand back a tab a render is done with, isolating the next render from it as the isolation level asks
+        and retiring it if the health policy says so. Resetting, checking and replacing tabs happen in the
+        background, so that the render can reply straight away.
+        """
+        renders = self._renders[tab] = self._renders.get(tab, 0) + 1
+        if self._isolation == 'context':
+            self.replace(tab)
+        elif self._isolation == 'none' and not self._health.is_due(renders):
+            self.release(tab)
+        else:
+            asyncio.ensure_future(self._check(tab, renders))
+
+    def release(self, tab: ChromeTab):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(tab)
+                return
+        self._idle.append(tab)
@@ -0,0 +1,190 @@
+""" JavaScript profiles, code run on the page of a render selected by name with the `js` query param.
+
+A profile is a folder of `.js` files, run in file name order once the page has loaded. Files ending in
+`.start.js` are instead run when the document is created, before any of the page's own scripts. Every sub
+folder of the profiles folder is a profile, and profiles are reloaded when their files change.
+
+Rather than sending the source of a profile with every render, profiles are registered with
+`Page.addScriptToEvaluateOnNewDocument` on the tabs that use them and stay registered for as long as the
+renders on that tab keep asking for them. Code that runs after load is registered as a function on a
+hidden global, so that running it only takes a call by name and the code is parsed once per page. As the code
+is the body of that function, its top level declarations are local to it rather than page globals, and a top
+level `return` is allowed.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+log = logging.getLogger('chromewhip.profiles')
+
+START_SUFFIX = '.start.js'
+REGISTRY_GLOBAL = '__chromewhip_profiles__'
+RELOAD_INTERVAL_S = 2
+
+# registered scripts only run in the main frame, in the same way as code evaluated after load
+_DEFINE_JS = """if (window.top === window) {
+    const profiles = window[%(registry)s] || Object.defineProperty(window, %(registry)s, {value: {}})[%(registry)s];
+    profiles[%(name)s] = function () {
+%(source)s
+    };
+}
+"""
+_START_JS = """if (window.top === window) {
+%(source)s
+}
+"""
+
+
+def _js_files(path: str):
+    return sorted(f for f in os.listdir(path) if os.path.splitext(f)[1] == '.js')
+
+
+class JSProfile:
+
+    def __init__(self, name: str, source: str = '', start_source: str = ''):
+        self.name = name
+        self.source = source
+        self.start_source = start_source
+        self.digest = hashlib.sha1('{}\0{}'.format(start_source, source).encode()).hexdigest()
+        # built once, so that tabs comparing them against what they have registered find the same strings
+        self._new_document_scripts = self._build_new_document_scripts()
+
+    @classmethod
+    def from_folder(cls, path: str, name: str = None):
+        source, start_source = '', ''
+        for f in _js_files(path):
+            with open(os.path.join(path, f)) as fh:
+                code = '{}\n'.format(fh.read())
+            if f.endswith(START_SUFFIX):
+                start_source += code
+            else:
+                source += code
+        return cls(name or os.path.basename(os.path.normpath(path)), source, start_source)
+
+    def new_document_scripts(self) -> dict:
+        """ Scripts to register with `ChromeTab.set_new_document_scripts`, by a key unique to the profile.
+        """
+        return dict(self._new_document_scripts)
+
+    def _build_new_document_scripts(self) -> dict:
+        scripts = {}
+        if self.start_source:
+            scripts['%s:start' % self.name] = _START_JS % {'source': self.start_source}
+        if self.source:
+            scripts['%s:define' % self.name] = _DEFINE_JS % {
+                'registry': json.dumps(REGISTRY_GLOBAL),
+                'name': json.dumps(self.name),
+                'source': self.source,
+            }
+        return scripts
+
+    def run_expression(self):
+        """ Expression running the after load code of the profile, or `None` if there is none.
+        """
+        if not self.source:
+            return None
+        return 'window[%s][%s]()' % (json.dumps(REGISTRY_GLOBAL), json.dumps(self.name))
+
+
+class ProfileIndex:
+    """ The profiles in the folder `path` by name, where each sub folder is a profile. `.js` files directly in
+    `path` make up a profile named after `path` itself.
+
+    `reload` picks up changed, added and removed profiles, replacing the index as a whole so that renders
+    always see a consistent set of profiles. A render holding on to a profile keeps the version it started with.
+    Tabs notice changed profiles by their scripts, which then get registered again.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._profiles = {}
+        self._signatures = {}
+        self.reload()
+
+    def __contains__(self, name):
+        return name in self._profiles
+
+    def __getitem__(self, name):
+        return self._profiles[name]
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def get(self, name, default=None):
+        return self._profiles.get(name, default)
+
+    @property
+    def digests(self):
+        return {name: profile.digest for name, profile in self._profiles.items()}
+
+    def _profile_folders(self) -> dict:
+        folders = {}
+        if _js_files(self._path):
+            folders[os.path.basename(os.path.normpath(self._path))] = self._path
+        for entry in sorted(os.listdir(self._path)):
+            folder = os.path.join(self._path, entry)
+            if os.path.isdir(folder) and _js_files(folder):
+                folders[entry] = folder
+        return folders
+
+    @staticmethod
+    def _signature(folder: str):
+        signature = []
+        for f in _js_files(folder):
+            stat = os.stat(os.path.join(folder, f))
+            signature.append((f, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def reload(self) -> list:
+        """ Reload the profiles whose files changed, returning the names of changed, added and removed profiles.
+        """
+        profiles, signatures, changed = {}, {}, []
+        for name, folder in self._profile_folders().items():
+            current = self._profiles.get(name)
+            try:
+                signature = self._signature(folder)
+                if current and signature == self._signatures.get(name):
+                    profile = current
+                else:
+                    profile = JSProfile.from_folder(folder, name)
+            except (OSError, UnicodeDecodeError):
+                log.exception('Unable to load profile "%s", keeping the version loaded before' % name)
+                if current:
+                    profiles[name] = current
+                    signatures[name] = self._signatures[name]
+                continue
+            if current and profile.digest == current.digest:
+                profile = current
+            elif current:
+                log.info('reloaded profile "%s"' % name)
+                changed.append(name)
+            else:
+                log.debug('adding profile "%s"' % name)
+                changed.append(name)
+            profiles[name] = profile
+            signatures[name] = signature
+        for name in set(self._profiles) - set(profiles):
+            log.info('removed profile "%s"' % name)
+            changed.append(name)
+        self._profiles, self._signatures = profiles, signatures
+        return changed
+
+    async def watch(self, interval_s: float = RELOAD_INTERVAL_S):
+        """ Reload profiles every `interval_s` seconds, until cancelled.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(interval_s)
+            try:
+                # scanning the folder stats every file, so keep it off the event loop
+                await loop.run_in_executor(None, self.reload)
+            except Exception:
+                log.exception('Unable to reload profiles from "%s"' % self._path)
+
+
+def load_profiles(path: str) -> ProfileIndex:
+    """ Load every profile in the folder `path`, see `ProfileIndex`.
+    """
+    return ProfileIndex(path)
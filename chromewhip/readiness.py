@@ -0,0 +1,189 @@
+""" Readiness conditions deciding when a navigated page is ready to be rendered.
+
+Instead of sleeping for a fixed `wait` after the frame stopped loading, a render can wait for one of Chrome's
+lifecycle events of the main frame, or for chromewhip's own count of in-flight requests to stay at zero for
+`IDLE_S`, with `wait` as the upper bound. A render can also run the page on virtual time, so that its timers
+fire as fast as the CPU allows rather than in wall-clock time.
+"""
+import asyncio
+import logging
+
+from chromewhip.protocol import emulation, network, page
+
+log = logging.getLogger('chromewhip.readiness')
+
+# `ready` query param values mapped to the name of the lifecycle event they wait for
+LIFECYCLE_CONDITIONS = {
+    'domcontentloaded': 'DOMContentLoaded',
+    'load': 'load',
+    'networkalmostidle': 'networkAlmostIdle',
+    'networkidle': 'networkIdle',
+}
+IDLE_CONDITION = 'idle'
+CONDITIONS = tuple(LIFECYCLE_CONDITIONS) + (IDLE_CONDITION,)
+IDLE_S = 0.5
+VIRTUAL_TIME_POLICY = 'pauseIfNetworkFetchesPending'
+
+
+class RequestTracker:
+    """ Counts the requests of a tab that are still in flight, noting when there have been none for `idle_s`.
+    """
+
+    def __init__(self, idle_s: float = IDLE_S):
+        self._idle_s = idle_s
+        self._in_flight = set()
+        self._idle_handle = None
+        self.idle = asyncio.Event()
+
+    @property
+    def in_flight(self):
+        return len(self._in_flight)
+
+    def _schedule_idle(self):
+        self._cancel_idle()
+        self._idle_handle = asyncio.get_event_loop().call_later(self._idle_s, self.idle.set)
+
+    def _cancel_idle(self):
+        if self._idle_handle:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+
+    def start(self):
+        if not self._in_flight:
+            self._schedule_idle()
+
+    def stop(self):
+        self._cancel_idle()
+
+    def request_started(self, request_id):
+        self._in_flight.add(request_id)
+        self._cancel_idle()
+        self.idle.clear()
+
+    def request_finished(self, request_id):
+        self._in_flight.discard(request_id)
+        if not self._in_flight:
+            self._schedule_idle()
+
+
+class ReadinessWatcher:
+    """ Navigates a tab and waits until its main frame satisfies `condition`, one of `CONDITIONS`.
+    """
+
+    def __init__(self, tab, condition: str, idle_s: float = IDLE_S):
+        if condition not in CONDITIONS:
+            raise ValueError('Unknown readiness condition "%s"' % condition)
+        self._tab = tab
+        self._condition = condition
+        self._tracker = RequestTracker(idle_s) if condition == IDLE_CONDITION else None
+        self._frame_id = None
+        self._loader_id = None
+        self._lifecycle = {}
+        self._ready = asyncio.Event()
+        self._is_started = False
+
+    async def _on_lifecycle_event(self, event: page.LifecycleEventEvent):
+        self._lifecycle.setdefault((event.frameId, event.loaderId), set()).add(event.name)
+        self._check()
+
+    async def _on_request_started(self, event: network.RequestWillBeSentEvent):
+        self._tracker.request_started(event.requestId)
+
+    async def _on_request_finished(self, event):
+        self._tracker.request_finished(event.requestId)
+
+    def _handlers(self):
+        if self._tracker:
+            return [(network.RequestWillBeSentEvent, self._on_request_started),
+                    (network.LoadingFinishedEvent, self._on_request_finished),
+                    (network.LoadingFailedEvent, self._on_request_finished)]
+        return [(page.LifecycleEventEvent, self._on_lifecycle_event)]
+
+    def _check(self):
+        if self._frame_id is None:
+            return
+        expected = LIFECYCLE_CONDITIONS[self._condition]
+        if expected in self._lifecycle.get((self._frame_id, self._loader_id), ()):
+            self._ready.set()
+
+    async def start(self):
+        for event_cls, handler in self._handlers():
+            self._tab.add_event_handler(event_cls, handler)
+        self._is_started = True
+        if self._tracker:
+            await self._tab.domains.acquire('Network')
+        else:
+            await self._tab.send_command(page.Page.setLifecycleEventsEnabled(enabled=True))
+
+    async def stop(self):
+        if not self._is_started:
+            return
+        self._is_started = False
+        try:
+            if self._tracker:
+                self._tracker.stop()
+                await self._tab.domains.release('Network')
+            else:
+                await self._tab.send_command(page.Page.setLifecycleEventsEnabled(enabled=False))
+        finally:
+            for event_cls, handler in self._handlers():
+                self._tab.remove_event_handler(event_cls, handler)
+
+    async def navigate(self, url: str):
+        result = await self._tab.send_command(page.Page.navigate(url))
+        ack = result['ack']['result']
+        self._frame_id = ack['frameId']
+        self._loader_id = ack.get('loaderId')
+        if self._tracker:
+            self._tracker.start()
+        else:
+            self._check()
+
+    async def wait(self, timeout: float = None) -> bool:
+        """ Wait for the page to be ready, at most `timeout` seconds, returning whether it became ready.
+        """
+        ready = self._tracker.idle if self._tracker else self._ready
+        try:
+            await asyncio.wait_for(ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            log.debug('page not "%s" after %ss, rendering anyway' % (self._condition, timeout))
+            return False
+        return True
+
+
+class VirtualTimeBudget:
+    """ Runs the next navigation of a tab on virtual time until `budget_ms` virtual milliseconds have elapsed,
+    time not advancing while requests are pending.
+
+    Chrome offers no way to return a tab to real time, so the tab should not be reused afterwards.
+    """
+
+    def __init__(self, tab, budget_ms: float):
+        self._tab = tab
+        self._budget_ms = budget_ms
+        self._expired = asyncio.Event()
+        self._is_started = False
+
+    async def _on_budget_expired(self, event: emulation.VirtualTimeBudgetExpiredEvent):
+        self._expired.set()
+
+    async def start(self):
+        self._tab.add_event_handler(emulation.VirtualTimeBudgetExpiredEvent, self._on_budget_expired)
+        self._is_started = True
+        await self._tab.send_command(emulation.Emulation.setVirtualTimePolicy(
+            policy=VIRTUAL_TIME_POLICY, budget=self._budget_ms, waitForNavigation=True))
+
+    def stop(self):
+        if self._is_started:
+            self._is_started = False
+            self._tab.remove_event_handler(emulation.VirtualTimeBudgetExpiredEvent, self._on_budget_expired)
+
+    async def wait(self, timeout: float = None) -> bool:
+        """ Wait for the budget to expire, at most `timeout` seconds, returning whether it did.
+        """
+        try:
+            await asyncio.wait_for(self._expired.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            log.debug('virtual time budget of %sms not expired after %ss' % (self._budget_ms, timeout))
+            return False
+        return True
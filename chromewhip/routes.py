@@ -1,6 +1,19 @@
-from chromewhip.views import render_html, render_png
+from chromewhip.batch import render_batch
+from chromewhip.crawl import crawl
+from chromewhip.jobs import get_job, submit_job
+from chromewhip.scripts import execute
+from chromewhip.views import render_extract, render_html, render_links, render_png, render_txt, render_metrics
 
 
 def setup_routes(app):
     app.router.add_get('/render.html', render_html)
     app.router.add_get('/render.png', render_png)
+    app.router.add_get('/render.txt', render_txt)
+    app.router.add_get('/render.links', render_links)
+    app.router.add_get('/render.extract', render_extract)
+    app.router.add_post('/render.batch', render_batch)
+    app.router.add_post('/execute', execute)
+    app.router.add_post('/crawl', crawl)
+    app.router.add_post('/jobs', submit_job)
+    app.router.add_get('/jobs/{job_id}', get_job)
+    app.router.add_get('/metrics', render_metrics)
@@ -0,0 +1,157 @@
+""" Render scripts, a list of steps run one after the other against a single tab, entirely server side.
+
+`POST /execute` takes a JSON object with a list of `steps`, each an object with an `action` and its arguments,
+and returns the outputs of the steps that have one in a single response, keyed by the `name` of the step or
+else its index. Like the other render endpoints, scripts hold a render slot and a tab while they run and are
+bounded by the `timeout` query param.
+"""
+import asyncio
+import base64
+import json
+import logging
+
+from aiohttp import web
+
+from chromewhip.admission import admission_controlled
+from chromewhip.chrome import ChromewhipException, TimeoutError as CommandTimeoutError
+from chromewhip.timing import get_timer, timed
+from chromewhip.views import acquire_tab, get_viewport, render_within_timeout, time_left
+
+log = logging.getLogger('chromewhip.scripts')
+
+MAX_STEPS = 100
+
+# action -> arguments of which at least one is required
+REQUIRED_ARGS = {
+    'navigate': ('url',),
+    'wait': ('seconds',),
+    'wait_for': ('selector', 'js'),
+    'click': ('selector',),
+    'type': ('text',),
+    'scroll': ('selector', 'y'),
+    'evaluate': ('js',),
+    'screenshot': (),
+    'extract': ('selector',),
+    'html': (),
+}
+
+EXTRACT_SPEC_KEYS = ('selector', 'attribute', 'html', 'all')
+NUMBER_ARGS = ('seconds', 'timeout', 'x', 'y')
+STRING_ARGS = ('url', 'selector', 'text', 'js', 'attribute')
+
+SCROLL_TO_JS = 'window.scrollTo(%s, %s)'
+SCROLL_INTO_VIEW_JS = """
+(() => {
+    const element = document.querySelector(%s);
+    if (element) { element.scrollIntoView(); }
+    return !!element;
+})()
+"""
+
+
+class ScriptError(ChromewhipException):
+    pass
+
+
+def _get_steps(body) -> list:
+    if not isinstance(body, dict) or not isinstance(body.get('steps'), list) or not body['steps']:
+        raise web.HTTPBadRequest(reason='body must be a JSON object with a non empty list of steps')
+    steps = body['steps']
+    if len(steps) > MAX_STEPS:
+        raise web.HTTPBadRequest(reason='a script can have at most %s steps' % MAX_STEPS)
+    for i, step in enumerate(steps):
+        action = step.get('action') if isinstance(step, dict) else None
+        if action not in REQUIRED_ARGS:
+            raise web.HTTPBadRequest(reason='action of step %s must be one of %s' % (
+                i, ', '.join(sorted(REQUIRED_ARGS))))
+        required = REQUIRED_ARGS[action]
+        if required and not any(arg in step for arg in required):
+            raise web.HTTPBadRequest(reason='step %s (%s) requires %s' % (i, action, ' or '.join(required)))
+        for arg in NUMBER_ARGS:
+            if arg in step and (not isinstance(step[arg], (int, float)) or isinstance(step[arg], bool)):
+                raise web.HTTPBadRequest(reason='%s of step %s (%s) must be a number' % (arg, i, action))
+        for arg in STRING_ARGS:
+            if arg in step and not isinstance(step[arg], str):
+                raise web.HTTPBadRequest(reason='%s of step %s (%s) must be a string' % (arg, i, action))
+    return steps
+
+
+async def _value(tab, js: str):
+    result = await tab.evaluate(js, return_by_value=True, await_promise=True)
+    return result['ack']['result']['result'].value
+
+
+async def _run_step(tab, step: dict, max_wait: float = None):
+    """ Run a single step, returning its output if it has one. `wait_for` steps wait at most `max_wait` seconds,
+    their own `timeout` being capped at it.
+    """
+    action = step['action']
+    if action == 'navigate':
+        await tab.go(step['url'])
+    elif action == 'wait':
+        await asyncio.sleep(float(step['seconds']))
+    elif action == 'wait_for':
+        timeout = step.get('timeout')
+        timeout = float(timeout) if timeout is not None else max_wait
+        if timeout is not None and max_wait is not None:
+            timeout = min(timeout, max_wait)
+        if 'selector' in step:
+            ok = await tab.wait_for_selector(step['selector'], timeout=timeout)
+        else:
+            ok = await tab.wait_for_function(step['js'], timeout=timeout)
+        if not ok:
+            raise ScriptError('timed out after %ss waiting for %s' % (timeout, step.get('selector', step.get('js'))))
+    elif action == 'click':
+        await tab.click(step['selector'])
+    elif action == 'type':
+        await tab.type_text(step['text'], selector=step.get('selector'))
+    elif action == 'scroll':
+        if 'selector' in step:
+            if not await _value(tab, SCROLL_INTO_VIEW_JS % json.dumps(step['selector'])):
+                raise ScriptError('no element matches "%s"' % step['selector'])
+        else:
+            await tab.evaluate(SCROLL_TO_JS % (float(step.get('x', 0)), float(step['y'])))
+    elif action == 'evaluate':
+        return await _value(tab, step['js'])
+    elif action == 'screenshot':
+        return base64.b64encode(await tab.screenshot()).decode('ascii')
+    elif action == 'extract':
+        spec = {k: step[k] for k in EXTRACT_SPEC_KEYS if k in step}
+        return (await tab.extract({'value': spec}))['value']
+    elif action == 'html':
+        return (await tab.html()).decode('utf-8')
+
+
+async def _run_script(request: web.Request):
+    steps = request['chromewhip-steps']
+    width, height = get_viewport(request)
+    tab = await acquire_tab(request, width, height)
+    timer = get_timer(request)
+
+    outputs = {}
+    for i, step in enumerate(steps):
+        try:
+            with timer.phase(step['action']):
+                output = await _run_step(tab, step, max_wait=time_left(request))
+        except (ChromewhipException, CommandTimeoutError, ValueError) as e:
+            raise ScriptError({'step': i, 'action': step['action'], 'error': e.args[0] if e.args else repr(e)})
+        if output is not None or step['action'] in ('evaluate', 'extract'):
+            outputs[str(step.get('name', i))] = output
+    return web.json_response({'outputs': outputs})
+
+
+@admission_controlled
+async def _execute(request: web.Request):
+    return await render_within_timeout(request, _run_script)
+
+
+@timed
+async def execute(request: web.Request):
+    # https://splash.readthedocs.io/en/stable/api.html#execute
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(reason='body must be JSON')
+    # validated before waiting for a render slot
+    request['chromewhip-steps'] = _get_steps(body)
+    return await _execute(request)
@@ -0,0 +1,106 @@
+""" Per request phase timing of renders.
+
+Every timed request gets a `PhaseTimer`, which attributes the latency of the render to its phases. The same
+numbers are sent to the client in a `Server-Timing` header, optionally as JSON, fed into the render latency
+histogram and logged when the render is slower than a configurable threshold.
+"""
+import contextlib
+import functools
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from chromewhip.metrics import Histogram
+
+log = logging.getLogger('chromewhip.timing')
+slow_log = logging.getLogger('chromewhip.timing.slow_renders')
+
+TIMINGS_HEADER = 'Chromewhip-Timings'
+
+RENDER_SECONDS = Histogram('chromewhip_render_duration_seconds',
+                           'Render latency by endpoint and phase, where the `total` phase covers the whole render',
+                           ['endpoint', 'phase'])
+
+
+class PhaseTimer:
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.phases = OrderedDict()
+        self._started = time.monotonic()
+        self._total_s = None
+
+    @property
+    def total_s(self):
+        if self._total_s is not None:
+            return self._total_s
+        return time.monotonic() - self._started
+
+    def record(self, name: str, duration_s: float):
+        """ Attribute `duration_s` to phase `name`, adding up repeated phases.
+        """
+        self.phases[name] = self.phases.get(name, 0) + duration_s
+        RENDER_SECONDS.labels(self.endpoint, name).observe(duration_s)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, time.monotonic() - started)
+
+    def stop(self):
+        if self._total_s is None:
+            self._total_s = time.monotonic() - self._started
+            RENDER_SECONDS.labels(self.endpoint, 'total').observe(self._total_s)
+        return self._total_s
+
+    def to_dict(self):
+        """ Phase durations in milliseconds.
+        """
+        return {
+            'phases': OrderedDict((name, round(s * 1000, 1)) for name, s in self.phases.items()),
+            'total': round(self.total_s * 1000, 1),
+        }
+
+    def server_timing(self) -> str:
+        # https://www.w3.org/TR/server-timing/
+        entries = ['%s;dur=%.1f' % (name, s * 1000) for name, s in self.phases.items()]
+        entries.append('total;dur=%.1f' % (self.total_s * 1000))
+        return ', '.join(entries)
+
+    def apply(self, response, with_json: bool = False):
+        response.headers['Server-Timing'] = self.server_timing()
+        if with_json:
+            response.headers[TIMINGS_HEADER] = json.dumps(self.to_dict())
+        return response
+
+
+def get_timer(request) -> PhaseTimer:
+    """ The timer of a timed request, or a throwaway one so that untimed code paths can share helpers.
+    """
+    timer = request.get('chromewhip-timer')
+    if timer is None:
+        timer = request['chromewhip-timer'] = PhaseTimer(request.path)
+    return timer
+
+
+def timed(handler):
+    """ Decorator for views whose phases are reported with `Server-Timing`, outermost so queueing counts.
+    """
+    @functools.wraps(handler)
+    async def wrapper(request):
+        timer = get_timer(request)
+        try:
+            response = await handler(request)
+            return timer.apply(response, with_json=request.query.get('timings') == '1')
+        finally:
+            total_s = timer.stop()
+            threshold = request.app['slow-render-threshold']
+            if threshold is not None and total_s >= threshold:
+                # only the url, as the rest of the query can hold secrets like the `api_key`
+                slow_log.warning('slow render of %.1fms for %s of %s: %s' % (
+                    total_s * 1000, request.path, request.query.get('url'), timer.server_timing()))
+    return wrapper
@@ -1,86 +1,421 @@
 import asyncio
 import functools
+import json
 import logging
 
 from bs4 import BeautifulSoup
 from aiohttp import web
 
+from chromewhip import metrics
+from chromewhip.admission import admission_controlled
+from chromewhip.cache import ResourceCacheHandler
+from chromewhip.chrome import ChromewhipException
+from chromewhip.filters import DEFAULT_FILTER_NAME, NO_FILTERS_NAME
+from chromewhip.interception import RequestInterceptor, build_blocking
+from chromewhip.pool import DEFAULT_VIEWPORT
+from chromewhip.readiness import CONDITIONS, ReadinessWatcher, VirtualTimeBudget
+from chromewhip.timing import get_timer, timed
 from chromewhip.protocol import page, emulation, browser, dom, runtime
 
 BS = functools.partial(BeautifulSoup, features="lxml")
 
+
+def prettify_html(html: bytes) -> str:
+    # module level so it can be pickled into the worker processes of `html-executor`
+    return BS(html.decode()).prettify()
+
 log = logging.getLogger('chromewhip.views')
 
-async def _go(request: web.Request):
+DEFAULT_TIMEOUT_S = 30
+MAX_TIMEOUT_S = 90
+RESET_TIMEOUT_S = 5
+MAX_EXTRACT_SELECTORS = 100
+
+RENDERS = metrics.Counter('chromewhip_renders_total', 'Renders by endpoint and outcome', ['endpoint', 'outcome'])
+TAB_POOL_TABS = metrics.Gauge('chromewhip_tab_pool_tabs', 'Tabs in the pool, by state', ['state'])
+RENDER_QUEUE = metrics.Gauge('chromewhip_render_queue_renders', 'Renders admitted or queued, by state', ['state'])
+CHROME_RSS = metrics.Gauge('chromewhip_chrome_rss_bytes', 'Resident memory of Chrome and all of its child processes')
+CACHE_BYTES = metrics.Gauge('chromewhip_resource_cache_bytes', 'Size of the shared subresource cache, by storage',
+                            ['storage'])
+
+
+class GlobalTimeoutError(ChromewhipException):
+
+    def __init__(self, message, timeout):
+        super().__init__(message)
+        self.timeout = timeout
+
+
+def _get_timeout(request: web.Request) -> float:
+    max_timeout = request.app['max-timeout']
+    try:
+        timeout = float(request.query.get('timeout', min(DEFAULT_TIMEOUT_S, max_timeout)))
+    except ValueError:
+        raise web.HTTPBadRequest(reason='timeout must be a number')
+    if not 0 < timeout <= max_timeout:
+        raise web.HTTPBadRequest(reason='timeout must be greater than 0 and at most %s' % max_timeout)
+    return timeout
+
+
+def _get_filters(request: web.Request):
+    filters = request.app['filters']
+    raw_filters = request.query.get('filters')
+    if raw_filters is None:
+        default = filters.get(DEFAULT_FILTER_NAME)
+        return [default] if default else []
+    names = [n.strip() for n in raw_filters.split(',') if n.strip()]
+    if names == [NO_FILTERS_NAME]:
+        return []
+    invalid = [n for n in names if n not in filters]
+    if invalid:
+        raise web.HTTPBadRequest(reason='Invalid filter names: %s' % ', '.join(invalid))
+    return [filters[n] for n in names]
+
+
+def _get_ready(request: web.Request):
+    ready = request.query.get('ready')
+    if ready is not None and ready not in CONDITIONS:
+        raise web.HTTPBadRequest(reason='ready must be one of %s' % ', '.join(CONDITIONS))
+    return ready
+
+
+def _get_virtual_time_budget(request: web.Request):
+    raw_budget = request.query.get('virtual_time_budget')
+    if raw_budget is None:
+        return None
+    try:
+        budget_ms = float(raw_budget)
+    except ValueError:
+        raise web.HTTPBadRequest(reason='virtual_time_budget must be a number')
+    if budget_ms <= 0:
+        raise web.HTTPBadRequest(reason='virtual_time_budget must be greater than 0')
+    return budget_ms
+
+
+def _get_extract_specs(request: web.Request):
+    """ The `selectors` query param, a JSON object mapping names to a CSS selector or to an object with a
+    `selector` and optionally an `attribute` to extract, `html` for the outer html and `all` for every match.
+    """
+    raw_selectors = request.query.get('selectors')
+    if not raw_selectors:
+        raise web.HTTPBadRequest(reason='no selectors query param provided')
+    try:
+        selectors = json.loads(raw_selectors)
+    except ValueError:
+        selectors = None
+    if not isinstance(selectors, dict) or not selectors:
+        raise web.HTTPBadRequest(reason='selectors must be a non empty JSON object')
+    if len(selectors) > MAX_EXTRACT_SELECTORS:
+        raise web.HTTPBadRequest(reason='at most %s selectors can be extracted' % MAX_EXTRACT_SELECTORS)
+
+    specs = {}
+    for name, spec in selectors.items():
+        if isinstance(spec, str):
+            spec = {'selector': spec}
+        if not isinstance(spec, dict) or not isinstance(spec.get('selector'), str):
+            raise web.HTTPBadRequest(reason='selector "%s" must be a string or an object with a selector' % name)
+        if spec.get('attribute') is not None and not isinstance(spec['attribute'], str):
+            raise web.HTTPBadRequest(reason='attribute of selector "%s" must be a string' % name)
+        specs[name] = {'selector': spec['selector'], 'attribute': spec.get('attribute'),
+                       'html': bool(spec.get('html')), 'all': bool(spec.get('all'))}
+    return specs
+
+
+async def _setup_interception(request: web.Request, tab, url: str):
+    blocked_resource_types = set()
+    if request.query.get('images', '1') == '0':
+        blocked_resource_types.add('Image')
+
+    handlers = []
+    native_urls, filter_handler = build_blocking(_get_filters(request), blocked_resource_types, document_url=url)
+    if native_urls:
+        # blocked URLs only apply while the Network domain is enabled
+        await tab.domains.acquire('Network')
+        request['chromewhip-network-enabled'] = True
+    await tab.set_blocked_urls(native_urls)
+    if filter_handler:
+        handlers.append(filter_handler)
+
+    cache = request.app['resource-cache']
+    if cache and request.query.get('resource_cache', '1') != '0':
+        handlers.append(ResourceCacheHandler(tab, cache))
+
+    if handlers:
+        interceptor = RequestInterceptor(tab, handlers=handlers)
+        request['chromewhip-interceptor'] = interceptor
+        await interceptor.start()
+
+
+async def _reset_tab(request: web.Request, tab):
+    interceptor = request.get('chromewhip-interceptor')
+    if interceptor:
+        await interceptor.stop()
+    watcher = request.get('chromewhip-readiness')
+    if watcher:
+        await watcher.stop()
+    virtual_time = request.get('chromewhip-virtual-time')
+    if virtual_time:
+        virtual_time.stop()
+    if request.get('chromewhip-timed-out'):
+        # the page may still be loading or running scripts, so leave it before anyone else gets the tab
+        await tab.stop_loading()
+        await tab.go('about:blank')
+    if request.get('chromewhip-page-enabled'):
+        await tab.disable_page_events()
+    if request.get('chromewhip-network-enabled'):
+        await tab.domains.release('Network')
+
+
+async def _teardown(request: web.Request):
+    tab = request.get('chromewhip-tab')
+    if not tab:
+        return
+    pool = request.app['tab-pool']
+    if request.get('chromewhip-cancelled'):
+        # the page may still be loading, and resetting it could be cancelled in turn, so replace it without waiting
+        pool.replace(tab)
+        return
+    try:
+        await asyncio.wait_for(_reset_tab(request, tab), timeout=RESET_TIMEOUT_S)
+    except Exception:
+        log.exception('Unable to reset tab %r, replacing it' % tab)
+        pool.discard(tab)
+    else:
+        if request.get('chromewhip-virtual-time'):
+            # virtual time can't be turned off again
+            pool.replace(tab)
+        else:
+            pool.recycle(tab)
+
+
+async def render_within_timeout(request: web.Request, render):
+    """ Run `render` within the time budget of the request, always handing the tab back to the pool.
+    """
+    timeout = _get_timeout(request)
+    request['chromewhip-deadline'] = asyncio.get_event_loop().time() + timeout
+    outcome = 'error'
+    try:
+        response = await asyncio.wait_for(render(request), timeout=timeout)
+        outcome = 'ok'
+        return response
+    except asyncio.TimeoutError:
+        outcome = 'timeout'
+        request['chromewhip-timed-out'] = True
+        raise GlobalTimeoutError('Timeout exceeded rendering page', timeout)
+    except asyncio.CancelledError:
+        # such as when the client of a batch or crawl went away
+        outcome = 'cancelled'
+        request['chromewhip-cancelled'] = True
+        raise
+    finally:
+        RENDERS.labels(request.path, outcome).inc()
+        await _teardown(request)
+
+
+def time_left(request: web.Request) -> float:
+    """ Seconds left of the time budget of a render run by `render_within_timeout`.
+    """
+    return max(request['chromewhip-deadline'] - asyncio.get_event_loop().time(), 0)
+
+
+def get_viewport(request: web.Request, raw_viewport: str = None):
+    raw_viewport = raw_viewport or request.query.get('viewport')
+    if not raw_viewport:
+        return DEFAULT_VIEWPORT
+    try:
+        width, height = (int(p) for p in raw_viewport.split('x'))
+    except ValueError:
+        raise web.HTTPBadRequest(reason='viewport must be of the form <width>x<height>')
+    return width, height
+
+
+async def acquire_tab(request: web.Request, width: int, height: int):
+    """ Take a tab from the pool for the request, emulating a `width` x `height` viewport with page events enabled.
+
+    The tab goes back to the pool once the render passed to `render_within_timeout` is done.
+    """
+    timer = get_timer(request)
+    with timer.phase('tab'):
+        tab = await request.app['tab-pool'].acquire(viewport=(width, height))
+    request['chromewhip-tab'] = tab
+    with timer.phase('setup'):
+        await tab.set_device_metrics(width, height)
+        await tab.enable_page_events()
+        request['chromewhip-page-enabled'] = True
+    return tab
+
+
+async def _wait_until_ready(request: web.Request, tab, watcher, wait_s: float):
+    """ Sleep for `wait`, unless the request has readiness conditions, which `wait` then bounds instead, or else
+    the time left of the render.
+    """
+    wait_for = request.query.get('wait_for')
+    wait_for_js = request.query.get('wait_for_js')
+    virtual_time = request.get('chromewhip-virtual-time')
+    if not (watcher or wait_for or wait_for_js or virtual_time):
+        await asyncio.sleep(wait_s)
+        return
+
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + (min(wait_s, time_left(request)) if wait_s else time_left(request))
+
+    def remaining():
+        return max(deadline - loop.time(), 0)
 
+    if watcher:
+        await watcher.wait(timeout=remaining())
+    if virtual_time:
+        await virtual_time.wait(timeout=remaining())
+    if wait_for:
+        await tab.wait_for_selector(wait_for, timeout=remaining())
+    if wait_for_js:
+        await tab.wait_for_function(wait_for_js, timeout=remaining())
+
+
+async def load_page(request: web.Request):
+    """ Take a tab and load the `url` of the request in it as the render query params ask, returning the tab.
+    """
     js_profiles = request.app['js-profiles']
-    c = request.app['chrome-driver']
 
     url = request.query.get('url')
     if not url:
-        return web.HTTPBadRequest(reason='no url query param provided')  # TODO: match splash reply
+        raise web.HTTPBadRequest(reason='no url query param provided')  # TODO: match splash reply
 
     wait_s = float(request.query.get('wait', 0))
+    ready = _get_ready(request)
+    virtual_time_budget = _get_virtual_time_budget(request)
 
-    raw_viewport = request.query.get('viewport', '1024x768')
-    parts = raw_viewport.split('x')
-    width = int(parts[0])
-    height = int(parts[1])
+    width, height = get_viewport(request)
 
+    profile = None
     js_profile_name = request.query.get('js', None)
     if js_profile_name:
         profile = js_profiles.get(js_profile_name)
         if not profile:
-            return web.HTTPBadRequest(reason='profile name is incorrect')  # TODO: match splash
+            raise web.HTTPBadRequest(reason='profile name is incorrect')  # TODO: match splash
 
     # TODO: potentially validate and verify js source for errors and security concerrns
     js_source = request.query.get('js_source', None)
 
-    await c.connect()
-    tab = c.tabs[0]
-    cmd = page.Page.setDeviceMetricsOverride(width=width,
-                                             height=height,
-                                             deviceScaleFactor=0.0,
-                                             mobile=False)
-    await tab.send_command(cmd)
-    await tab.enable_page_events()
-    await tab.go(url)
-    await asyncio.sleep(wait_s)
-    if js_profile_name:
-        await tab.evaluate(js_profiles[js_profile_name])
+    timer = get_timer(request)
+    tab = await acquire_tab(request, width, height)
+    with timer.phase('setup'):
+        await _setup_interception(request, tab, url)
+        await tab.set_new_document_scripts(profile.new_document_scripts() if profile else {})
+    if virtual_time_budget:
+        virtual_time = request['chromewhip-virtual-time'] = VirtualTimeBudget(tab, virtual_time_budget)
+        await virtual_time.start()
+    watcher = None
+    if ready:
+        watcher = request['chromewhip-readiness'] = ReadinessWatcher(tab, ready)
+        await watcher.start()
+    with timer.phase('navigation'):
+        if watcher:
+            await watcher.navigate(url)
+        else:
+            await tab.go(url)
+    with timer.phase('wait'):
+        await _wait_until_ready(request, tab, watcher, wait_s)
+    with timer.phase('js'):
+        if profile and profile.run_expression():
+            await tab.evaluate(profile.run_expression())
 
-    if js_source:
-        await tab.evaluate(js_source)
+        if js_source:
+            await tab.evaluate(js_source)
 
     return tab
 
 
+@timed
+@admission_controlled
 async def render_html(request: web.Request):
     # https://splash.readthedocs.io/en/stable/api.html#render-html
-    tab = await _go(request)
-    return web.Response(text=BS((await tab.html()).decode()).prettify())
+    return await render_within_timeout(request, _render_html)
+
+
+async def _render_html(request: web.Request):
+    tab = await load_page(request)
+    timer = get_timer(request)
+    with timer.phase('serialize'):
+        html = await tab.html()
+
+    raw_prettify = request.query.get('prettify')
+    should_prettify = request.app['prettify-html'] if raw_prettify is None else raw_prettify == '1'
+    if not should_prettify:
+        return web.Response(body=html, content_type='text/html', charset='utf-8')
+
+    with timer.phase('prettify'):
+        # parsing large pages takes hundreds of milliseconds, which must not block the event loop
+        loop = asyncio.get_event_loop()
+        text = await loop.run_in_executor(request.app['html-executor'], prettify_html, html)
+    return web.Response(text=text, content_type='text/html')
+
+
+@timed
+@admission_controlled
+async def render_txt(request: web.Request):
+    return await render_within_timeout(request, _render_txt)
+
+
+async def _render_txt(request: web.Request):
+    tab = await load_page(request)
+    timer = get_timer(request)
+    with timer.phase('serialize'):
+        text = await tab.text()
+    return web.Response(text=text, content_type='text/plain')
+
+
+@timed
+@admission_controlled
+async def render_links(request: web.Request):
+    return await render_within_timeout(request, _render_links)
 
 
+async def _render_links(request: web.Request):
+    tab = await load_page(request)
+    timer = get_timer(request)
+    with timer.phase('serialize'):
+        links = await tab.links(same_origin=request.query.get('same_origin') == '1')
+    return web.json_response(links)
+
+
+@timed
+@admission_controlled
+async def render_extract(request: web.Request):
+    return await render_within_timeout(request, _render_extract)
+
+
+async def _render_extract(request: web.Request):
+    # validated before the page is loaded for nothing
+    specs = _get_extract_specs(request)
+    tab = await load_page(request)
+    timer = get_timer(request)
+    with timer.phase('extract'):
+        values = await tab.extract(specs)
+    return web.json_response(values)
+
+
+@timed
+@admission_controlled
 async def render_png(request: web.Request):
     # https://splash.readthedocs.io/en/stable/api.html#render-png
-    tab = await _go(request)
+    return await render_within_timeout(request, _render_png)
+
+
+async def _render_png(request: web.Request):
+    tab = await load_page(request)
+    timer = get_timer(request)
 
     should_render_all = True if request.query.get('render_all', False) == '1' else False
 
     if not should_render_all:
-        data = await tab.screenshot()
+        with timer.phase('screenshot'):
+            data = await tab.screenshot()
         return web.Response(body=data, content_type='image/png')
 
     if should_render_all:
-        raw_viewport = request.query.get('viewport', '1024x768')
-        parts = raw_viewport.split('x')
-        width = int(parts[0])
-        height = int(parts[1])
-        cmd = page.Page.setDeviceMetricsOverride(width=int(width),
-                                                 height=int(height),
-                                                 deviceScaleFactor=0.0,
-                                                 mobile=False)
-        await tab.send_command(cmd)
+        width, height = get_viewport(request)
+        await tab.set_device_metrics(width, height)
 
         # model numbers affected by device metrics, so needs to come after
         res = await tab.send_command(dom.DOM.getDocument())
@@ -91,20 +426,49 @@ async def render_png(request: web.Request):
         full_height = res['ack']['result']['model'].height
         log.debug('full_height = %s' % full_height)
 
-        offset = 0
-        import base64
-        from PIL import Image
-        from io import BytesIO
-        full_image = Image.new('RGB', (int(width), int(full_height)))
-        delta = int(height)
-        while offset < full_height + 1:  # TODO: cut+paste to exact dimensions
-            await tab.send_command(runtime.Runtime.evaluate('window.scrollTo(0, %s)' % offset))
-            result = await tab.send_command(page.Page.captureScreenshot(format='png', fromSurface=False))
-            base64_data = result['ack']['result']['data']
-            snapshot = Image.open(BytesIO(base64.b64decode(base64_data)))
-            full_image.paste(snapshot, (0, offset))
-            offset += delta
-        output = BytesIO()
-        full_image.save(output, format='png')
-        return web.Response(body=output.getvalue(), content_type='image/png')
+        with timer.phase('screenshot'):
+            data = await _capture_full_page(tab, width, height, full_height)
+        return web.Response(body=data, content_type='image/png')
+
+
+async def _capture_full_page(tab, width, height, full_height):
+    offset = 0
+    import base64
+    from PIL import Image
+    from io import BytesIO
+    full_image = Image.new('RGB', (int(width), int(full_height)))
+    delta = int(height)
+    while offset < full_height + 1:  # TODO: cut+paste to exact dimensions
+        await tab.send_command(runtime.Runtime.evaluate('window.scrollTo(0, %s)' % offset))
+        result = await tab.send_command(page.Page.captureScreenshot(format='png', fromSurface=tab.from_surface))
+        base64_data = result['ack']['result']['data']
+        snapshot = Image.open(BytesIO(base64.b64decode(base64_data)))
+        full_image.paste(snapshot, (0, offset))
+        offset += delta
+    output = BytesIO()
+    full_image.save(output, format='png')
+    return output.getvalue()
+
+
+async def render_metrics(request: web.Request):
+    pool = request.app['tab-pool']
+    TAB_POOL_TABS.labels('in_use').set(pool.in_use)
+    TAB_POOL_TABS.labels('idle').set(pool.idle)
+    TAB_POOL_TABS.labels('max').set(pool.size)
+
+    controller = request.app['admission-controller']
+    RENDER_QUEUE.labels('running').set(controller.running)
+    RENDER_QUEUE.labels('queued').set(controller.queued)
+
+    cache = request.app['resource-cache']
+    if cache:
+        CACHE_BYTES.labels('memory').set(cache.memory_bytes)
+        CACHE_BYTES.labels('disk').set(cache.disk_bytes)
+
+    chrome = request.app.get('chrome-process')
+    rss = metrics.process_tree_rss(chrome.pid) if chrome else None
+    if rss is not None:
+        CHROME_RSS.set(rss)
+
+    return web.Response(text=metrics.REGISTRY.expose(), headers={'Content-Type': metrics.CONTENT_TYPE})
 
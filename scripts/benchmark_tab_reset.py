@@ -0,0 +1,79 @@
+""" Compares the cost of the ways a tab can be made clean for the next render, against a running Chrome:
+resetting it in place, closing it and creating a new tab, or creating a new tab in a browser context of its own.
+
+    python scripts/benchmark_tab_reset.py --url https://example.com --iterations 20
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+sys.path.insert(0, "../")
+sys.path.insert(0, ".")
+
+from chromewhip.chrome import Chrome
+
+
+async def _load(tab, url):
+    await tab.enable_page_events()
+    try:
+        await tab.go(url)
+    finally:
+        await tab.disable_page_events()
+
+
+async def reset_page(chrome, tab):
+    await tab.reset(clear_storage=False)
+    return tab
+
+
+async def reset_storage(chrome, tab):
+    await tab.reset()
+    return tab
+
+
+async def recreate(chrome, tab):
+    await chrome.close_tab(tab)
+    return await chrome.create_tab()
+
+
+async def new_context(chrome, tab):
+    await chrome.close_tab(tab)
+    return await chrome.create_tab(browser_context=True)
+
+
+STRATEGIES = {
+    'reset page': reset_page,
+    'reset storage': reset_storage,
+    'recreate tab': recreate,
+    'new browser context': new_context,
+}
+
+
+async def benchmark(host, port, url, iterations):
+    chrome = Chrome(host=host, port=port)
+    await chrome.connect()
+    for name, strategy in STRATEGIES.items():
+        tab = await chrome.create_tab()
+        timings = []
+        for _ in range(iterations):
+            await _load(tab, url)
+            start = time.perf_counter()
+            tab = await strategy(chrome, tab)
+            timings.append((time.perf_counter() - start) * 1000)
+        await chrome.close_tab(tab)
+        timings.sort()
+        print('%-20s median %7.1fms  mean %7.1fms  p95 %7.1fms' % (
+            name, statistics.median(timings), statistics.mean(timings),
+            timings[min(len(timings) - 1, int(len(timings) * 0.95))]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=9222)
+    parser.add_argument('--url', default='https://example.com')
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(benchmark(args.host, args.port, args.url, args.iterations))
@@ -1,5 +1,10 @@
 #!/bin/bash
 
+if [ -n "$CHROMEWHIP_HEADLESS" ]; then
+    echo "Starting Chromewhip headless..."
+    exec python3.6 -m chromewhip.__init__ --js-profiles-path /usr/jsprofiles --headless
+fi
+
 echo "Starting window manager..."
 fluxbox -display $DISPLAY &
 
@@ -1,11 +1,119 @@
 # https://github.com/pytest-dev/pytest-asyncio/issues/52
 # pytest_plugins = 'aiohttp.pytest_plugin'
 
+import asyncio
 import pytest
 import os
 import sys
+import types
 
 PACKAGE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 
 sys.path.append(PACKAGE_DIR)
 
+from chromewhip.chrome import DomainManager  # noqa: E402 needs PACKAGE_DIR on the path
+
+
+class FakeTab:
+    """ Stands in for a `ChromeTab`, recording what is done to it. `values` are the results of selectors and
+    scripts on its page.
+    """
+
+    def __init__(self, name='tab', viewport=None, values=None):
+        self.name = name
+        self.viewport = viewport
+        self.values = values or {}
+        self.blocked_urls = []
+        self.calls = []
+        self.sent = []
+        self.resets = []
+        self.handlers = {}
+        self.domains = DomainManager(self)
+
+    async def send_command(self, command, **kwargs):
+        await asyncio.sleep(0)
+        self.sent.append(command[0]['method'])
+        return {'ack': {'result': {'frameId': 'frame', 'loaderId': 'loader'}}}
+
+    def add_event_handler(self, event_cls, coro):
+        self.handlers.setdefault(event_cls.js_name, []).append(coro)
+
+    def remove_event_handler(self, event_cls, coro):
+        self.handlers[event_cls.js_name].remove(coro)
+
+    async def emit(self, event):
+        for coro in self.handlers.get(event.js_name, []):
+            await coro(event)
+
+    async def set_blocked_urls(self, urls):
+        self.blocked_urls = urls
+
+    async def set_device_metrics(self, width, height):
+        self.viewport = (width, height)
+
+    async def enable_page_events(self):
+        self.calls.append('enable_page_events')
+
+    async def disable_page_events(self):
+        self.calls.append('disable_page_events')
+
+    async def stop_loading(self):
+        self.calls.append('stop_loading')
+
+    async def reset(self, clear_storage=True):
+        self.resets.append(clear_storage)
+
+    async def go(self, url):
+        self.calls.append(('go', url))
+
+    async def click(self, selector):
+        self.calls.append(('click', selector))
+
+    async def type_text(self, text, selector=None):
+        self.calls.append(('type', text, selector))
+
+    async def wait_for_selector(self, selector, timeout=None):
+        self.calls.append(('wait_for_selector', selector, timeout))
+        return selector in self.values
+
+    async def evaluate(self, javascript, return_by_value=None, await_promise=None):
+        self.calls.append(('evaluate', javascript))
+        value = self.values.get(javascript.strip().splitlines()[0])
+        return {'ack': {'result': {'result': types.SimpleNamespace(value=value)}}}
+
+    async def extract(self, specs):
+        return {name: self.values.get(spec['selector']) for name, spec in specs.items()}
+
+    async def screenshot(self):
+        return b'\x89PNG'
+
+    async def html(self):
+        return b'<html></html>'
+
+
+class FakeChrome:
+    """ Stands in for `Chrome`, starting with tabs named `startup_tabs` and naming the tabs it creates in order.
+    """
+    tab_class = FakeTab
+
+    def __init__(self, *startup_tabs):
+        self._tabs = [self.tab_class(name) for name in startup_tabs]
+        self.created = 0
+        self.closed = []
+
+    async def connect(self):
+        pass
+
+    @property
+    def tabs(self):
+        return tuple(self._tabs)
+
+    async def create_tab(self, browser_context=False):
+        self.created += 1
+        tab = self.tab_class('%s-%s' % ('context-tab' if browser_context else 'tab', self.created))
+        self._tabs.append(tab)
+        return tab
+
+    async def close_tab(self, tab):
+        self.closed.append(tab)
+        self._tabs.remove(tab)
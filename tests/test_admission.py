@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from chromewhip.admission import AdmissionController, AdmissionRejected
+
+
+@pytest.mark.asyncio
+async def test_admits_up_to_concurrency_then_queues():
+    controller = AdmissionController(max_concurrency=2)
+    t1 = await controller.acquire('a')
+    t2 = await controller.acquire('b')
+    waiting = asyncio.ensure_future(controller.acquire('c'))
+    await asyncio.sleep(0)
+    assert controller.running == 2
+    assert controller.queued == 1
+    controller.release(t1)
+    t3 = await waiting
+    assert t3.client_id == 'c'
+    assert controller.queued == 0
+    controller.release(t2)
+    controller.release(t3)
+    assert controller.running == 0
+
+
+@pytest.mark.asyncio
+async def test_rejects_when_queue_is_full():
+    controller = AdmissionController(max_concurrency=1, max_queue_size=1)
+    await controller.acquire('a')
+    waiting = asyncio.ensure_future(controller.acquire('b'))
+    await asyncio.sleep(0)
+    with pytest.raises(AdmissionRejected) as exc_info:
+        await controller.acquire('c')
+    assert exc_info.value.retry_after >= 1
+    waiting.cancel()
+
+
+@pytest.mark.asyncio
+async def test_rejects_after_max_wait():
+    controller = AdmissionController(max_concurrency=1, max_wait_s=0.05)
+    await controller.acquire('a')
+    with pytest.raises(AdmissionRejected):
+        await controller.acquire('b')
+    assert controller.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_per_client_limit():
+    controller = AdmissionController(max_concurrency=4, max_per_client=1, clients={'vip': {'max_per_client': 2}})
+    await controller.acquire('a')
+    with pytest.raises(AdmissionRejected):
+        await controller.acquire('a')
+    await controller.acquire('vip')
+    await controller.acquire('vip')
+
+
+@pytest.mark.asyncio
+async def test_higher_priority_is_admitted_first():
+    controller = AdmissionController(max_concurrency=1)
+    ticket = await controller.acquire('a')
+    low = asyncio.ensure_future(controller.acquire('b', 'low'))
+    await asyncio.sleep(0)
+    high = asyncio.ensure_future(controller.acquire('c', 'high'))
+    await asyncio.sleep(0)
+    controller.release(ticket)
+    high_ticket = await asyncio.wait_for(high, timeout=1)
+    assert not low.done()
+    controller.release(high_ticket)
+    await low
+
+
+def test_priority_can_only_be_lowered():
+    controller = AdmissionController(max_concurrency=1, clients={'vip': {'priority': 'high'}})
+    assert controller.priority_for('someone', 'high') == 'normal'
+    assert controller.priority_for('someone', 'low') == 'low'
+    assert controller.priority_for('vip') == 'high'
+
+
+@pytest.mark.asyncio
+async def test_waiting_clients_are_admitted_round_robin():
+    controller = AdmissionController(max_concurrency=1, clients={'heavy': {'weight': 2}})
+    ticket = await controller.acquire('x')
+    admitted = []
+
+    async def render(client_id):
+        t = await controller.acquire(client_id)
+        admitted.append(client_id)
+        await asyncio.sleep(0)
+        controller.release(t)
+
+    renders = [asyncio.ensure_future(render(c)) for c in ['a'] * 3 + ['b'] * 2 + ['heavy'] * 3]
+    await asyncio.sleep(0)
+    controller.release(ticket)
+    await asyncio.gather(*renders)
+    assert admitted == ['a', 'b', 'heavy', 'heavy', 'a', 'b', 'heavy', 'a']
+
+
+@pytest.mark.asyncio
+async def test_per_host_limit_lets_other_hosts_go_ahead():
+    controller = AdmissionController(max_concurrency=3, max_per_host=1)
+    t1 = await controller.acquire('a', host='slow.com')
+    blocked = asyncio.ensure_future(controller.acquire('a', host='slow.com'))
+    await asyncio.sleep(0)
+    assert controller.queued == 1
+    t2 = await asyncio.wait_for(controller.acquire('b', host='fast.com'), timeout=1)
+    assert not blocked.done()
+    controller.release(t1)
+    t3 = await asyncio.wait_for(blocked, timeout=1)
+    assert t3.host == 'slow.com'
+    for t in (t2, t3):
+        controller.release(t)
+    assert controller.running == 0
+
+
+@pytest.mark.asyncio
+async def test_running_per_client_limit():
+    controller = AdmissionController(max_concurrency=2, max_running_per_client=1)
+    t1 = await controller.acquire('a')
+    waiting = asyncio.ensure_future(controller.acquire('a'))
+    await asyncio.sleep(0)
+    t2 = await asyncio.wait_for(controller.acquire('b'), timeout=1)
+    assert not waiting.done()
+    controller.release(t1)
+    controller.release(await asyncio.wait_for(waiting, timeout=1))
+    controller.release(t2)
@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from chromewhip import batch
+from chromewhip.middleware import error_middleware
+
+
+class FakePool:
+    size = 2
+
+
+async def fake_render(request):
+    if request.query['url'] == 'bad':
+        raise web.HTTPBadRequest(reason='bad url')
+    await asyncio.sleep(float(request.query.get('wait', 0)))
+    return web.Response(text=request.query['url'], content_type='text/html')
+
+
+async def fake_png(request):
+    return web.Response(body=b'\x89PNG', content_type='image/png')
+
+
+@pytest.fixture
+def endpoints(monkeypatch):
+    monkeypatch.setattr(batch, 'ENDPOINTS', {'html': ('/render.html', fake_render), 'png': ('/render.png', fake_png)})
+
+
+async def post_batch(body):
+    app = web.Application(middlewares=[error_middleware])
+    app['tab-pool'] = FakePool()
+    app.router.add_post('/render.batch', batch.render_batch)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try:
+        resp = await client.post('/render.batch', data=json.dumps(body))
+        return resp.headers['Content-Type'], await resp.text()
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_batch_streams_results_as_they_complete(endpoints):
+    content_type, text = await post_batch({'renders': [
+        {'id': 'slow', 'url': 'http://slow', 'wait': 0.05},
+        {'id': 'fast', 'url': 'http://fast'},
+        {'id': 'image', 'endpoint': 'png', 'url': 'http://image'},
+        {'id': 'error', 'url': 'bad'},
+    ]})
+    assert content_type == batch.CONTENT_TYPE
+    results = [json.loads(line) for line in text.splitlines()]
+    assert results[-1]['id'] == 'slow'
+    by_id = {r['id']: r for r in results}
+    assert by_id['fast']['body'] == 'http://fast'
+    assert by_id['image']['body_base64'] == 'iVBORw=='
+    assert json.loads(by_id['error']['body'])['error'] == 'bad url'
+
+
+def test_batch_validation():
+    with pytest.raises(web.HTTPBadRequest):
+        batch._get_renders({'renders': []}, 4)
+    with pytest.raises(web.HTTPBadRequest):
+        batch._get_renders({'renders': [{'id': 1}, {'id': 1}]}, 4)
+    with pytest.raises(web.HTTPBadRequest):
+        batch._get_renders({'renders': [{'endpoint': 'pdf'}]}, 4)
+    specs, concurrency = batch._get_renders({'renders': [{'url': 'http://a', 'wait': 1}], 'concurrency': 10}, 4)
+    assert specs == [(0, 'html', {'url': 'http://a', 'wait': '1'})]
+    assert concurrency == 4
@@ -0,0 +1,133 @@
+import asyncio
+import base64
+import time
+from email.utils import formatdate
+
+import pytest
+
+from chromewhip.cache import CacheEntry, ResourceCache, build_raw_response, freshness_lifetime
+
+CACHEABLE_HEADERS = {'Content-Type': 'application/javascript', 'Cache-Control': 'public, max-age=600',
+                     'Content-Encoding': 'gzip'}
+
+
+def test_freshness_lifetime_from_max_age():
+    assert freshness_lifetime({'Cache-Control': 'max-age=60'}) == 60
+    assert freshness_lifetime({'cache-control': 'max-age=60, s-maxage=120'}) == 120
+    assert freshness_lifetime({'Cache-Control': 'max-age=60', 'Age': '20'}) == 40
+
+
+def test_freshness_lifetime_from_expires():
+    now = time.time()
+    lifetime = freshness_lifetime({'Expires': formatdate(now + 100, usegmt=True)}, now=now)
+    assert 98 < lifetime <= 100
+
+
+@pytest.mark.parametrize('headers', [
+    {},
+    {'Cache-Control': 'no-store, max-age=60'},
+    {'Cache-Control': 'private, max-age=60'},
+    {'Cache-Control': 'max-age=0'},
+    {'Cache-Control': 'max-age=60', 'Set-Cookie': 'a=b'},
+    {'Cache-Control': 'max-age=60', 'Vary': 'Cookie'},
+])
+def test_freshness_lifetime_uncacheable(headers):
+    assert freshness_lifetime(headers) is None
+
+
+def test_freshness_lifetime_of_authorized_response():
+    assert freshness_lifetime({'Cache-Control': 'max-age=60'}, authorized=True) is None
+    assert freshness_lifetime({'Cache-Control': 'public, max-age=60'}, authorized=True) == 60
+
+
+@pytest.mark.asyncio
+async def test_put_and_get_from_memory():
+    cache = ResourceCache(max_memory_bytes=1024)
+    assert await cache.get('http://example.com/app.js') is None
+    entry = await cache.put('http://example.com/app.js', 200, CACHEABLE_HEADERS, b'var a = 1;')
+    assert 'Content-Encoding' not in entry.headers
+    entry, body = await cache.get('http://example.com/app.js')
+    assert body == b'var a = 1;'
+    assert cache.stats['hits'] == 1
+    assert cache.stats['misses'] == 1
+
+
+@pytest.mark.asyncio
+async def test_uncacheable_response_is_not_stored():
+    cache = ResourceCache(max_memory_bytes=1024)
+    assert await cache.put('http://example.com/a.js', 200, {'Cache-Control': 'no-store'}, b'x') is None
+    assert await cache.put('http://example.com/b.js', 404, CACHEABLE_HEADERS, b'x') is None
+    assert cache.memory_bytes == 0
+
+
+@pytest.mark.asyncio
+async def test_identical_bodies_are_stored_once():
+    cache = ResourceCache(max_memory_bytes=1024)
+    await cache.put('http://a.example.com/lib.js', 200, CACHEABLE_HEADERS, b'x' * 100)
+    await cache.put('http://b.example.com/lib.js', 200, CACHEABLE_HEADERS, b'x' * 100)
+    assert cache.memory_bytes == 100
+
+
+@pytest.mark.asyncio
+async def test_memory_is_bounded():
+    cache = ResourceCache(max_memory_bytes=250)
+    for i in range(3):
+        await cache.put('http://example.com/%s.js' % i, 200, CACHEABLE_HEADERS, bytes([i]) * 100)
+    assert cache.memory_bytes == 200
+    assert await cache.get('http://example.com/0.js') is None
+    assert await cache.get('http://example.com/2.js') is not None
+
+
+@pytest.mark.asyncio
+async def test_memory_entries_are_bounded(tmpdir):
+    # bodies too large for memory still have their entries remembered
+    cache = ResourceCache(max_memory_bytes=0, path=str(tmpdir), max_memory_entries=2)
+    for i in range(3):
+        await cache.put('http://example.com/%s.js' % i, 200, CACHEABLE_HEADERS, bytes([i]))
+    assert list(cache._entries) == ['http://example.com/1.js', 'http://example.com/2.js']
+    # evicted entries are looked up on disk
+    _, body = await cache.get('http://example.com/0.js')
+    assert body == bytes([0])
+
+
+@pytest.mark.asyncio
+async def test_disk_cache_survives_new_instance(tmpdir):
+    cache = ResourceCache(max_memory_bytes=0, path=str(tmpdir))
+    await cache.put('http://example.com/app.css', 200, CACHEABLE_HEADERS, b'body {}')
+    # the body and its entry
+    disk_bytes = cache.disk_bytes
+    assert disk_bytes > len(b'body {}')
+
+    cache = ResourceCache(max_memory_bytes=1024, path=str(tmpdir))
+    assert cache.disk_bytes == disk_bytes
+    _, body = await cache.get('http://example.com/app.css')
+    assert body == b'body {}'
+
+
+@pytest.mark.asyncio
+async def test_disk_cache_is_bounded(tmpdir):
+    cache = ResourceCache(max_memory_bytes=0, path=str(tmpdir), max_disk_bytes=1000)
+    await asyncio.gather(*(cache.put('http://example.com/%s.js' % i, 200, CACHEABLE_HEADERS, bytes([i]) * 100)
+                           for i in range(20)))
+    assert cache.disk_bytes <= 1000
+    on_disk = sum(f.size() for f in tmpdir.visit() if f.isfile())
+    assert cache.disk_bytes == on_disk
+
+
+@pytest.mark.asyncio
+async def test_build_raw_response():
+    cache = ResourceCache(max_memory_bytes=1024)
+    entry = await cache.put('http://example.com/app.js', 200, CACHEABLE_HEADERS, b'var a = 1;')
+    raw = base64.b64decode(build_raw_response(entry, b'var a = 1;'))
+    head, body = raw.split(b'\r\n\r\n', 1)
+    assert head.startswith(b'HTTP/1.1 200 OK\r\n')
+    assert b'Content-Length: 10' in head
+    assert body == b'var a = 1;'
+
+
+def test_build_raw_response_splits_joined_headers():
+    entry = CacheEntry('http://example.com/app.js', '', 200, {'Link': '</a.css>; rel=preload\n</b.css>; rel=preload'},
+                       0, 0)
+    head = base64.b64decode(build_raw_response(entry, b''))
+    assert b'\r\nLink: </a.css>; rel=preload\r\nLink: </b.css>; rel=preload\r\n' in head
+    assert b'\n' not in head.replace(b'\r\n', b'')
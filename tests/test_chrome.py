@@ -10,7 +10,7 @@ from websockets.exceptions import ConnectionClosed
 
 
 from chromewhip import chrome, helpers
-from chromewhip.protocol import page, network
+from chromewhip.protocol import page, network, runtime
 
 TEST_HOST = 'localhost'
 TEST_PORT = 32322
@@ -298,3 +298,255 @@ async def xtest_can_register_callback_on_devtools_event(event_loop, chrome_tab):
 
     server.close()
     await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_unchanged_tab_settings_are_not_sent_again():
+    tab = chrome.ChromeTab('test', 'about:blank', f'ws://{TEST_HOST}:{TEST_PORT}', '123')
+    sent = []
+
+    async def send_command(command, **kwargs):
+        sent.append(command[0]['method'])
+    tab.send_command = send_command
+
+    assert await tab.set_device_metrics(1024, 768)
+    assert not await tab.set_device_metrics(1024, 768)
+    assert await tab.set_device_metrics(800, 600)
+    assert tab.viewport == (800, 600)
+    assert not await tab.set_blocked_urls([])
+    assert not await tab.set_user_agent('')
+    assert await tab.set_user_agent('chromewhip')
+    assert not await tab.set_extra_headers({})
+    assert sent == ['Page.setDeviceMetricsOverride', 'Page.setDeviceMetricsOverride',
+                    'Network.setUserAgentOverride']
+
+
+@pytest.mark.asyncio
+async def test_wait_for_selector_awaits_promise_in_page():
+    tab = chrome.ChromeTab('test', 'about:blank', f'ws://{TEST_HOST}:{TEST_PORT}', '123')
+    sent = []
+
+    async def send_command(command, **kwargs):
+        sent.append(command[0])
+        return {'ack': {'result': {'result': runtime.RemoteObject(type='boolean', value=False)}}}
+    tab.send_command = send_command
+
+    assert not await tab.wait_for_selector('#content', timeout=1.5)
+    params = sent[0]['params']
+    assert sent[0]['method'] == 'Runtime.evaluate'
+    assert params['awaitPromise'] and params['returnByValue']
+    assert 'document.querySelector("#content")' in params['expression']
+    assert 'const timeoutMs = 1500;' in params['expression']
+
+
+class SilentWebsocket:
+    """ Takes commands, leaving the test to ack them.
+    """
+    state = websockets.protocol.OPEN
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, msg):
+        self.sent.append(json.loads(msg))
+
+
+@pytest.mark.asyncio
+async def test_wait_for_outliving_command_timeout_returns_false(monkeypatch):
+    monkeypatch.setattr(chrome, 'TIMEOUT_S', 0.05)
+    monkeypatch.setattr(chrome, 'WAIT_MARGIN_S', 0.1)
+    tab = chrome.ChromeTab('test', 'about:blank', f'ws://{TEST_HOST}:{TEST_PORT}', '123')
+    tab._ws = SilentWebsocket()
+
+    async def ack_later(delay):
+        await asyncio.sleep(delay)
+        id_ = tab._ws.sent[-1]['id']
+        tab._ack_payloads[id_] = {'id': id_, 'result': {'result': {'type': 'boolean', 'value': False}}}
+        tab._ack_events[id_].set()
+
+    # the page gives up waiting after longer than commands are usually given to ack
+    acking = asyncio.ensure_future(ack_later(0.15))
+    assert not await tab.wait_for_selector('#content', timeout=0.15)
+    await acking
+    assert 'const timeoutMs = 150;' in tab._ws.sent[-1]['params']['expression']
+
+    # the page never answers
+    assert not await tab.wait_for_function('window.ready', timeout=0.1)
+
+
+class DevtoolsWebsocket(SilentWebsocket):
+    """ Answers commands with the messages of `replies`, by method, where an `id` of `None` is the command's, and
+    other commands with an empty result.
+    """
+
+    def __init__(self, replies=None):
+        super().__init__()
+        self.replies = replies or {}
+        self.received = asyncio.Queue()
+
+    async def send(self, msg):
+        await super().send(msg)
+        command = self.sent[-1]
+        for reply in self.replies.get(command['method'], [{'id': None, 'result': {}}]):
+            self.push(dict(reply, id=command['id']) if 'id' in reply else reply)
+
+    def push(self, message):
+        self.received.put_nowait(json.dumps(message))
+
+    async def recv(self):
+        return await self.received.get()
+
+    async def close(self):
+        pass
+
+
+def frame_stopped_loading(frame_id):
+    return {'method': 'Page.frameStoppedLoading', 'params': {'frameId': frame_id}}
+
+
+@pytest.mark.asyncio
+async def test_events_are_only_kept_while_commands_await_them():
+    tab = chrome.ChromeTab('test', 'about:blank', f'ws://{TEST_HOST}:{TEST_PORT}', '123')
+    tab._ws = DevtoolsWebsocket({'Page.navigate': [
+        {'id': None, 'result': {'frameId': '1', 'loaderId': 'L1'}}, frame_stopped_loading('1')]})
+    receiving = asyncio.ensure_future(tab.recv_handler())
+    try:
+        tab._ws.push(frame_stopped_loading('1'))
+        await asyncio.sleep(0.01)
+        assert tab._event_payloads == {}
+
+        await asyncio.wait_for(tab.go('http://a.com/'), timeout=1)
+        assert tab._event_payloads == {}
+        assert tab._ack_payloads == {} and tab._ack_events == {} and tab._trigger_events == {}
+    finally:
+        receiving.cancel()
+
+
+@pytest.mark.asyncio
+async def test_websocket_traffic_is_counted_in_bytes():
+    tab = chrome.ChromeTab('test', 'about:blank', f'ws://{TEST_HOST}:{TEST_PORT}', '123')
+    tab._ws = DevtoolsWebsocket()
+    received = chrome.WEBSOCKET_BYTES.labels('in')
+    before = received.value
+    receiving = asyncio.ensure_future(tab.recv_handler())
+    try:
+        message = '{"method": "Page.frameStoppedLoading", "params": {"frameId": "\u00e9t\u00e9"}}'
+        tab._ws.received.put_nowait(message)
+        await asyncio.sleep(0.01)
+        assert received.value - before == len(message) + 2
+    finally:
+        receiving.cancel()
+
+
+@pytest.mark.asyncio
+async def test_new_document_scripts_are_registered_once():
+    tab = chrome.ChromeTab('test', 'about:blank', f'ws://{TEST_HOST}:{TEST_PORT}', '123')
+    sent = []
+
+    async def send_command(command, **kwargs):
+        sent.append(command[0])
+        return {'ack': {'result': {'identifier': str(len(sent))}}}
+    tab.send_command = send_command
+
+    await tab.set_new_document_scripts({'a': 'A', 'b': 'B'})
+    await tab.set_new_document_scripts({'a': 'A', 'b': 'B'})
+    assert len(sent) == 2
+    await tab.set_new_document_scripts({'a': 'A2'})
+    assert [c['method'] for c in sent[2:]] == ['Page.removeScriptToEvaluateOnNewDocument'] * 2 + [
+        'Page.addScriptToEvaluateOnNewDocument']
+    assert tab.new_document_scripts == ('a',)
+
+
+@pytest.mark.asyncio
+async def test_links_are_computed_in_page():
+    tab = chrome.ChromeTab('test', 'about:blank', f'ws://{TEST_HOST}:{TEST_PORT}', '123')
+    sent = []
+
+    async def send_command(command, **kwargs):
+        sent.append(command[0])
+        return {'ack': {'result': {'result': runtime.RemoteObject(type='object', value=['http://a/'])}}}
+    tab.send_command = send_command
+
+    assert await tab.links(same_origin=True) == ['http://a/']
+    params = sent[0]['params']
+    assert params['returnByValue']
+    assert params['expression'].strip().endswith('})(true)')
+
+
+@pytest.mark.asyncio
+async def test_reset_clears_state_of_the_render():
+    tab = chrome.ChromeTab('test', 'about:blank', f'ws://{TEST_HOST}:{TEST_PORT}', '123')
+    sent = []
+
+    async def send_command(command, **kwargs):
+        sent.append(command[0])
+        if command[0]['method'] == 'Page.getFrameTree':
+            return {'ack': {'result': {'frameTree': page.FrameTree(
+                frame={'securityOrigin': 'https://a.com'},
+                childFrames=[{'frame': {'securityOrigin': 'https://ads.com'}}, {'frame': {'securityOrigin': '://'}}])}}}
+        return {'ack': {'result': {'identifier': '1'}}}
+    tab.send_command = send_command
+
+    await tab.set_new_document_scripts({'profile': 'P'})
+    await tab.set_user_agent('bot')
+    sent.clear()
+    await tab.reset()
+    methods = [c['method'] for c in sent]
+    assert methods[:4] == ['Page.getFrameTree', 'Runtime.releaseObjectGroup', 'Page.enable', 'Page.stopLoading']
+    assert 'Page.removeScriptToEvaluateOnNewDocument' in methods
+    assert 'Network.setUserAgentOverride' in methods
+    assert [c['params']['origin'] for c in sent if c['method'] == 'Storage.clearDataForOrigin'] == [
+        'https://a.com', 'https://ads.com']
+    assert methods[-1] == 'Network.clearBrowserCookies'
+    assert not tab.new_document_scripts
+    assert tab.emulation_state['user_agent'] is None
+
+
+def navigated(frame_id, loader_id):
+    return {'id': None, 'result': {'frameId': frame_id, 'loaderId': loader_id}}
+
+
+@pytest.mark.asyncio
+async def test_go_waits_for_its_own_navigation_to_stop_loading():
+    tab = chrome.ChromeTab('test', 'about:blank', f'ws://{TEST_HOST}:{TEST_PORT}', '123')
+    tab._ws = DevtoolsWebsocket()
+    receiving = asyncio.ensure_future(tab.recv_handler())
+    try:
+        # a navigation of another frame keeps events stored meanwhile
+        tab._ws.replies = {'Page.navigate': [navigated('2', 'L1')]}
+        other = asyncio.ensure_future(tab.go('http://b.com/'))
+        await asyncio.sleep(0.01)
+        # the main frame stopping loading a previous page
+        tab._ws.push(frame_stopped_loading('1'))
+        await asyncio.sleep(0.01)
+
+        tab._ws.replies = {'Page.navigate': [navigated('1', 'L2')]}
+        going = asyncio.ensure_future(tab.go('http://a.com/'))
+        await asyncio.sleep(0.05)
+        assert not going.done()
+        tab._ws.push(frame_stopped_loading('1'))
+        await asyncio.wait_for(going, timeout=1)
+
+        tab._ws.push(frame_stopped_loading('2'))
+        await asyncio.wait_for(other, timeout=1)
+    finally:
+        receiving.cancel()
+
+
+@pytest.mark.asyncio
+async def test_reset_waits_for_about_blank_every_time():
+    tab = chrome.ChromeTab('test', 'about:blank', f'ws://{TEST_HOST}:{TEST_PORT}', '123')
+    tab._ws = DevtoolsWebsocket({'Page.navigate': [navigated('1', 'L1')]})
+    receiving = asyncio.ensure_future(tab.recv_handler())
+    try:
+        for _ in range(2):
+            tab._ws.sent.clear()
+            resetting = asyncio.ensure_future(tab.reset(clear_storage=False))
+            await asyncio.sleep(0.05)
+            # nothing of the reset runs while the previous page may still be unloading
+            assert tab._ws.sent[-1]['method'] == 'Page.navigate' and not resetting.done()
+            tab._ws.push(frame_stopped_loading('1'))
+            await asyncio.wait_for(resetting, timeout=1)
+            assert tab._ws.sent[-1]['method'] == 'Page.disable'
+    finally:
+        receiving.cancel()
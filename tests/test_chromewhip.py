@@ -1,4 +1,6 @@
+from concurrent.futures import ProcessPoolExecutor
 from urllib.parse import quote
+import asyncio
 import os
 import sys
 
@@ -7,8 +9,10 @@ import pytest
 PROJECT_ROOT = os.path.abspath(os.path.join(__file__, '../..'))
 sys.path.insert(0, PROJECT_ROOT)
 
-from chromewhip import setup_app
-from chromewhip.views import BS
+from chromewhip import get_settings, setup_app
+from chromewhip.batch import RenderRequest
+from chromewhip.views import BS, _get_extract_specs, prettify_html
+from aiohttp import web
 from aiohttp.test_utils import TestClient as tc
 HTTPBIN_HOST = 'http://httpbin.org'
 
@@ -22,7 +26,7 @@ async def xtest_render_html_basic(event_loop):
     expected = BS(open(os.path.join(RESPONSES_DIR, 'httpbin.org.html.txt')).read()).prettify()
     client = tc(setup_app(loop=event_loop), loop=event_loop)
     await client.start_server()
-    resp = await client.get('/render.html?url={}'.format(quote('{}/html'.format(HTTPBIN_HOST))))
+    resp = await client.get('/render.html?prettify=1&url={}'.format(quote('{}/html'.format(HTTPBIN_HOST))))
     assert resp.status == 200
     text = await resp.text()
     assert expected == text
@@ -34,9 +38,40 @@ async def xtest_render_html_with_js_profile(event_loop):
     profile_path = os.path.join(PROJECT_ROOT, 'tests/resources/js/profiles/{}'.format(profile_name))
     client = tc(setup_app(loop=event_loop, js_profiles_path=profile_path), loop=event_loop)
     await client.start_server()
-    resp = await client.get('/render.html?url={}&js={}'.format(
+    resp = await client.get('/render.html?prettify=1&url={}&js={}'.format(
         quote('{}/html'.format(HTTPBIN_HOST)),
         profile_name))
     assert resp.status == 200
     text = await resp.text()
     assert expected == text
+
+@pytest.mark.asyncio
+async def test_prettify_html_in_worker_process():
+    html = open(os.path.join(RESPONSES_DIR, 'httpbin.org.html.txt'), 'rb').read()
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        text = await asyncio.get_event_loop().run_in_executor(executor, prettify_html, html)
+    assert text == BS(html.decode()).prettify()
+
+
+def test_extract_specs():
+    def specs(selectors):
+        return _get_extract_specs(RenderRequest(None, '/render.extract', {'selectors': selectors}))
+
+    assert specs('{"title": "h1", "links": {"selector": "a", "attribute": "href", "all": true}}') == {
+        'title': {'selector': 'h1', 'attribute': None, 'html': False, 'all': False},
+        'links': {'selector': 'a', 'attribute': 'href', 'html': False, 'all': True},
+    }
+    for invalid in ('', 'h1', '{}', '["h1"]', '{"title": 1}', '{"title": {"selector": "h1", "attribute": 1}}'):
+        with pytest.raises(web.HTTPBadRequest):
+            specs(invalid)
+
+
+def test_headless_settings(monkeypatch):
+    monkeypatch.setattr('platform.system', lambda: 'Linux')
+    settings = get_settings()
+    assert settings.should_run_xfvb and '--headless' not in settings.chrome_flags
+
+    settings = get_settings(headless=True)
+    assert settings.headless and not settings.should_run_xfvb
+    assert '--headless' in settings.chrome_flags and '--no-sandbox' in settings.chrome_flags
+    assert settings.chrome_flags[-1] == 'about:blank'
@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+
+from chromewhip import crawl
+
+PAGES = {
+    'http://a.com/': ['http://a.com/1#top', 'http://a.com/2', 'http://b.com/', 'mailto:me@a.com'],
+    'http://a.com/1': ['http://a.com/', 'http://a.com/3'],
+    'http://a.com/2': ['http://a.com/1', 'http://a.com/4'],
+}
+
+
+async def fake_render_view(app, path, view, params, headers=None, transport=None):
+    url = params['url']
+    if url not in PAGES:
+        return web.Response(text=json.dumps({'error': 'not found'}))
+    return web.json_response({'links': PAGES[url]})
+
+
+def test_normalize_url():
+    assert crawl.normalize_url('HTTP://A.com:80/x/../y#frag') == 'http://a.com/y'
+    assert crawl.normalize_url('https://a.com') == 'https://a.com/'
+    assert crawl.normalize_url('mailto:me@a.com') is None
+    assert crawl.normalize_url('/relative') is None
+
+
+def test_seen_set_and_scope():
+    seen = crawl.SeenSet()
+    assert seen.add('http://a.com/')
+    assert not seen.add('http://a.com/')
+    assert 'http://a.com/' in seen and len(seen) == 1
+
+    scope = crawl.Scope(['a.com'], exclude=[r'\.pdf$'])
+    assert scope.allows('http://www.a.com/x')
+    assert not scope.allows('http://b.com/x')
+    assert not scope.allows('http://a.com/x.pdf')
+
+
+@pytest.mark.asyncio
+async def test_frontier_delays_urls_of_the_same_host():
+    frontier = crawl.Frontier(delay_s=0.1)
+    for url in ('http://a.com/1', 'http://a.com/2', 'http://b.com/1'):
+        frontier.add(url, 0)
+    assert not frontier.add('http://a.com/1', 1)
+
+    loop = asyncio.get_event_loop()
+    started = loop.time()
+    got = []
+    for _ in range(3):
+        got.append((await frontier.get())[0])
+        frontier.done()
+    assert got == ['http://a.com/1', 'http://b.com/1', 'http://a.com/2']
+    assert loop.time() - started >= 0.1
+    assert await frontier.get() is None
+
+
+@pytest.mark.asyncio
+async def test_crawler_follows_links_in_scope_up_to_max_depth(monkeypatch):
+    monkeypatch.setattr(crawl, 'render_view', fake_render_view)
+    crawler = crawl.Crawler(None, ['http://a.com/'], crawl.Scope(['a.com']), max_depth=1, concurrency=2, delay_s=0)
+    results = [r async for r in crawler.results()]
+    assert sorted(r['url'] for r in results) == ['http://a.com/', 'http://a.com/1', 'http://a.com/2']
+    assert all(r['depth'] == 1 for r in results if r['url'] != 'http://a.com/')
+
+    crawler = crawl.Crawler(None, ['http://a.com/'], crawl.Scope(['a.com']), max_depth=5, max_pages=4, delay_s=0)
+    results = [r async for r in crawler.results()]
+    assert len(results) == 4
+    assert [r for r in results if 'error' in r][0]['error'] == 'not found'
+
+
+@pytest.mark.parametrize('scope', [
+    {'hosts': 'a.com'},
+    {'hosts': ['a.com', 1]},
+    {'include': r'\.html$'},
+    {'exclude': ['(']},
+])
+def test_invalid_scope_is_rejected(scope):
+    with pytest.raises(web.HTTPBadRequest):
+        crawl._get_crawl(None, {'seeds': ['http://a.com/'], 'scope': scope})
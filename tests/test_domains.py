@@ -0,0 +1,31 @@
+import asyncio
+
+import pytest
+
+from chromewhip.chrome import DomainManager
+from conftest import FakeTab
+
+
+@pytest.mark.asyncio
+async def test_domain_is_enabled_once_and_disabled_by_last_user():
+    tab = FakeTab()
+    domains = DomainManager(tab)
+    await asyncio.gather(domains.acquire('Page'), domains.acquire('Page', 'Network'))
+    assert tab.sent == ['Page.enable', 'Network.enable']
+    assert set(domains.enabled) == {'Page', 'Network'}
+
+    await domains.release('Page')
+    assert domains.is_enabled('Page')
+    await domains.release('Page', 'Network')
+    assert tab.sent[2:] == ['Page.disable', 'Network.disable']
+    assert domains.enabled == ()
+
+    await domains.acquire('Page')
+    assert tab.sent[-1] == 'Page.enable'
+
+
+@pytest.mark.asyncio
+async def test_releasing_a_domain_not_acquired_raises():
+    domains = DomainManager(FakeTab())
+    with pytest.raises(ValueError):
+        await domains.release('DOM')
@@ -0,0 +1,88 @@
+import pytest
+
+from chromewhip.filters import FilterMatcher, parse_rule
+from chromewhip.interception import build_blocking
+
+EASYLIST = """
+[Adblock Plus 2.0]
+! comment
+||doubleclick.net^
+||ads.example.com^$third-party
+/banner/*/ad_
+@@||doubleclick.net/allowed/
+|https://tracker.io/pixel.gif|
+example.org##.ad-box
+.swf$object
+/analytics\\.js$/
+||cdn.example.com^$image,domain=news.com|~sports.news.com
+"""
+
+
+@pytest.fixture
+def matcher():
+    return FilterMatcher.from_lines(EASYLIST.splitlines(), name='easylist')
+
+
+def test_parse_rule_skips_comments_and_element_hiding():
+    assert parse_rule('! comment') is None
+    assert parse_rule('[Adblock Plus 2.0]') is None
+    assert parse_rule('example.org##.ad-box') is None
+    assert parse_rule('||example.com^$popup') is None
+
+
+def test_domain_anchor(matcher):
+    assert matcher.should_block('http://doubleclick.net/ad.js')
+    assert matcher.should_block('https://stats.g.doubleclick.net/r/collect')
+    assert not matcher.should_block('http://notdoubleclick.net/ad.js')
+
+
+def test_exception_rule(matcher):
+    assert not matcher.should_block('http://doubleclick.net/allowed/ad.js')
+
+
+def test_wildcard_and_anchors(matcher):
+    assert matcher.should_block('http://example.com/banner/123/ad_top.png')
+    assert matcher.should_block('https://tracker.io/pixel.gif')
+    assert not matcher.should_block('https://tracker.io/pixel.gif?x=1')
+
+
+def test_regex_rule(matcher):
+    assert matcher.should_block('http://example.com/js/analytics.js')
+
+
+def test_third_party_option(matcher):
+    assert matcher.should_block('http://ads.example.com/x.js', document_url='http://news.com/')
+    assert not matcher.should_block('http://ads.example.com/x.js', document_url='http://www.example.com/')
+
+
+def test_resource_type_and_domain_options(matcher):
+    img = 'http://cdn.example.com/img.png'
+    assert matcher.should_block(img, resource_type='Image', document_url='http://news.com/')
+    assert not matcher.should_block(img, resource_type='Script', document_url='http://news.com/')
+    assert not matcher.should_block(img, resource_type='Image', document_url='http://sports.news.com/')
+    assert not matcher.should_block(img, resource_type='Image', document_url='http://other.com/')
+
+
+def test_native_patterns():
+    simple = FilterMatcher.from_lines(['||ads.com^', '/banner/ad', '|http://x.com/a.js|'])
+    assert simple.native_patterns() == ['*://ads.com/*', '*://*.ads.com/*', '*/banner/ad*', 'http://x.com/a.js']
+
+
+def test_native_patterns_unavailable_with_options_or_exceptions(matcher):
+    assert matcher.native_patterns() is None
+    assert FilterMatcher.from_lines(['||ads.com^$script']).native_patterns() is None
+
+
+def test_build_blocking_uses_native_patterns_when_possible(matcher):
+    simple = FilterMatcher.from_lines(['||ads.com^'])
+    native_urls, handler = build_blocking([simple], set())
+    assert native_urls == ['*://ads.com/*', '*://*.ads.com/*']
+    assert handler is None
+
+    native_urls, handler = build_blocking([simple], {'Image'})
+    assert handler.patterns == [{'urlPattern': '*', 'resourceType': 'Image'}]
+
+    native_urls, handler = build_blocking([matcher], set())
+    assert native_urls == []
+    assert handler.patterns == [{'urlPattern': '*'}]
+    assert handler.should_block('http://doubleclick.net/ad.js')
@@ -3,7 +3,7 @@ import json
 import pytest
 
 from chromewhip import helpers
-from chromewhip.protocol import page
+from chromewhip.protocol import emulation, page, performance, target
 
 
 def test_valid_json_to_event():
@@ -50,3 +50,14 @@ def test_build_hash_from_event_cls():
     assert hash == "Page.frameNavigated:frameId=3"
 
 
+def test_convert_payload_accepts_whole_floats_sent_as_ints():
+    _, convert = emulation.Emulation.setVirtualTimePolicy(policy='pause')
+    assert convert({'virtualTimeTicksBase': 1}) == {'virtualTimeTicksBase': 1.0}
+
+
+def test_convert_payload_converts_arrays_of_types():
+    _, convert = performance.Performance.getMetrics()
+    result = convert({'metrics': [{'name': 'Nodes', 'value': 10}]})
+    assert [(m.name, m.value) for m in result['metrics']] == [('Nodes', 10)]
+    _, convert = target.Target.getBrowserContexts()
+    assert convert({'browserContextIds': ['a']}) == {'browserContextIds': ['a']}
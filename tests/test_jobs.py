@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from chromewhip import jobs
+
+
+class FakeRenders:
+
+    def __init__(self):
+        self.params = []
+        self.busy = 0
+
+    async def __call__(self, app, endpoint, params, headers=None, transport=None):
+        if self.busy:
+            self.busy -= 1
+            return web.Response(status=503, headers={'Retry-After': '0'})
+        self.params.append(params)
+        return web.Response(text='<html>%s</html>' % params['url'], content_type='text/html')
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    renders = FakeRenders()
+    monkeypatch.setattr(jobs, 'render_response', renders)
+    return renders
+
+
+async def wait_until_done(queue, job):
+    for _ in range(100):
+        if queue.get(job.id).status == jobs.DONE:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError('job %s not done' % job.id)
+
+
+@pytest.mark.asyncio
+async def test_jobs_run_at_low_priority_and_retry_when_queue_busy(tmpdir, renders):
+    renders.busy = 1
+    queue = jobs.JobQueue(None, jobs.JobStore(str(tmpdir)), workers=1)
+    await queue.start()
+    try:
+        job = await queue.submit('html', {'url': 'http://example.com'})
+        await wait_until_done(queue, job)
+    finally:
+        await queue.stop()
+    assert renders.params == [{'url': 'http://example.com', 'priority': 'low'}]
+    assert job.describe()['render_status'] == 200
+    with open(queue.store.result_fp(job.id), 'rb') as f:
+        assert f.read() == b'<html>http://example.com</html>'
+
+
+@pytest.mark.asyncio
+async def test_unfinished_jobs_are_resumed_and_old_results_evicted(tmpdir, renders):
+    store = jobs.JobStore(str(tmpdir), max_disk_bytes=40)
+    store.save(jobs.Job('interrupted', 'html', {'url': 'http://a'}, status=jobs.RUNNING, created_at=1))
+    store.save(jobs.Job('queued', 'html', {'url': 'http://b'}, created_at=2))
+
+    queue = jobs.JobQueue(None, store, workers=1)
+    await queue.start()
+    try:
+        await wait_until_done(queue, queue.get('queued'))
+    finally:
+        await queue.stop()
+    assert [p['url'] for p in renders.params] == ['http://a', 'http://b']
+    # each result is 22 bytes, so only the newest fits
+    assert queue.get('interrupted') is None
+    assert [j.id for j in jobs.JobStore(str(tmpdir)).load()] == ['queued']
+
+
+def test_finished_jobs_are_evicted_by_count_and_age(tmpdir):
+    store = jobs.JobStore(str(tmpdir), max_finished=2, ttl_s=100)
+    finished = [jobs.Job(str(i), 'html', {'url': 'http://a'}, status=jobs.DONE, created_at=i, finished_at=i,
+                         result={}) for i in (10, 50, 150, 160)]
+    finished.append(jobs.Job('queued', 'html', {'url': 'http://b'}, created_at=1))
+    for job in finished:
+        store.save(job)
+
+    # 10 is past its TTL at 200 and 50 is one job too many, even though none of them has a result
+    assert [j.id for j in store.evict(finished, now=200)] == ['10', '50']
+    assert sorted(j.id for j in store.load()) == ['150', '160', 'queued']
+    assert [j.id for j in store.evict(finished[2:], now=300)] == ['150', '160']
+
+
+def test_webhooks_must_be_local():
+    assert jobs._get_webhook('http://localhost:8000/done') == 'http://localhost:8000/done'
+    with pytest.raises(web.HTTPBadRequest):
+        jobs._get_webhook('http://example.com/done')
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from chromewhip import metrics
+
+
+@pytest.fixture
+def registry():
+    return metrics.Registry()
+
+
+def test_counter_exposition(registry):
+    c = metrics.Counter('test_requests_total', 'Requests', ['method'], registry=registry)
+    c.labels('GET').inc()
+    c.labels('GET').inc(2)
+    c.labels('POST').inc()
+    text = registry.expose()
+    assert '# TYPE test_requests_total counter' in text
+    assert 'test_requests_total{method="GET"} 3' in text
+    assert 'test_requests_total{method="POST"} 1' in text
+
+
+def test_counter_cannot_decrease(registry):
+    c = metrics.Counter('test_total', 'Test', registry=registry)
+    with pytest.raises(ValueError):
+        c.inc(-1)
+
+
+def test_gauge_without_labels(registry):
+    g = metrics.Gauge('test_bytes', 'Bytes', registry=registry)
+    g.set(10.5)
+    assert 'test_bytes 10.5' in registry.expose()
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    h = metrics.Histogram('test_seconds', 'Latency', ['phase'], buckets=(0.1, 1), registry=registry)
+    h.labels('load').observe(0.05)
+    h.labels('load').observe(0.5)
+    h.labels('load').observe(5)
+    text = registry.expose()
+    assert 'test_seconds_bucket{phase="load",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{phase="load",le="1"} 2' in text
+    assert 'test_seconds_bucket{phase="load",le="+Inf"} 3' in text
+    assert 'test_seconds_count{phase="load"} 3' in text
+    assert 'test_seconds_sum{phase="load"} 5.55' in text
+
+
+def test_label_values_are_escaped(registry):
+    c = metrics.Counter('test_escaped_total', 'Test', ['url'], registry=registry)
+    c.labels('a"b\\c').inc()
+    assert r'test_escaped_total{url="a\"b\\c"} 1' in registry.expose()
+
+
+def test_duplicate_registration_fails(registry):
+    metrics.Counter('test_dup_total', 'Test', registry=registry)
+    with pytest.raises(ValueError):
+        metrics.Counter('test_dup_total', 'Test', registry=registry)
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self'), reason='requires procfs')
+def test_process_tree_rss_of_current_process():
+    assert metrics.process_tree_rss(os.getpid()) > 0
@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+from chromewhip.pool import DEFAULT_VIEWPORT, HealthPolicy, TabPool
+from conftest import FakeChrome, FakeTab
+
+
+@pytest.mark.asyncio
+async def test_pool_adopts_existing_tabs_and_waits_when_exhausted():
+    chrome = FakeChrome('startup-tab')
+    pool = TabPool(chrome, size=2)
+    first = await pool.acquire()
+    second = await pool.acquire()
+    assert first.name == 'startup-tab'
+    assert second.name == 'tab-1'
+    waiting = asyncio.ensure_future(pool.acquire())
+    await asyncio.sleep(0)
+    assert not waiting.done()
+    pool.release(first)
+    assert await waiting is first
+    assert chrome.created == 1
+
+
+@pytest.mark.asyncio
+async def test_discarded_tab_is_closed_and_replaced_for_waiters():
+    chrome = FakeChrome('startup-tab')
+    pool = TabPool(chrome, size=1)
+    tab = await pool.acquire()
+    waiting = asyncio.ensure_future(pool.acquire())
+    await asyncio.sleep(0)
+    pool.discard(tab)
+    replacement = await asyncio.wait_for(waiting, timeout=1)
+    assert replacement.name == 'tab-1'
+    assert chrome.closed == [tab]
+    assert pool.tabs == (replacement,)
+
+
+@pytest.mark.asyncio
+async def test_pool_prefers_idle_tab_with_requested_viewport():
+    pool = TabPool(FakeChrome(), size=2)
+    small, large = FakeTab('small', viewport=(800, 600)), FakeTab('large', viewport=(1024, 768))
+    pool.release(small)
+    pool.release(large)
+    assert await pool.acquire(viewport=(1024, 768)) is large
+    pool.release(large)
+    assert await pool.acquire(viewport=(1920, 1080)) is small
+
+
+@pytest.mark.asyncio
+async def test_recycled_tab_is_reset_before_reuse():
+    chrome = FakeChrome('startup-tab')
+    tab = chrome.tabs[0]
+    pool = TabPool(chrome, size=1, isolation='storage')
+    assert await pool.acquire() is tab
+    pool.recycle(tab)
+    assert pool.idle == 0
+    assert await asyncio.wait_for(pool.acquire(), timeout=1) is tab
+    assert tab.resets == [True]
+
+
+@pytest.mark.asyncio
+async def test_context_isolation_replaces_recycled_tabs():
+    chrome = FakeChrome('startup-tab')
+    pool = TabPool(chrome, size=1, isolation='context')
+    tab = await pool.acquire()
+    assert tab.name == 'context-tab-1'
+    pool.recycle(tab)
+    replacement = await asyncio.wait_for(pool.acquire(), timeout=1)
+    assert replacement.name == 'context-tab-2'
+    assert chrome.closed == [tab]
+    assert pool.tabs == (replacement,)
+
+
+class AgingTab(FakeTab):
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.nodes = 0
+
+    async def health(self):
+        self.nodes += 1000
+        return {'js_heap_used_bytes': 0, 'nodes': self.nodes, 'documents': 1, 'js_event_listeners': 0}
+
+
+class AgingChrome(FakeChrome):
+    tab_class = AgingTab
+
+
+def test_health_policy_limits():
+    policy = HealthPolicy(max_js_heap_mb=1, max_dom_nodes=100, sample_every=2)
+    assert not policy.should_sample(1) and policy.should_sample(2)
+    assert policy.exceeded({'js_heap_used_bytes': 2 * 1024 ** 2, 'nodes': 0, 'documents': 1,
+                            'js_event_listeners': 0}) == 'js_heap_used_bytes'
+    assert policy.exceeded({'js_heap_used_bytes': 0, 'nodes': 10, 'documents': 1, 'js_event_listeners': 0}) is None
+    assert not HealthPolicy().is_due(100)
+
+
+@pytest.mark.asyncio
+async def test_unhealthy_tabs_are_replaced_before_being_closed():
+    chrome = AgingChrome('old')
+    tab = chrome.tabs[0]
+    pool = TabPool(chrome, size=1, health=HealthPolicy(max_dom_nodes=1500))
+    assert await pool.acquire() is tab
+    pool.recycle(tab)
+    assert await asyncio.wait_for(pool.acquire(), timeout=1) is tab
+    pool.recycle(tab)
+    replacement = await asyncio.wait_for(pool.acquire(), timeout=1)
+    assert replacement.name == 'tab-1'
+    await asyncio.sleep(0)
+    assert chrome.closed == [tab]
+
+
+@pytest.mark.asyncio
+async def test_tabs_are_retired_after_max_renders():
+    chrome = FakeChrome('startup-tab')
+    pool = TabPool(chrome, size=1, health=HealthPolicy(max_renders=2))
+    tab = await pool.acquire()
+    pool.recycle(tab)
+    assert await asyncio.wait_for(pool.acquire(), timeout=1) is tab
+    pool.recycle(tab)
+    assert (await asyncio.wait_for(pool.acquire(), timeout=1)).name == 'tab-1'
+
+
+@pytest.mark.asyncio
+async def test_spare_tabs_are_warmed_up_ahead_of_renders():
+    chrome = FakeChrome()
+    pool = TabPool(chrome, size=2, spare=1)
+    await pool.start()
+    await asyncio.sleep(0.01)
+    assert pool.idle == 1 and chrome.created == 1
+    tab = await pool.acquire()
+    assert 'enable_page_events' in tab.calls and tab.viewport == DEFAULT_VIEWPORT
+    await asyncio.sleep(0.01)
+    # checked out spare replaced in the background
+    assert pool.idle == 1 and chrome.created == 2
+    second = await pool.acquire()
+    third = await pool.acquire()
+    await asyncio.sleep(0.01)
+    assert chrome.created == 3
+    assert pool.idle == 0
+    for t in (tab, second, third):
+        pool.release(t)
+    assert len(pool.tabs) == 3
@@ -0,0 +1,51 @@
+import os
+
+from chromewhip.profiles import JSProfile, load_profiles
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+PROFILE_PATH = os.path.join(PROJECT_ROOT, 'tests/resources/js/profiles/httpbin-org-html')
+
+
+def test_profile_files_are_run_in_name_order():
+    profile = load_profiles(PROFILE_PATH)['httpbin-org-html']
+    assert profile.source.index("'Chromewhip'") < profile.source.index("'All profiles ran!'")
+    assert profile.start_source == ''
+    assert list(profile.new_document_scripts()) == ['httpbin-org-html:define']
+    assert profile.run_expression() == 'window["__chromewhip_profiles__"]["httpbin-org-html"]()'
+
+
+def test_start_files_run_at_document_start(tmpdir):
+    tmpdir.join('001_stub.start.js').write('window.stubbed = true;')
+    profile = JSProfile.from_folder(str(tmpdir))
+    assert profile.source == ''
+    assert profile.run_expression() is None
+    [(key, script)] = profile.new_document_scripts().items()
+    assert key.endswith(':start')
+    assert 'window.stubbed = true;' in script
+
+
+def test_index_loads_sub_folders_and_reloads_changed_profiles(tmpdir):
+    tmpdir.mkdir('first').join('001.js').write('first();')
+    second = tmpdir.mkdir('second')
+    second.join('001.js').write('second();')
+    index = load_profiles(str(tmpdir))
+    assert 'first' in index and 'second' in index
+    first, digests = index.get('first'), index.digests
+
+    assert index.reload() == []
+    assert index.get('first') is first
+
+    second.join('001.js').write('second(); again();')
+    tmpdir.join('first').remove()
+    tmpdir.mkdir('third').join('001.js').write('third();')
+    assert sorted(index.reload()) == ['first', 'second', 'third']
+    assert 'first' not in index
+    assert index.digests['second'] != digests['second']
+    assert 'again();' in index.get('second').source
+
+
+def test_after_load_code_is_the_body_of_a_registered_function(tmpdir):
+    tmpdir.join('001.js').write('var title = document.title;\n')
+    profile = JSProfile.from_folder(str(tmpdir))
+    [script] = profile.new_document_scripts().values()
+    assert 'function () {\nvar title = document.title;\n' in script
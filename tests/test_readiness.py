@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from chromewhip.protocol import emulation, page
+from chromewhip.readiness import ReadinessWatcher, RequestTracker, VirtualTimeBudget
+from conftest import FakeTab
+
+
+def lifecycle(name, frame_id='frame', loader_id='loader'):
+    return page.LifecycleEventEvent(frameId=frame_id, loaderId=loader_id, name=name, timestamp=1.0)
+
+
+@pytest.mark.asyncio
+async def test_watcher_waits_for_lifecycle_event_of_main_frame():
+    tab = FakeTab()
+    watcher = ReadinessWatcher(tab, 'domcontentloaded')
+    await watcher.start()
+    await tab.emit(lifecycle('DOMContentLoaded', frame_id='iframe'))
+    await watcher.navigate('http://example.com')
+    assert not await watcher.wait(timeout=0.01)
+    await tab.emit(lifecycle('DOMContentLoaded'))
+    assert await watcher.wait(timeout=0.01)
+    await watcher.stop()
+    assert tab.sent == ['Page.setLifecycleEventsEnabled', 'Page.navigate', 'Page.setLifecycleEventsEnabled']
+    assert not any(tab.handlers.values())
+
+
+@pytest.mark.asyncio
+async def test_request_tracker_is_idle_once_nothing_in_flight_for_idle_s():
+    tracker = RequestTracker(idle_s=0.01)
+    tracker.request_started('1')
+    tracker.start()
+    await asyncio.sleep(0.02)
+    assert not tracker.idle.is_set()
+    tracker.request_finished('1')
+    tracker.request_started('2')
+    await asyncio.sleep(0.02)
+    assert not tracker.idle.is_set()
+    tracker.request_finished('2')
+    await asyncio.wait_for(tracker.idle.wait(), timeout=0.1)
+    assert tracker.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_virtual_time_budget_resolves_on_budget_expired_event():
+    tab = FakeTab()
+    budget = VirtualTimeBudget(tab, 5000)
+    await budget.start()
+    assert tab.sent == ['Emulation.setVirtualTimePolicy']
+    assert not await budget.wait(timeout=0.01)
+    await tab.emit(emulation.VirtualTimeBudgetExpiredEvent())
+    assert await budget.wait(timeout=0.01)
+    budget.stop()
+    assert not any(tab.handlers.values())
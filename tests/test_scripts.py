@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from chromewhip import scripts
+from chromewhip.batch import RenderRequest
+from chromewhip.chrome import TimeoutError as CommandTimeoutError
+from conftest import FakeTab
+
+
+def test_step_validation():
+    with pytest.raises(web.HTTPBadRequest):
+        scripts._get_steps({'steps': []})
+    with pytest.raises(web.HTTPBadRequest):
+        scripts._get_steps({'steps': [{'action': 'fly'}]})
+    with pytest.raises(web.HTTPBadRequest):
+        scripts._get_steps({'steps': [{'action': 'click'}]})
+    with pytest.raises(web.HTTPBadRequest):
+        scripts._get_steps({'steps': [{'action': 'html'}] * (scripts.MAX_STEPS + 1)})
+    for step in ({'action': 'wait', 'seconds': None}, {'action': 'scroll', 'y': [1]},
+                 {'action': 'wait_for', 'selector': 'a', 'timeout': {}}, {'action': 'click', 'selector': 1}):
+        with pytest.raises(web.HTTPBadRequest):
+            scripts._get_steps({'steps': [step]})
+    steps = [{'action': 'navigate', 'url': 'http://a'}, {'action': 'wait_for', 'js': 'true'}, {'action': 'html'}]
+    assert scripts._get_steps({'steps': steps}) == steps
+
+
+@pytest.mark.asyncio
+async def test_steps_drive_the_tab():
+    tab = FakeTab(values={'1 + 1': 2, 'h1': 'Title'})
+    assert await scripts._run_step(tab, {'action': 'navigate', 'url': 'http://a'}) is None
+    assert await scripts._run_step(tab, {'action': 'type', 'text': 'me', 'selector': '#user'}) is None
+    assert await scripts._run_step(tab, {'action': 'click', 'selector': 'button'}) is None
+    assert await scripts._run_step(tab, {'action': 'scroll', 'y': 100}) is None
+    assert await scripts._run_step(tab, {'action': 'evaluate', 'js': '1 + 1'}) == 2
+    assert await scripts._run_step(tab, {'action': 'extract', 'selector': 'h1'}) == 'Title'
+    assert await scripts._run_step(tab, {'action': 'screenshot'}) == 'iVBORw=='
+    assert await scripts._run_step(tab, {'action': 'html'}) == '<html></html>'
+    assert tab.calls[:3] == [('go', 'http://a'), ('type', 'me', '#user'), ('click', 'button')]
+    assert tab.calls[3] == ('evaluate', 'window.scrollTo(0.0, 100.0)')
+
+
+@pytest.mark.asyncio
+async def test_failed_wait_for_fails_the_step():
+    tab = FakeTab(values={'.ready': True})
+    assert await scripts._run_step(tab, {'action': 'wait_for', 'selector': '.ready'}) is None
+    with pytest.raises(scripts.ScriptError):
+        await scripts._run_step(tab, {'action': 'wait_for', 'selector': '.missing', 'timeout': 0.1})
+    with pytest.raises(scripts.ScriptError):
+        await scripts._run_step(tab, {'action': 'scroll', 'selector': '.missing'})
+
+
+@pytest.mark.asyncio
+async def test_wait_for_is_capped_at_max_wait():
+    tab = FakeTab(values={'.ready': True})
+    await scripts._run_step(tab, {'action': 'wait_for', 'selector': '.ready'}, max_wait=3)
+    await scripts._run_step(tab, {'action': 'wait_for', 'selector': '.ready', 'timeout': 60}, max_wait=3)
+    await scripts._run_step(tab, {'action': 'wait_for', 'selector': '.ready', 'timeout': 1}, max_wait=3)
+    assert [c[2] for c in tab.calls] == [3, 3, 1]
+
+
+@pytest.mark.asyncio
+async def test_step_timing_out_names_the_step(monkeypatch):
+    tab = FakeTab()
+
+    async def click(selector):
+        raise CommandTimeoutError('Unknown cause for timeout to occurs for "Input.dispatchMouseEvent"')
+    tab.click = click
+
+    async def acquire_tab(request, width, height):
+        return tab
+    monkeypatch.setattr(scripts, 'acquire_tab', acquire_tab)
+
+    request = RenderRequest(None, '/execute', {})
+    request['chromewhip-deadline'] = asyncio.get_event_loop().time() + 10
+    request['chromewhip-steps'] = [{'action': 'navigate', 'url': 'http://a'}, {'action': 'click', 'selector': 'a'}]
+    with pytest.raises(scripts.ScriptError) as e:
+        await scripts._run_script(request)
+    assert e.value.args[0]['step'] == 1 and e.value.args[0]['action'] == 'click'
+    assert 'Input.dispatchMouseEvent' in e.value.args[0]['error']
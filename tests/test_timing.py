@@ -0,0 +1,70 @@
+import json
+import logging
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from chromewhip.timing import PhaseTimer, TIMINGS_HEADER, get_timer, timed
+
+
+def test_phases_add_up():
+    timer = PhaseTimer('/render.html')
+    timer.record('navigation', 0.25)
+    timer.record('js', 0.01)
+    timer.record('navigation', 0.25)
+    assert timer.phases['navigation'] == 0.5
+    assert list(timer.to_dict()['phases']) == ['navigation', 'js']
+    assert timer.to_dict()['phases']['navigation'] == 500.0
+
+
+def test_server_timing_header():
+    timer = PhaseTimer('/render.html')
+    timer.record('queue', 0.0123)
+    timer.stop()
+    header = timer.server_timing()
+    assert header.startswith('queue;dur=12.3, total;dur=')
+
+
+def test_phase_context_manager_records_on_error():
+    timer = PhaseTimer('/render.html')
+    with pytest.raises(ValueError):
+        with timer.phase('navigation'):
+            raise ValueError()
+    assert 'navigation' in timer.phases
+
+
+def _request(query='', threshold=None):
+    app = web.Application()
+    app['slow-render-threshold'] = threshold
+    return make_mocked_request('GET', '/render.html?url=http://example.com' + query, app=app)
+
+
+@pytest.mark.asyncio
+async def test_timed_view_sets_headers():
+    @timed
+    async def view(request):
+        with get_timer(request).phase('navigation'):
+            pass
+        return web.Response(text='ok')
+
+    response = await view(_request('&timings=1'))
+    assert 'navigation;dur=' in response.headers['Server-Timing']
+    assert 'navigation' in json.loads(response.headers[TIMINGS_HEADER])['phases']
+
+    response = await view(_request())
+    assert TIMINGS_HEADER not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_timed_view_logs_slow_renders(caplog):
+    @timed
+    async def view(request):
+        get_timer(request).record('wait', 2)
+        return web.Response(text='ok')
+
+    with caplog.at_level(logging.WARNING, logger='chromewhip.timing.slow_renders'):
+        await view(_request('&api_key=secret', threshold=0))
+    assert 'wait;dur=2000.0' in caplog.text
+    assert '/render.html of http://example.com' in caplog.text
+    assert 'secret' not in caplog.text
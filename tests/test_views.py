@@ -0,0 +1,129 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from chromewhip import views
+from chromewhip.batch import RenderRequest
+from chromewhip.filters import FilterMatcher
+from chromewhip.middleware import error_middleware
+from chromewhip.pool import TabPool
+from conftest import FakeChrome, FakeTab
+
+
+async def slow_render(request):
+    await views.acquire_tab(request, 1024, 768)
+    await asyncio.sleep(10)
+
+
+async def get(pool, render, query):
+    async def handler(request):
+        return await views.render_within_timeout(request, render)
+
+    app = web.Application(middlewares=[error_middleware])
+    app['tab-pool'] = pool
+    app['max-timeout'] = views.MAX_TIMEOUT_S
+    app.router.add_get('/render', handler)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try:
+        resp = await client.get('/render', params=query)
+        return resp.status, json.loads(await resp.text())
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_render_exceeding_timeout_stops_loading_and_hands_back_tab():
+    chrome = FakeChrome()
+    pool = TabPool(chrome, size=1)
+    status, body = await get(pool, slow_render, {'timeout': '0.1'})
+    assert status == 504
+    assert body['type'] == 'GlobalTimeoutError' and body['info'] == {'timeout': 0.1}
+    tab, = pool.tabs
+    assert tab.calls == ['enable_page_events', 'stop_loading', ('go', 'about:blank'), 'disable_page_events']
+    assert pool.idle == 1
+
+
+@pytest.mark.asyncio
+async def test_tab_failing_to_reset_after_timeout_is_replaced():
+    chrome = FakeChrome()
+    pool = TabPool(chrome, size=1)
+
+    async def stop_loading():
+        raise views.ChromewhipException('tab crashed')
+
+    async def render(request):
+        tab = await views.acquire_tab(request, 1024, 768)
+        tab.stop_loading = stop_loading
+        await asyncio.sleep(10)
+
+    status, _ = await get(pool, render, {'timeout': '0.1'})
+    assert status == 504
+    await asyncio.sleep(0.01)
+    assert [t.name for t in chrome.closed] == ['tab-1']
+    assert [t.name for t in pool.tabs] == ['tab-2'] and pool.idle == 1
+
+
+@pytest.mark.asyncio
+async def test_unbounded_wait_for_is_capped_at_time_left_of_render():
+    async def render(request):
+        tab = await views.acquire_tab(request, 1024, 768)
+        await views._wait_until_ready(request, tab, None, float(request.query.get('wait', 0)))
+        return web.json_response(tab.calls[-1])
+
+    _, call = await get(TabPool(FakeChrome(), size=1), render, {'wait_for': '#content', 'timeout': '2'})
+    assert call[:2] == ['wait_for_selector', '#content'] and 1.5 < call[2] <= 2
+    _, call = await get(TabPool(FakeChrome(), size=1), render, {'wait_for': '#content', 'wait': '5', 'timeout': '2'})
+    assert 1.5 < call[2] <= 2
+
+
+class StoppedVirtualTime:
+
+    def stop(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_virtual_time_render_leaves_pool_at_full_size():
+    chrome = FakeChrome()
+    pool = TabPool(chrome, size=1)
+
+    async def render(request):
+        await views.acquire_tab(request, 1024, 768)
+        request['chromewhip-virtual-time'] = StoppedVirtualTime()
+        return web.json_response({})
+
+    status, _ = await get(pool, render, {})
+    assert status == 200
+    await asyncio.sleep(0.01)
+    assert [t.name for t in chrome.closed] == ['tab-1']
+    assert [t.name for t in pool.tabs] == ['tab-2'] and pool.idle == 1
+
+
+@pytest.mark.asyncio
+async def test_native_blocking_enables_network_for_the_render():
+    app = {'filters': {'ads': FilterMatcher.from_lines(['||ads.com^'])}, 'resource-cache': None}
+    request = RenderRequest(app, '/render.html', {'url': 'http://a.com/', 'filters': 'ads'})
+    tab = FakeTab()
+    await views._setup_interception(request, tab, 'http://a.com/')
+    assert tab.blocked_urls and tab.domains.is_enabled('Network')
+    await views._reset_tab(request, tab)
+    assert tab.sent == ['Network.enable', 'Network.disable']
+
+
+@pytest.mark.asyncio
+async def test_cancelled_render_replaces_its_tab():
+    chrome = FakeChrome()
+    pool = TabPool(chrome, size=1)
+    request = RenderRequest({'tab-pool': pool, 'max-timeout': views.MAX_TIMEOUT_S}, '/render.html', {})
+    rendering = asyncio.ensure_future(views.render_within_timeout(request, slow_render))
+    await asyncio.sleep(0.01)
+    rendering.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await rendering
+    await asyncio.sleep(0.01)
+    assert [t.name for t in chrome.closed] == ['tab-1']
+    assert [t.name for t in pool.tabs] == ['tab-2'] and pool.idle == 1